@@ -1,4 +1,6 @@
 # coding: utf-8
+import json
+
 import requests
 
 from django.test import RequestFactory
@@ -174,6 +176,29 @@ class TestDataViewSet(TestBase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data), 1)
 
+    def test_data_with_cursor(self):
+        self._make_submissions()
+        view = DataViewSet.as_view({'get': 'list'})
+        formid = self.xform.pk
+        expected_ids = sorted(
+            self.xform.instances.values_list('pk', flat=True))
+
+        ids = []
+        url = '/?cursor=&limit=3'
+        while url:
+            request = self.factory.get(url, **self.extra)
+            response = view(request, pk=formid)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            page = json.loads(b''.join(response.streaming_content))
+            ids.extend(record['_id'] for record in page['results'])
+            url = page['next']
+        self.assertEqual(ids, expected_ids)
+        self.assertEqual(page['next_cursor'], None)
+
+        request = self.factory.get('/?cursor=&start=1', **self.extra)
+        response = view(request, pk=formid)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_anon_data_list(self):
         self._make_submissions()
         view = DataViewSet.as_view({'get': 'list'})
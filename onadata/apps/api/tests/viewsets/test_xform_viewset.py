@@ -440,3 +440,22 @@ class TestXFormViewSet(TestAbstractViewSet):
         self.assertTrue('Names must begin with a letter' in response.content.decode())
         self.assertEqual(response.status_code, 400)
         self.assertEqual(XForm.objects.count(), count)
+
+    def test_form_stats(self):
+        self.publish_xls_form()
+        self._make_submissions()
+        view = XFormViewSet.as_view({'get': 'stats'})
+        request = self.factory.get('/', data={
+            'numeric': 'available_transportation_types_to_referral_facility',
+            'group_by': '_submission_time',
+        }, **self.extra)
+        response = view(request, pk=self.xform.pk)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sum(group['count'] for group in
+                response.data['groups']['_submission_time']),
+            self.xform.instances.count())
+
+        request = self.factory.get('/', data={'bins': 0}, **self.extra)
+        response = view(request, pk=self.xform.pk)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,9 +1,9 @@
 # coding: utf-8
 import json
 
-from django.db.models import Q
+from django.db.models import Min, Q
 from django.db.models.signals import pre_delete
-from django.http import Http404
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import six
 from django.utils.translation import ugettext as _
@@ -15,14 +15,18 @@ from rest_framework.viewsets import ModelViewSet
 from rest_framework.exceptions import ParseError, PermissionDenied
 from rest_framework.serializers import ValidationError
 from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.utils.urls import replace_query_param
 
 from onadata.apps.api.exceptions import NoConfirmationProvidedException
+from onadata.apps.api.mongo_helper import MongoHelper
 from onadata.apps.api.viewsets.xform_viewset import custom_response_handler
 from onadata.apps.api.tools import add_tags_to_instance, \
     add_validation_status_to_instance, get_validation_status, \
     remove_validation_status_from_instance
 from onadata.apps.logger.models.xform import XForm
 from onadata.apps.logger.models.instance import Instance
+from onadata.apps.logger.models.submission_change import SubmissionChange
 from onadata.apps.viewer.models.parsed_instance import _remove_from_mongo, ParsedInstance
 from onadata.libs.renderers import renderers
 from onadata.libs.mixins.anonymous_user_public_forms_mixin import (
@@ -139,6 +143,29 @@ Provides a list of json submitted data for a specific form.
 >            }
 >        ]
 
+## Page through the submitted data of a specific form
+
+Large forms can be read page by page, with constant memory and latency per
+page, by adding the `cursor` parameter; leave it empty to get the first page.
+Submissions are returned in `_id` order, `limit` (default 1000) at a time,
+and the response gives the `next_cursor` token, and the `next` URL, of the
+following page; both are `null` on the last page. `query` and `fields` can be
+used as usual, but not `start`, `sort` or `count`.
+
+<pre class="prettyprint">
+<b>GET</b> /api/v1/data/<code>{pk}</code>?cursor=<code>{next_cursor}</code></pre>
+> Example
+>
+>       curl -X GET https://example.com/api/v1/data/22845?cursor=&limit=2
+
+> Response
+>
+>        {
+>            "results": [{"_id": 4503, ...}, {"_id": 4504, ...}],
+>            "next_cursor": "4504",
+>            "next": "https://example.com/api/v1/data/22845?cursor=4504&limit=2"
+>        }
+
 ## Get a single data submission for a given form
 
 Get a single specific submission json data providing `pk`
@@ -432,8 +459,12 @@ Delete a specific submission in a form
         postgres_query, mongo_query = self.__build_db_queries(xform, payload)
 
         # Update Postgres & Mongo
-        updated_records_count = Instance.objects.\
-            filter(**postgres_query).update(validation_status=new_validation_status)
+        instances = Instance.objects.filter(**postgres_query)
+        # `update()` sends no signal; log the change for incremental exports
+        SubmissionChange.log(
+            xform.pk, instances.aggregate(Min('pk'))['pk__min'])
+        updated_records_count = instances.update(
+            validation_status=new_validation_status)
         ParsedInstance.bulk_update_validation_statuses(mongo_query,
                                                        new_validation_status)
         return Response({
@@ -638,6 +669,9 @@ Delete a specific submission in a form
         query = request.GET.get("query", {})
         export_type = kwargs.get('format')
         if export_type is None or export_type in ['json']:
+            if 'cursor' in request.query_params:
+                return self.__stream_page(request, xform)
+
             # perform default viewset retrieve, no data export
 
             # With DRF ListSerializer are automatically created and wraps
@@ -649,6 +683,64 @@ Delete a specific submission in a form
 
         return custom_response_handler(request, xform, query, export_type)
 
+    @staticmethod
+    def __stream_page(request, xform):
+        """
+        Stream one page of submissions, in `_id` order, as a JSON object
+        with their list in `results`, and the `next_cursor` token and `next`
+        URL of the following page.
+        """
+        query_params = request.query_params
+        for param in ('start', 'sort', 'count'):
+            if param in query_params:
+                raise ParseError(_("`%(param)s` can't be used with `cursor`")
+                                 % {'param': param})
+        try:
+            cursor = query_params['cursor']
+            last_id = int(cursor) if cursor else None
+            limit = int(query_params.get('limit',
+                                         ParsedInstance.DEFAULT_BATCHSIZE))
+        except ValueError:
+            raise ParseError(_("Invalid cursor or limit"))
+
+        query = ParsedInstance.get_base_query(xform.user.username,
+                                              xform.id_string)
+        try:
+            query.update(json.loads(query_params.get('query', '{}')))
+        except ValueError:
+            raise ParseError(_("Invalid query: %(query)s"
+                             % {'query': query_params.get('query')}))
+
+        try:
+            records = ParsedInstance.query_mongo_keyset(
+                query=json.dumps(query), fields=query_params.get('fields'),
+                last_id=last_id, limit=limit)
+        except ValueError as e:
+            raise ParseError(str(e))
+
+        def stream():
+            yield '{"results": ['
+            count = 0
+            next_id = last_id
+            for record in records:
+                record = MongoHelper.to_readable_dict(record)
+                yield (',' if count else '') + json.dumps(
+                    record, cls=JSONEncoder)
+                count += 1
+                next_id = record.get('_id', next_id)
+
+            # A short page is the last one
+            next_cursor = next_url = None
+            if count == min(limit, ParsedInstance.DEFAULT_LIMIT):
+                next_cursor = str(next_id)
+                next_url = replace_query_param(
+                    request.build_absolute_uri(), 'cursor', next_cursor)
+            yield '], "next_cursor": {}, "next": {}}}'.format(
+                json.dumps(next_cursor), json.dumps(next_url))
+
+        return StreamingHttpResponse(stream(),
+                                     content_type='application/json')
+
     @staticmethod
     def __get_payload(request):
         try:
@@ -22,6 +22,11 @@ from onadata.apps.api.permissions import XFormPermissions
 from onadata.apps.logger.models.xform import XForm
 from onadata.apps.viewer.models.export import Export
 from onadata.libs import filters
+from onadata.libs.data.statistics import (
+    DEFAULT_BINS,
+    MAX_BINS,
+    get_form_statistics,
+)
 from onadata.libs.exceptions import NoRecordsFoundError
 from onadata.libs.mixins.anonymous_user_public_forms_mixin import (
     AnonymousUserPublicFormsMixin)
@@ -31,6 +36,7 @@ from onadata.libs.serializers.xform_serializer import XFormSerializer
 from onadata.libs.utils import log
 from onadata.libs.utils.common_tags import SUBMISSION_TIME
 from onadata.libs.utils.csv_import import submit_csv
+from onadata.libs.utils.export_cache import generate_cached_export
 from onadata.libs.utils.export_tools import generate_export, \
     should_create_new_export
 from onadata.libs.utils.export_tools import newset_export_for
@@ -100,10 +106,15 @@ def _generate_new_export(request, xform, query, export_type):
     extension = _get_extension_from_export_type(export_type)
 
     try:
-        export = generate_export(
-            export_type, extension, xform.user.username,
-            xform.id_string, None, query
-        )
+        if query is None:
+            export = generate_export(
+                export_type, extension, xform.user.username,
+                xform.id_string, None, query
+            )
+        else:
+            # filtered exports are not saved, but cached
+            export = generate_cached_export(
+                export_type, extension, xform, query)
         audit = {
             "xform": xform.id_string,
             "export_type": export_type
@@ -561,6 +572,43 @@ data (instance/submission per row)
 >           "additions": 9,
 >           "updates": 0
 >       }
+
+## Get form statistics
+
+Mean, median, standard deviation, minimum, maximum, percentiles and histogram
+of numeric fields, and number of submissions by value of other fields; dates
+are grouped by day. Statistics are cached until a submission is added,
+edited or deleted.
+
+Where:
+
+- `numeric` - comma separated numeric fields, defaults to the integer and
+decimal questions
+- `group_by` - comma separated fields to count submissions by, defaults to
+the select one and date questions and `_submission_time`
+- `bins` - number of bins of the histograms, defaults to 10
+
+<pre class="prettyprint">
+<b>GET</b> /api/v1/forms/<code>{pk}</code>/stats
+</pre>
+
+> Example
+>
+>       curl -X GET https://example.com/api/v1/forms/123/stats?numeric=age\
+&group_by=gender
+>
+> Response
+>
+>        HTTP 200 OK
+>       {
+>           "numeric": {
+>               "age": {"count": 3, "mean": 27.0, "median": 23.0, ...}
+>           },
+>           "groups": {
+>               "gender": [{"value": "female", "count": 2}, ...]
+>           },
+>           ...
+>       }
 """
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES + [
         renderers.XLSRenderer,
@@ -669,3 +717,31 @@ data (instance/submission per row)
             data=resp,
             status=status.HTTP_200_OK if resp.get('error') is None else
             status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['GET'])
+    def stats(self, request, *args, **kwargs):
+        """
+        Statistics of the submissions of the form; see
+        :py:func:`onadata.libs.data.statistics.get_form_statistics`
+        """
+        def get_fields(param):
+            fields = request.query_params.get(param)
+            if fields is None:
+                return None
+            return [field.strip() for field in fields.split(',')
+                    if field.strip()]
+
+        try:
+            bins = int(request.query_params.get('bins', DEFAULT_BINS))
+        except ValueError:
+            bins = 0
+        if not 0 < bins <= MAX_BINS:
+            raise exceptions.ParseError(
+                detail=_("`bins` must be between 1 and %s") % MAX_BINS)
+
+        return Response(get_form_statistics(
+            self.get_object(),
+            numeric_fields=get_fields('numeric'),
+            group_fields=get_fields('group_by'),
+            bins=bins,
+        ))
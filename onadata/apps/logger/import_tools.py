@@ -4,10 +4,11 @@ import shutil
 import tempfile
 import zipfile
 
+from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
 
 from onadata.apps.logger.xform_fs import XFormInstanceFS
-from onadata.libs.utils.logger_tools import create_instance
+from onadata.libs.utils.logger_tools import create_instances
 
 # odk
 # ├── forms
@@ -42,22 +43,36 @@ def django_file(path, field_name, content_type):
     )
 
 
-def iterate_through_instances(dirpath, callback):
+def iterate_through_instances(dirpath, callback, batch_size):
+    """
+    `callback` receives lists of up to `batch_size` XFormInstanceFS objects
+    and returns one `(instance, error)` pair for each of them.
+    """
     total_file_count = 0
     success_count = 0
     errors = []
 
+    def process(batch):
+        success = 0
+        for xfxs, (instance, error) in zip(batch, callback(batch)):
+            if error is not None:
+                errors.append("%s => %s" % (xfxs.filename, str(error)))
+            elif instance:
+                success += 1
+        return success
+
+    batch = []
     for directory, subdirs, subfiles in os.walk(dirpath):
         for filename in subfiles:
             filepath = os.path.join(directory, filename)
             if XFormInstanceFS.is_valid_instance(filepath):
-                xfxs = XFormInstanceFS(filepath)
-                try:
-                    success_count += callback(xfxs)
-                except Exception as e:
-                    errors.append("%s => %s" % (xfxs.filename, str(e)))
-                del xfxs
+                batch.append(XFormInstanceFS(filepath))
                 total_file_count += 1
+                if len(batch) == batch_size:
+                    success_count += process(batch)
+                    batch = []
+    if batch:
+        success_count += process(batch)
 
     return total_file_count, success_count, errors
 
@@ -78,31 +93,32 @@ def import_instances_from_zip(zipfile_path, user, status="zip"):
 
 
 def import_instances_from_path(path, user, status="zip"):
-    def callback(xform_fs):
+    def callback(xform_fs_batch):
         """
-        This callback is passed an instance of a XFormInstanceFS.
+        This callback is passed a list of XFormInstanceFS instances.
         See xform_fs.py for more info.
         """
-        with django_file(xform_fs.path, field_name="xml_file",
-                         content_type="text/xml") as xml_file:
-            images = [django_file(jpg, field_name="image",
-                      content_type="image/jpeg") for jpg in xform_fs.photos]
+        submissions = []
+        try:
+            for xform_fs in xform_fs_batch:
+                xml_file = django_file(xform_fs.path, field_name="xml_file",
+                                       content_type="text/xml")
+                images = [django_file(jpg, field_name="image",
+                          content_type="image/jpeg")
+                          for jpg in xform_fs.photos]
+                submissions.append((xml_file, images))
             # TODO: if an instance has been submitted make sure all the
             # files are in the database.
             # there shouldn't be any instances with a submitted status in the
             # import.
-            instance = create_instance(user.username, xml_file, images, status)
-
-            for i in images:
-                i.close()
-                i.close()
-
-            if instance:
-                return 1
-            else:
-                return 0
+            return create_instances(user.username, submissions, status)
+        finally:
+            for xml_file, images in submissions:
+                xml_file.close()
+                for i in images:
+                    i.close()
 
     total_count, success_count, errors = iterate_through_instances(
-        path, callback)
+        path, callback, settings.BULK_SUBMISSION_BATCH_SIZE)
 
     return total_count, success_count, errors
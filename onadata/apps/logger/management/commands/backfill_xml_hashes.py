@@ -0,0 +1,105 @@
+# coding: utf-8
+'''
+Django management command to populate `Instance.xml_hash` on large tables,
+by ranges of primary keys, hashing in parallel. Unlike
+`populate_xml_hashes_for_instances`, it can be throttled and resumed.
+
+:Example:
+    python manage.py backfill_xml_hashes --checkpoint-file /tmp/xml_hashes.json
+    python manage.py backfill_xml_hashes --workers 8 --max-rows-per-second 20000
+'''
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from onadata.libs.utils.xml_hash_backfill import backfill_xml_hashes
+
+
+class Command(BaseCommand):
+
+    help = 'Populates `Instance` objects with hashes, by ranges of primary ' \
+           'keys and in parallel'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--start-pk',
+            type=int,
+            help='First `Instance` primary key to consider. Defaults to the '
+                 'checkpoint, if any, or to the first `Instance` without '
+                 'a hash',
+        )
+        parser.add_argument(
+            '--end-pk',
+            type=int,
+            help='Last `Instance` primary key to consider',
+        )
+        parser.add_argument(
+            '--range-size',
+            type=int,
+            default=5000,
+            help='Number of primary keys read per query',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of `Instance` objects updated per query',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help='Number of processes computing hashes; 0 computes them in '
+                 'this process. Defaults to the number of CPUs',
+        )
+        parser.add_argument(
+            '--max-rows-per-second',
+            type=int,
+            help='Throttle the backfill to this many `Instance` objects per '
+                 'second',
+        )
+        parser.add_argument(
+            '--checkpoint-file',
+            help='File where the primary key to resume from is saved after '
+                 'each range, and read from on start',
+        )
+        parser.add_argument(
+            '--repopulate',
+            action='store_true',
+            help='Recalculate even `Instance` objects that already have '
+                 'hashes.',
+        )
+
+    def handle(self, *_, **options):
+        if connection.vendor != 'postgresql':
+            raise NotImplementedError(
+                'Only the PostgreSQL database backend is supported')
+
+        verbosity = options['verbosity']
+
+        def progress(stats):
+            if verbosity < 1:
+                return
+            self.stderr.write(
+                'Hashed {rows_hashed} `Instance`s ({rows_updated} updated), '
+                'next primary key {next_pk} of {end_pk}; {rate} per second, '
+                '{eta} remaining.'.format(
+                    rate=int(stats['rows_per_second']),
+                    eta=timedelta(seconds=int(stats['eta'])),
+                    **stats))
+
+        stats = backfill_xml_hashes(
+            start_pk=options['start_pk'],
+            end_pk=options['end_pk'],
+            range_size=options['range_size'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            max_rows_per_second=options['max_rows_per_second'],
+            repopulate=options['repopulate'],
+            checkpoint_file=options['checkpoint_file'],
+            progress_callback=progress,
+        )
+        self.stdout.write(
+            'Populated {} `Instance` hashes in {}.'.format(
+                stats['rows_updated'],
+                timedelta(seconds=int(stats['elapsed']))))
@@ -4,20 +4,25 @@
 from django.contrib.auth.models import User
 
 from django.core.management.base import BaseCommand, CommandError
-from django.core.files.storage import get_storage_class
-from django.conf import settings
 
 from onadata.apps.logger.models.attachment import Attachment
 from onadata.apps.logger.models.xform import XForm
-from onadata.libs.utils.image_tools import resize
+from onadata.libs.utils.image_tools import (
+    create_thumbnails,
+    get_thumbnails_manifest,
+    requeue_stale_thumbnails,
+)
 from onadata.libs.utils.model_tools import queryset_iterator
-from onadata.libs.utils.viewer_tools import get_path
 from django.utils.translation import ugettext as _, ugettext_lazy
 
 
 class Command(BaseCommand):
     help = ugettext_lazy("Creates thumbnails for "
-                         "all form images and stores them")
+                         "all form images and stores them. Thumbnails "
+                         "which already exist are recorded on their "
+                         "attachments, so they are served without querying "
+                         "the storage. Thumbnails pending for too long are "
+                         "queued again")
 
     def add_arguments(self, parser):
         parser.add_argument('-u', '--username',
@@ -26,13 +31,14 @@ class Command(BaseCommand):
         parser.add_argument('-i', '--id_string',
                             help=ugettext_lazy("id string of the form"))
 
-        parser.add_argument('-f', '--force', action='store_false',
+        parser.add_argument('-f', '--force', action='store_true',
                             help=ugettext_lazy("regenerate thumbnails if they "
                                                "exist."))
 
     def handle(self, *args, **kwargs):
-        attachments_qs = Attachment.objects.select_related(
-            'instance', 'instance__xform')
+        force = kwargs.get('force')
+        attachments_qs = Attachment.objects.filter(
+            mimetype__startswith='image').order_by('pk')
         if kwargs.get('username'):
             username = kwargs.get('username')
             try:
@@ -54,29 +60,37 @@ class Command(BaseCommand):
                 )
             attachments_qs = attachments_qs.filter(instance__xform=xform)
 
+        # Attachments are skipped here rather than filtered out of the
+        # queryset: `queryset_iterator()` pages with offsets, which must not
+        # shift while attachments get updated
         for att in queryset_iterator(attachments_qs):
+            if not force and att.thumbnails is not None and \
+                    att.thumbnails_status == Attachment.THUMBNAILS_CREATED:
+                continue
+            if not force and \
+                    att.thumbnails_status == Attachment.THUMBNAILS_PENDING:
+                # Leave the task alone, unless it is presumably lost
+                if requeue_stale_thumbnails(att):
+                    print(_('Thumbnails queued again for %(file)s')
+                          % {'file': att.media_file.name})
+                continue
             filename = att.media_file.name
-            default_storage = get_storage_class()()
-            full_path = get_path(filename,
-                                 settings.THUMB_CONF['small']['suffix'])
-            if kwargs.get('force') is not None:
-                for s in settings.THUMB_CONF.keys():
-                    fp = get_path(filename,
-                                  settings.THUMB_CONF[s]['suffix'])
-                    if default_storage.exists(fp):
-                        default_storage.delete(fp)
-
-            if not default_storage.exists(full_path):
-                try:
-                    resize(filename)
-                    if default_storage.exists(get_path(
-                            filename,
-                            '%s' % settings.THUMB_CONF['small']['suffix'])):
-                        print(_('Thumbnails created for %(file)s')
-                              % {'file': filename})
-                    else:
-                        print(_('Problem with the file %(file)s')
-                              % {'file': filename})
-                except (IOError, OSError) as e:
-                    print(_('Error on %(filename)s: %(error)s')
-                          % {'filename': filename, 'error': e})
+            if not force:
+                manifest = get_thumbnails_manifest(filename)
+                if manifest is not None:
+                    att.set_thumbnails(manifest)
+                    print(_('Thumbnails recorded for %(file)s')
+                          % {'file': filename})
+                    continue
+            try:
+                # Existing thumbnails are replaced
+                manifest = create_thumbnails(filename)
+            except Exception as e:
+                Attachment.objects.filter(pk=att.pk).update(
+                    thumbnails_status=Attachment.THUMBNAILS_FAILED)
+                print(_('Error on %(filename)s: %(error)s')
+                      % {'filename': filename, 'error': e})
+            else:
+                att.set_thumbnails(manifest)
+                print(_('Thumbnails created for %(file)s')
+                      % {'file': filename})
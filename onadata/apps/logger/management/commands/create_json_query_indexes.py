@@ -0,0 +1,67 @@
+# coding: utf-8
+'''
+Django management command to create the indexes the PostgreSQL backend of
+the data API needs, on deployments which use it; see
+`onadata.libs.utils.query_backends`. Indexes are created concurrently, so
+that submissions are still accepted meanwhile.
+
+:Example:
+    python manage.py create_json_query_indexes
+    python manage.py create_json_query_indexes --fields end today
+'''
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils.translation import ugettext_lazy
+
+from onadata.libs.utils.common_tags import SUBMISSION_TIME
+
+# Equality conditions, e.g. `{"field": "value"}`
+GIN_INDEX_SQL = '''
+CREATE INDEX CONCURRENTLY IF NOT EXISTS logger_instance_json_gin
+ON logger_instance USING GIN ((json::jsonb) jsonb_path_ops)
+'''
+
+# Sorts and ranges on a field of the submissions of a form
+FIELD_INDEX_SQL = '''
+CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}
+ON logger_instance (xform_id, (json::jsonb -> %s))
+'''
+
+
+class Command(BaseCommand):
+
+    help = ugettext_lazy("Creates the indexes of the PostgreSQL backend of "
+                         "the data API")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fields',
+            nargs='*',
+            default=[],
+            help=ugettext_lazy("Other fields of the submissions, which "
+                               "queries often sort on or compare, to index "
+                               "besides `_submission_time`"))
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise NotImplementedError(
+                'Only the PostgreSQL database backend is supported')
+
+        statements = [(GIN_INDEX_SQL, [])]
+        for field in [SUBMISSION_TIME] + options['fields']:
+            name = 'logger_instance_json_{}'.format(
+                re.sub(r'\W+', '_', field).strip('_').lower())
+            if len(name) > 63:
+                raise CommandError('`{}` is too long a field name to '
+                                   'index'.format(field))
+            statements.append((FIELD_INDEX_SQL.format(name=name), [field]))
+
+        # `CREATE INDEX CONCURRENTLY` cannot run inside a transaction
+        connection.set_autocommit(True)
+        with connection.cursor() as cursor:
+            for sql, params in statements:
+                cursor.execute(sql, params)
+                if options['verbosity'] > 0:
+                    self.stdout.write(' '.join(sql.split()))
@@ -2,10 +2,11 @@
 # vim: ai ts=4 sts=4 et sw=4 fileencoding=utf-8
 # coding: utf-8
 from django.core.management.base import BaseCommand
-from django.db.models import Q, Func
+from django.db.models import Q, Func, OuterRef, Subquery
 from django.utils.translation import ugettext as _, ugettext_lazy
 
 from onadata.apps.logger.models.attachment import Attachment
+from onadata.apps.logger.models.instance import Instance
 
 
 class SubstrFromPattern(Func):
@@ -15,8 +16,8 @@ class SubstrFromPattern(Func):
 
 class Command(BaseCommand):
 
-    help = ugettext_lazy("Updates indexed field `media_file_basename` "
-                         "which is empty or null")
+    help = ugettext_lazy("Updates indexed fields `media_file_basename` "
+                         "and `owner` which are empty or null")
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -27,21 +28,27 @@ class Command(BaseCommand):
 
     def handle(self, *args, **kwargs):
         batchsize = kwargs.get("batchsize")
-        stop = False
-        offset = 0
-        while stop is not True:
-            limit = offset + batchsize
+        last_id = 0
+        while True:
+            # Updated attachments do not match anymore, so paginate by id
+            # rather than by offset
             attachments_ids = list(Attachment.objects.values_list("id", flat=True)
-                                                     .filter(Q(media_file_basename=None) | Q(media_file_basename=""))
-                                                     .order_by("id")[offset:limit])
-            if attachments_ids:
-                self.stdout.write(_("Updating attachments from #{} to #{}\n").format(
-                    attachments_ids[0],
-                    attachments_ids[-1]))
-
-                Attachment.objects.filter(id__in=attachments_ids)\
-                    .update(media_file_basename=SubstrFromPattern("media_file", pattern="/([^/]+)$"))
-
-                offset += batchsize
-            else:
-                stop = True
+                                                     .filter(Q(media_file_basename=None) |
+                                                             Q(media_file_basename="") |
+                                                             Q(owner=None),
+                                                             id__gt=last_id)
+                                                     .order_by("id")[:batchsize])
+            if not attachments_ids:
+                break
+
+            self.stdout.write(_("Updating attachments from #{} to #{}\n").format(
+                attachments_ids[0],
+                attachments_ids[-1]))
+
+            owners = Instance.objects.filter(
+                pk=OuterRef('instance_id')).values('xform__user_id')[:1]
+            Attachment.objects.filter(id__in=attachments_ids)\
+                .update(media_file_basename=SubstrFromPattern("media_file", pattern="/([^/]+)$"),
+                        owner=Subquery(owners))
+
+            last_id = attachments_ids[-1]
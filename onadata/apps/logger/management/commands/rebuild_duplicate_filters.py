@@ -0,0 +1,45 @@
+# coding: utf-8
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import ugettext as _, ugettext_lazy
+
+from onadata.libs.utils.duplicate_filter import duplicate_filter
+
+
+class Command(BaseCommand):
+
+    help = ugettext_lazy("Rebuilds the Bloom filters of submissions used to "
+                         "detect duplicates, and prints their statistics")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--usernames',
+            nargs='+',
+            help=ugettext_lazy("Rebuild only the filters of these users"))
+        parser.add_argument(
+            '--stats-only',
+            action='store_true',
+            help=ugettext_lazy("Only print the statistics"))
+
+    def handle(self, *args, **kwargs):
+        if not settings.DUPLICATE_FILTER_ENABLED:
+            raise CommandError(_("DUPLICATE_FILTER_ENABLED is not set"))
+
+        if not kwargs['stats_only']:
+            users = User.objects.filter(xforms__instances__isnull=False)
+            if kwargs['usernames']:
+                users = users.filter(username__in=kwargs['usernames'])
+            for user_id, username in users.distinct().values_list(
+                    'pk', 'username').iterator():
+                if duplicate_filter.rebuild(user_id):
+                    self.stdout.write(_("Rebuilt the filter of {}").format(
+                        username))
+                else:
+                    self.stdout.write(_(
+                        "Some submissions of {} have no hash; run the "
+                        "`backfill_xml_hashes` command first").format(
+                            username))
+
+        for name, value in sorted(duplicate_filter.get_stats().items()):
+            self.stdout.write('{}: {}'.format(name, value))
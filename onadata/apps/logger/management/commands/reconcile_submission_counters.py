@@ -0,0 +1,77 @@
+# coding: utf-8
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max, Sum
+from django.utils.translation import ugettext_lazy
+
+from onadata.apps.logger.models import XForm
+from onadata.libs.utils.submission_counter_buffer import \
+    submission_counter_buffer
+
+
+class Command(BaseCommand):
+    help = ugettext_lazy(
+        "Flush the buffered submission counters, then recompute the number "
+        "of submissions and the time of the last submission of each form, "
+        "and the number of submissions of each user, from the submissions "
+        "themselves. Monthly submission counters are left alone since they "
+        "are never decreased when submissions are deleted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--usernames',
+            nargs='+',
+            help=ugettext_lazy("Space-delimited list of usernames whose "
+                               "counters should be reconciled. Defaults to "
+                               "every user."))
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        submission_counter_buffer.flush()
+
+        xforms = XForm.objects.all()
+        users = User.objects.all()
+        if options['usernames']:
+            xforms = xforms.filter(user__username__in=options['usernames'])
+            users = users.filter(username__in=options['usernames'])
+
+        xforms_fixed = 0
+        xforms = xforms.annotate(
+            instance_count=Count('instances'),
+            last_instance_time=Max('instances__date_created'),
+        ).only('pk', 'num_of_submissions', 'last_submission_time')
+        for xform in xforms.iterator():
+            if (xform.num_of_submissions == xform.instance_count and
+                    xform.last_submission_time == xform.last_instance_time):
+                continue
+            if verbosity > 1:
+                self.stdout.write('Form {}: {} submissions instead of {}'.format(
+                    xform.pk, xform.instance_count, xform.num_of_submissions))
+            XForm.objects.filter(pk=xform.pk).update(
+                num_of_submissions=xform.instance_count,
+                last_submission_time=xform.last_instance_time,
+            )
+            xforms_fixed += 1
+
+        profiles_fixed = 0
+        # Hack to avoid circular imports
+        UserProfile = User.profile.related.related_model
+        submission_counts = dict(
+            XForm.objects.filter(user__in=users).values('user_id').annotate(
+                count=Sum('num_of_submissions')
+            ).values_list('user_id', 'count'))
+        profiles = UserProfile.objects.filter(user__in=users).only(
+            'pk', 'user_id', 'num_of_submissions')
+        for profile in profiles.iterator():
+            count = submission_counts.get(profile.user_id) or 0
+            if profile.num_of_submissions == count:
+                continue
+            if verbosity > 1:
+                self.stdout.write('User {}: {} submissions instead of {}'.format(
+                    profile.user_id, count, profile.num_of_submissions))
+            UserProfile.objects.filter(pk=profile.pk).update(
+                num_of_submissions=count)
+            profiles_fixed += 1
+
+        self.stdout.write('Reconciled {} forms and {} users'.format(
+            xforms_fixed, profiles_fixed))
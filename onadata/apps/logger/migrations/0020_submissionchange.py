@@ -0,0 +1,24 @@
+# coding: utf-8
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0019_purge_deleted_instances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('xform_id', models.IntegerField()),
+                ('instance_id', models.IntegerField()),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'index_together': {('xform_id', 'date_created')},
+            },
+        ),
+    ]
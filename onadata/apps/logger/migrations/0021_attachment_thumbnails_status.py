@@ -0,0 +1,17 @@
+# coding: utf-8
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0020_submissionchange'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='thumbnails_status',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+    ]
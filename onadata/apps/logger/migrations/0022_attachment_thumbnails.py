@@ -0,0 +1,18 @@
+# coding: utf-8
+import jsonfield.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0021_attachment_thumbnails_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='thumbnails',
+            field=jsonfield.fields.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# coding: utf-8
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('logger', '0022_attachment_thumbnails'),
+    ]
+
+    # Existing attachments are populated by the `populate_media_file_basename`
+    # management command
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='owner',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterIndexTogether(
+            name='attachment',
+            index_together={('owner', 'media_file_basename')},
+        ),
+    ]
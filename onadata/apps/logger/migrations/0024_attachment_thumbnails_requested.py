@@ -0,0 +1,19 @@
+# coding: utf-8
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0023_attachment_owner'),
+    ]
+
+    # Thumbnails left pending before this field existed are queued again the
+    # next time they are needed
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='thumbnails_requested',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
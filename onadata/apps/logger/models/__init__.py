@@ -5,3 +5,4 @@ from onadata.apps.logger.models.survey_type import SurveyType
 from onadata.apps.logger.models.xform import XForm
 from onadata.apps.logger.xform_instance_parser import InstanceParseError
 from onadata.apps.logger.models.note import Note
+from onadata.apps.logger.models.submission_change import SubmissionChange
@@ -4,8 +4,10 @@ import os
 from hashlib import md5
 
 from django.conf import settings
+from django.contrib.auth.models import User
 from django.db import models
 from django.utils.http import urlencode
+from jsonfield import JSONField
 
 from .instance import Instance
 
@@ -31,20 +33,42 @@ def hash_attachment_contents(contents):
 
 
 class Attachment(models.Model):
+    # See `thumbnails_status`
+    THUMBNAILS_PENDING = 0
+    THUMBNAILS_CREATED = 1
+    THUMBNAILS_FAILED = 2
+
     instance = models.ForeignKey(Instance, related_name="attachments", on_delete=models.CASCADE)
     media_file = models.FileField(upload_to=upload_to, max_length=380, db_index=True)
     media_file_basename = models.CharField(
         max_length=260, null=True, blank=True, db_index=True)
+    # Owner of the form, so that the media redirector finds attachments by
+    # owner and file name without joining instances and forms
+    owner = models.ForeignKey(User, null=True, blank=True, related_name='+',
+                              db_index=False, on_delete=models.CASCADE)
     # `PositiveIntegerField` will only accomodate 2 GiB, so we should consider
     # `PositiveBigIntegerField` after upgrading to Django 3.1+
     media_file_size = models.PositiveIntegerField(blank=True, null=True)
     mimetype = models.CharField(
         max_length=100, null=False, blank=True, default='')
+    # Set by the `create_attachment_thumbnails` task; `None` for attachments
+    # saved before it existed
+    thumbnails_status = models.SmallIntegerField(null=True, blank=True)
+    # When the `create_attachment_thumbnails` task was last queued, to queue
+    # it again if the thumbnails stay pending for too long
+    thumbnails_requested = models.DateTimeField(null=True, blank=True)
+    # Manifest of the created thumbnails, by size, e.g.
+    # `{'small': {'key': <path in the storage>, 'size': <bytes>}, ...}`, so
+    # that serving them does not query the storage
+    thumbnails = JSONField(null=True, blank=True)
 
     class Meta:
         app_label = 'logger'
+        index_together = (('owner', 'media_file_basename'),)
 
     def save(self, *args, **kwargs):
+        if self.owner_id is None and self.instance.xform_id is not None:
+            self.owner_id = self.instance.xform.user_id
         if self.media_file:
             self.media_file_basename = self.filename
             if self.mimetype == '':
@@ -58,6 +82,17 @@ class Attachment(models.Model):
 
         super().save(*args, **kwargs)
 
+    def set_thumbnails(self, manifest):
+        """
+        Record the thumbnails created for this attachment, without going
+        through `save()`, which queries the storage for the file size
+        """
+        self.thumbnails_status = self.THUMBNAILS_CREATED
+        self.thumbnails = manifest
+        Attachment.objects.filter(pk=self.pk).update(
+            thumbnails_status=self.thumbnails_status,
+            thumbnails=self.thumbnails)
+
     @property
     def file_hash(self):
         if self.media_file.storage.exists(self.media_file.name):
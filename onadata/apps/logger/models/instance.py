@@ -3,6 +3,7 @@ from datetime import date, datetime
 from hashlib import sha256
 
 import reversion
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.gis.db import models
 from django.contrib.gis.geos import GeometryCollection, Point
@@ -19,9 +20,9 @@ from onadata.apps.logger.exceptions import FormInactiveError
 from onadata.apps.logger.fields import LazyDefaultBooleanField
 from onadata.apps.logger.models.survey_type import SurveyType
 from onadata.apps.logger.models.xform import XForm
+from onadata.apps.logger.models.submission_change import SubmissionChange
 from onadata.apps.logger.models.submission_counter import SubmissionCounter
-from onadata.apps.logger.xform_instance_parser import XFormInstanceParser, \
-    clean_and_parse_xml, get_uuid_from_xml
+from onadata.apps.logger.xform_instance_parser import ParsedSubmission
 from onadata.libs.utils.common_tags import (
     ATTACHMENTS,
     GEOLOCATION,
@@ -34,31 +35,16 @@ from onadata.libs.utils.common_tags import (
     XFORM_ID_STRING,
     SUBMITTED_BY
 )
+from onadata.libs.utils.duplicate_filter import duplicate_filter
 from onadata.libs.utils.model_tools import set_uuid
+from onadata.libs.utils.submission_counter_buffer import \
+    submission_counter_buffer
 
 
 # need to establish id_string of the xform before we run get_dict since
 # we now rely on data dictionary to parse the xml
 def get_id_string_from_xml_str(xml_str):
-    xml_obj = clean_and_parse_xml(xml_str)
-    root_node = xml_obj.documentElement
-    id_string = root_node.getAttribute("id")
-
-    if len(id_string) == 0:
-        # may be hidden in submission/data/id_string
-        elems = root_node.getElementsByTagName('data')
-
-        for data in elems:
-            for child in data.childNodes:
-                id_string = data.childNodes[0].getAttribute('id')
-
-                if len(id_string) > 0:
-                    break
-
-            if len(id_string) > 0:
-                break
-
-    return id_string
+    return ParsedSubmission(xml_str).id_string
 
 
 def submission_time():
@@ -71,14 +57,22 @@ def update_xform_submission_count(sender, instance, created, **kwargs):
     # `defer_counting` is a Python-only attribute
     if getattr(instance, 'defer_counting', False):
         return
+    increment_xform_submission_count(instance.xform_id, instance.date_created)
+
+
+def increment_xform_submission_count(xform_id, last_submission_time, count=1):
+    if settings.SUBMISSION_COUNTER_BUFFER_ENABLED:
+        # The buffer also takes care of the user's counters
+        submission_counter_buffer.add(xform_id, count, last_submission_time)
+        return
     with transaction.atomic():
-        xform = XForm.objects.only('user_id').get(pk=instance.xform_id)
+        xform = XForm.objects.only('user_id').get(pk=xform_id)
         # Update with `F` expression instead of `select_for_update` to avoid
         # locks, which were mysteriously piling up during periods of high
         # traffic
-        XForm.objects.filter(pk=instance.xform_id).update(
-            num_of_submissions=F('num_of_submissions') + 1,
-            last_submission_time=instance.date_created,
+        XForm.objects.filter(pk=xform_id).update(
+            num_of_submissions=F('num_of_submissions') + count,
+            last_submission_time=last_submission_time,
         )
         # Hack to avoid circular imports
         UserProfile = User.profile.related.related_model
@@ -86,7 +80,7 @@ def update_xform_submission_count(sender, instance, created, **kwargs):
             user_id=xform.user_id
         )
         UserProfile.objects.filter(pk=profile.pk).update(
-            num_of_submissions=F('num_of_submissions') + 1,
+            num_of_submissions=F('num_of_submissions') + count,
         )
 
 
@@ -112,16 +106,43 @@ def nullify_exports_time_of_last_submission(sender, instance, **kwargs):
     f.update(time_of_last_submission=None)
 
 
+def log_submission_change(sender, instance, created=False, **kwargs):
+    """
+    Record edits and deletions, but not new submissions, for incremental
+    exports
+    """
+    if created:
+        return
+    SubmissionChange.log(instance.xform_id, instance.pk)
+
+
+def add_to_duplicate_filter(sender, instance, **kwargs):
+    """
+    Add new submissions, and edited ones since their hash changed, to the
+    Bloom filter of their owner
+    """
+    if not settings.DUPLICATE_FILTER_ENABLED or instance.xform_id is None:
+        return
+    duplicate_filter.add(instance.xform.user_id,
+                         [(instance.xml_hash, instance.uuid)])
+
+
 def update_user_submissions_counter(sender, instance, created, **kwargs):
     if not created:
         return
     if getattr(instance, 'defer_counting', False):
         return
+    increment_user_submissions_counter(instance.xform_id)
+
 
+def increment_user_submissions_counter(xform_id, count=1):
+    if settings.SUBMISSION_COUNTER_BUFFER_ENABLED:
+        # Already buffered by `increment_xform_submission_count()`
+        return
     # Querying the database this way because it's faster than querying
     # the instance model for the data
     user_id = XForm.objects.values_list('user_id', flat=True).get(
-        pk=instance.xform_id
+        pk=xform_id
     )
     today = date.today()
     first_day_of_month = today.replace(day=1)
@@ -131,10 +152,14 @@ def update_user_submissions_counter(sender, instance, created, **kwargs):
     if not queryset.exists():
         SubmissionCounter.objects.create(user_id=user_id)
 
-    queryset.update(count=F('count') + 1)
+    queryset.update(count=F('count') + count)
 
 
 def update_xform_submission_count_delete(sender, instance, **kwargs):
+    if settings.SUBMISSION_COUNTER_BUFFER_ENABLED:
+        if instance.xform_id is not None:
+            submission_counter_buffer.add(instance.xform_id, -1)
+        return
     try:
         xform = XForm.objects.select_for_update().get(pk=instance.xform.pk)
     except XForm.DoesNotExist:
@@ -227,18 +252,11 @@ class Instance(models.Model):
 
     def _set_geom(self):
         xform = self.xform
-        data_dictionary = xform.data_dictionary()
-        geo_xpaths = data_dictionary.geopoint_xpaths()
-        doc = self.get_dict()
-        points = []
+        geopoints = self.get_parsed_submission().get_geopoints(
+            xform.data_dictionary())
 
-        if len(geo_xpaths):
-            for xpath in geo_xpaths:
-                geometry = [float(s) for s in doc.get(xpath, '').split()]
-
-                if len(geometry):
-                    lat, lng = geometry[0:2]
-                    points.append(Point(lng, lat))
+        if geopoints is not None:
+            points = [Point(lng, lat) for lat, lng in geopoints]
 
             if not xform.instances_with_geopoints and len(points):
                 xform.instances_with_geopoints = True
@@ -265,16 +283,20 @@ class Instance(models.Model):
 
     def _set_parser(self):
         if not hasattr(self, "_parser"):
-            self._parser = XFormInstanceParser(
-                self.xml, self.xform.data_dictionary())
+            self._parser = self.get_parsed_submission().get_parser(
+                self.xform.data_dictionary())
 
     def _set_survey_type(self):
-        self.survey_type, created = \
-            SurveyType.objects.get_or_create(slug=self.get_root_node_name())
+        slug = self.get_root_node_name()
+        # `create_instances()` assigns the survey type up front for a whole
+        # batch of submissions
+        if self.survey_type_id is None or self.survey_type.slug != slug:
+            self.survey_type, created = \
+                SurveyType.objects.get_or_create(slug=slug)
 
     def _set_uuid(self):
         if self.xml and not self.uuid:
-            uuid = get_uuid_from_xml(self.xml)
+            uuid = self.get_parsed_submission().uuid
             if uuid is not None:
                 self.uuid = uuid
         set_uuid(self)
@@ -379,6 +401,18 @@ class Instance(models.Model):
     def get_notes(self):
         return [note['note'] for note in self.notes.values('note')]
 
+    def get_parsed_submission(self):
+        """
+        Return the `ParsedSubmission` of `self.xml`. `create_instance()`
+        hands over the one it built at ingest through the Python-only
+        `parsed_submission` attribute, so the XML is not parsed again.
+        """
+        parsed_submission = getattr(self, 'parsed_submission', None)
+        if parsed_submission is None or parsed_submission.xml != self.xml:
+            parsed_submission = ParsedSubmission(self.xml)
+            self.parsed_submission = parsed_submission
+        return parsed_submission
+
     def get_root_node(self):
         self._set_parser()
         return self._parser.get_root_node()
@@ -408,7 +442,14 @@ class Instance(models.Model):
 
     def save(self, *args, **kwargs):
         force = kwargs.pop("force", False)
+        self._prepare_for_save(force)
+        super().save(*args, **kwargs)
 
+    def _prepare_for_save(self, force=False):
+        """
+        Derive every field that depends on `xml`. Called by `save()`, and
+        directly by `create_instances()`, which inserts in bulk.
+        """
         self._check_active(force)
 
         self._set_geom()
@@ -421,8 +462,6 @@ class Instance(models.Model):
         if self.validation_status is None:
             self.validation_status = {}
 
-        super().save(*args, **kwargs)
-
     def get_validation_status(self):
         """
         Returns instance validation status.
@@ -442,6 +481,15 @@ post_save.connect(update_xform_submission_count, sender=Instance,
 post_delete.connect(nullify_exports_time_of_last_submission, sender=Instance,
                     dispatch_uid='nullify_exports_time_of_last_submission')
 
+post_save.connect(log_submission_change, sender=Instance,
+                  dispatch_uid='log_submission_change')
+
+post_delete.connect(log_submission_change, sender=Instance,
+                    dispatch_uid='log_submission_change_delete')
+
+post_save.connect(add_to_duplicate_filter, sender=Instance,
+                  dispatch_uid='add_to_duplicate_filter')
+
 post_save.connect(update_user_submissions_counter, sender=Instance,
                   dispatch_uid='update_user_submissions_counter')
 
@@ -0,0 +1,49 @@
+# coding: utf-8
+from django.contrib.gis.db import models
+
+
+class SubmissionChange(models.Model):
+    """
+    Edits and deletions of the submissions of a form, which make incremental
+    exports rebuild from scratch; see
+    `onadata.libs.utils.incremental_export`
+    """
+    # Not a foreign key: deleting a form deletes its submissions first,
+    # which logs changes for a form about to disappear. They are deleted
+    # along with the form by `xform.delete_submission_changes()`
+    xform_id = models.IntegerField()
+    # lowest `Instance` pk touched by the change
+    instance_id = models.IntegerField()
+    date_created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        app_label = 'logger'
+        index_together = (('xform_id', 'date_created'),)
+
+    @classmethod
+    def log(cls, xform_id, instance_id):
+        if xform_id is None or instance_id is None:
+            return
+        cls.objects.create(xform_id=xform_id, instance_id=instance_id)
+
+    @classmethod
+    def touches(cls, xform_id, since, last_id):
+        """
+        Whether a submission whose pk is not greater than `last_id` was
+        edited or deleted since `since`
+        """
+        return cls.objects.filter(
+            xform_id=xform_id, date_created__gte=since,
+            instance_id__lte=last_id).exists()
+
+    @classmethod
+    def get_latest_id(cls, xform_id):
+        return cls.objects.filter(xform_id=xform_id).order_by(
+            '-pk').values_list('pk', flat=True).first()
+
+    @classmethod
+    def prune(cls, xform_id, before):
+        # The latest change is kept: it versions the submissions of the form,
+        # see `export_cache.get_submissions_version()`
+        cls.objects.filter(xform_id=xform_id, date_created__lt=before)\
+            .exclude(pk=cls.get_latest_id(xform_id)).delete()
@@ -22,6 +22,7 @@ from guardian.shortcuts import (
 from taggit.managers import TaggableManager
 
 from onadata.apps.logger.fields import LazyDefaultBooleanField
+from onadata.apps.logger.models.submission_change import SubmissionChange
 from onadata.apps.logger.xform_instance_parser import XLSFormError
 from onadata.koboform.pyxform_utils import convert_csv_to_xls
 from onadata.libs.constants import (
@@ -115,7 +116,7 @@ class XForm(BaseModel):
     def data_dictionary(self):
         from onadata.apps.viewer.models.data_dictionary import\
             DataDictionary
-        return DataDictionary.objects.get(pk=self.pk)
+        return DataDictionary.from_xform(self)
 
     @property
     def has_instances_with_geopoints(self):
@@ -292,6 +293,15 @@ post_delete.connect(update_profile_num_submissions, sender=XForm,
                     dispatch_uid='update_profile_num_submissions')
 
 
+def delete_submission_changes(sender, instance, **kwargs):
+    # `SubmissionChange` has no foreign key to cascade
+    SubmissionChange.objects.filter(xform_id=instance.pk).delete()
+
+
+post_delete.connect(delete_submission_changes, sender=XForm,
+                    dispatch_uid='delete_submission_changes')
+
+
 def set_object_permissions(sender, instance=None, created=False, **kwargs):
     if created:
         for perm in get_perms_for_model(XForm):
@@ -7,12 +7,38 @@ from io import BytesIO
 
 from celery import task, shared_task
 from dateutil import relativedelta
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.files.storage import get_storage_class
 from django.core.management import call_command
 
+from onadata.libs.utils.duplicate_filter import duplicate_filter
+from onadata.libs.utils.image_tools import create_thumbnails
+from onadata.libs.utils.submission_counter_buffer import \
+    submission_counter_buffer
 from .models.submission_counter import SubmissionCounter
-from .models import Instance, XForm
+from .models import Attachment, Instance, XForm
+
+
+@shared_task(soft_time_limit=120, time_limit=180)
+def create_attachment_thumbnails(attachment_id):
+    """
+    Create the thumbnails of an image attachment, off the request which
+    saved it; see `logger_tools.save_attachments()`
+    """
+    try:
+        attachment = Attachment.objects.get(pk=attachment_id)
+    except Attachment.DoesNotExist:
+        return
+    try:
+        manifest = create_thumbnails(attachment.media_file.name)
+    except Exception:
+        # Missing file, not an image Pillow can read, storage error, soft
+        # time limit... Anything left pending would be queued again forever
+        Attachment.objects.filter(pk=attachment_id).update(
+            thumbnails_status=Attachment.THUMBNAILS_FAILED)
+    else:
+        attachment.set_thumbnails(manifest)
 
 
 @task()
@@ -110,3 +136,30 @@ def generate_stats_zip(output_filename):
             csv_io.close()
 
         zip_file.close()
+
+
+@shared_task(soft_time_limit=60, time_limit=90)
+def flush_submission_counters():
+    if settings.SUBMISSION_COUNTER_BUFFER_ENABLED:
+        submission_counter_buffer.flush()
+
+
+@shared_task(soft_time_limit=1800, time_limit=2100)
+def rebuild_duplicate_filter(owner_id):
+    """
+    Build the Bloom filter of a user's submissions; see
+    `onadata.libs.utils.duplicate_filter`
+    """
+    duplicate_filter.rebuild(owner_id)
+
+
+@shared_task(bind=True, max_retries=720, default_retry_delay=10)
+def forget_duplicate_filter(self, owner_id):
+    """
+    Drop the Bloom filter of a user whose submissions could not be added to
+    it, once its store is available again
+    """
+    try:
+        duplicate_filter.forget(owner_id)
+    except duplicate_filter.store.errors as e:
+        raise self.retry(exc=e)
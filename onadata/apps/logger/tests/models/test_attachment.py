@@ -1,15 +1,21 @@
 # coding: utf-8
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from django.conf import settings
 from django.core.files.base import File
-from django.core.files.storage import default_storage
+from django.core.files.storage import default_storage, get_storage_class
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
+from django.utils import timezone
+from mock import patch
+from PIL import Image
 
 from onadata.apps.main.tests.test_base import TestBase
 from onadata.apps.logger.models import Attachment, Instance
-from onadata.libs.utils.image_tools import image_url
+from onadata.apps.logger.tasks import create_attachment_thumbnails
+from onadata.libs.utils.image_tools import create_thumbnails, image_url
+from onadata.libs.utils.logger_tools import save_attachments
 
 
 class TestAttachment(TestBase):
@@ -31,6 +37,13 @@ class TestAttachment(TestBase):
 
     def test_thumbnails(self):
         for attachment in Attachment.objects.filter(instance=self.instance):
+            # Thumbnails are never created inline: the original is returned
+            # while the task creates them
+            url = image_url(attachment, 'small')
+            self.assertEqual(url, attachment.media_file.url)
+            attachment.refresh_from_db()
+            self.assertEqual(attachment.thumbnails_status,
+                             Attachment.THUMBNAILS_CREATED)
             url = image_url(attachment, 'small')
             filename = attachment.media_file.name.replace('.jpg', '')
             thumbnail = '%s-small.jpg' % filename
@@ -42,6 +55,137 @@ class TestAttachment(TestBase):
                     default_storage.exists(thumbnail))
                 default_storage.delete(thumbnail)
 
+    def test_create_thumbnails(self):
+        thumbnails = create_thumbnails(self.attachment.media_file.name)
+        self.assertEqual(list(thumbnails), settings.THUMB_ORDER)
+        widths = []
+        for size in settings.THUMB_ORDER:
+            self.assertEqual(default_storage.size(thumbnails[size]['key']),
+                             thumbnails[size]['size'])
+            with default_storage.open(thumbnails[size]['key']) as thumbnail:
+                image = Image.open(thumbnail)
+                self.assertEqual(image.format, 'JPEG')
+                self.assertLessEqual(max(image.size),
+                                     settings.THUMB_CONF[size]['size'])
+                widths.append(image.size[0])
+            default_storage.delete(thumbnails[size]['key'])
+        self.assertEqual(widths, sorted(widths, reverse=True))
+
+    def test_recorded_thumbnails_are_not_looked_up(self):
+        create_attachment_thumbnails(self.attachment.pk)
+        self.attachment.refresh_from_db()
+        self.assertEqual(list(self.attachment.thumbnails),
+                         settings.THUMB_ORDER)
+        storage_class = get_storage_class()
+        with patch.object(storage_class, 'exists') as exists, \
+                patch.object(storage_class, 'size') as size:
+            url = image_url(self.attachment, 'small')
+        self.assertFalse(exists.called)
+        self.assertFalse(size.called)
+        self.assertTrue(url.endswith(
+            self.attachment.thumbnails['small']['key']))
+        for thumbnail in self.attachment.thumbnails.values():
+            default_storage.delete(thumbnail['key'])
+
+    def test_existing_thumbnails_are_recorded(self):
+        # Thumbnails created before the manifest existed
+        thumbnails = create_thumbnails(self.attachment.media_file.name)
+        self.assertIsNone(self.attachment.thumbnails_status)
+        url = image_url(self.attachment, 'small')
+        self.assertTrue(url.endswith(thumbnails['small']['key']))
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.thumbnails_status,
+                         Attachment.THUMBNAILS_CREATED)
+        self.assertEqual(self.attachment.thumbnails, thumbnails)
+        for thumbnail in thumbnails.values():
+            default_storage.delete(thumbnail['key'])
+
+    def test_legacy_thumbnails_are_queued_once(self):
+        with patch('onadata.apps.logger.tasks.create_attachment_thumbnails.'
+                   'delay') as delay:
+            image_url(self.attachment, 'small')
+            attachment = Attachment.objects.get(pk=self.attachment.pk)
+            self.assertEqual(attachment.thumbnails_status,
+                             Attachment.THUMBNAILS_PENDING)
+            # A view which loaded the attachment before it was claimed
+            self.attachment.refresh_from_db()
+            self.attachment.thumbnails_status = None
+            image_url(self.attachment, 'small')
+        delay.assert_called_once_with(self.attachment.pk)
+
+    def test_thumbnails_task_records_failures(self):
+        default_storage.delete(self.attachment.media_file.name)
+        create_attachment_thumbnails(self.attachment.pk)
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.thumbnails_status,
+                         Attachment.THUMBNAILS_FAILED)
+        self.assertEqual(image_url(self.attachment, 'small'),
+                         self.attachment.media_file.url)
+
+    def test_thumbnails_task_records_any_failure(self):
+        with patch('onadata.apps.logger.tasks.create_thumbnails',
+                   side_effect=ValueError('unexpected')):
+            create_attachment_thumbnails(self.attachment.pk)
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.thumbnails_status,
+                         Attachment.THUMBNAILS_FAILED)
+
+    def test_stale_pending_thumbnails_are_queued_again(self):
+        Attachment.objects.filter(pk=self.attachment.pk).update(
+            thumbnails_status=Attachment.THUMBNAILS_PENDING,
+            thumbnails_requested=timezone.now())
+        self.attachment.refresh_from_db()
+        with patch('onadata.apps.logger.tasks.create_attachment_thumbnails.'
+                   'delay') as delay:
+            image_url(self.attachment, 'small')
+            call_command('create_image_thumbnails')
+        self.assertFalse(delay.called)
+
+        Attachment.objects.filter(pk=self.attachment.pk).update(
+            thumbnails_requested=timezone.now() - timedelta(
+                minutes=settings.THUMBNAILS_PENDING_TIMEOUT + 1))
+        self.attachment.refresh_from_db()
+        self.assertEqual(image_url(self.attachment, 'small'),
+                         self.attachment.media_file.url)
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.thumbnails_status,
+                         Attachment.THUMBNAILS_CREATED)
+        for thumbnail in self.attachment.thumbnails.values():
+            default_storage.delete(thumbnail['key'])
+
+    def test_create_thumbnails_command_queues_stale_pending_thumbnails(self):
+        Attachment.objects.filter(pk=self.attachment.pk).update(
+            thumbnails_status=Attachment.THUMBNAILS_PENDING,
+            thumbnails_requested=None)
+        with patch('onadata.apps.logger.tasks.create_attachment_thumbnails.'
+                   'delay') as delay:
+            call_command('create_image_thumbnails')
+            # Only once
+            call_command('create_image_thumbnails')
+        delay.assert_called_once_with(self.attachment.pk)
+
+    def test_save_attachments_creates_thumbnails_on_commit(self):
+        media_file = os.path.join(
+            self.this_directory, 'fixtures', 'transportation', 'instances',
+            self.surveys[0], self.media_file)
+        with open(media_file, 'rb') as f:
+            upload = SimpleUploadedFile('other.jpg', f.read(),
+                                        content_type='image/jpeg')
+        with patch('django.db.transaction.on_commit') as on_commit:
+            save_attachments(self.instance, [upload])
+        attachment = Attachment.objects.get(media_file_basename='other.jpg')
+        self.assertEqual(attachment.thumbnails_status,
+                         Attachment.THUMBNAILS_PENDING)
+        self.assertIsNotNone(attachment.thumbnails_requested)
+        # pending thumbnails are not looked up in the storage
+        self.assertEqual(image_url(attachment, 'small'),
+                         attachment.media_file.url)
+
+        on_commit.call_args[0][0]()
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.thumbnails_status,
+                         Attachment.THUMBNAILS_CREATED)
+
     def test_create_thumbnails_command(self):
         call_command("create_image_thumbnails")
         created_times = {}
@@ -52,6 +196,11 @@ class TestAttachment(TestBase):
                 self.assertTrue(
                     default_storage.exists(thumbnail))
                 created_times[size] = default_storage.get_modified_time(thumbnail)
+        for attachment in Attachment.objects.filter(instance=self.instance):
+            self.assertEqual(attachment.thumbnails_status,
+                             Attachment.THUMBNAILS_CREATED)
+            self.assertEqual(list(attachment.thumbnails),
+                             settings.THUMB_ORDER)
         # replace or regenerate thumbnails if they exist
         call_command("create_image_thumbnails", force=True)
         for attachment in Attachment.objects.filter(instance=self.instance):
@@ -63,3 +212,24 @@ class TestAttachment(TestBase):
                 self.assertTrue(
                     default_storage.get_modified_time(thumbnail) > created_times[size])
                 default_storage.delete(thumbnail)
+
+    def test_create_thumbnails_command_records_existing_thumbnails(self):
+        thumbnails = create_thumbnails(self.attachment.media_file.name)
+        created_times = dict(
+            (size, default_storage.get_modified_time(thumbnail['key']))
+            for size, thumbnail in thumbnails.items())
+        with patch('onadata.apps.logger.management.commands.'
+                   'create_image_thumbnails.create_thumbnails',
+                   return_value={}) as create_thumbnails_mock:
+            call_command("create_image_thumbnails",
+                         id_string=self.xform.id_string)
+        # only the attachments without any thumbnails get them created
+        created = [call[0][0] for call in create_thumbnails_mock.call_args_list]
+        self.assertNotIn(self.attachment.media_file.name, created)
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.thumbnails, thumbnails)
+        for size, thumbnail in thumbnails.items():
+            self.assertEqual(
+                default_storage.get_modified_time(thumbnail['key']),
+                created_times[size])
+            default_storage.delete(thumbnail['key'])
@@ -4,7 +4,8 @@ import reversion
 import unittest
 
 from onadata.apps.main.tests.test_base import TestBase
-from onadata.apps.logger.models import XForm, Instance
+from onadata.apps.logger.models import XForm, Instance, SubmissionChange
+from onadata.apps.viewer.models.data_dictionary import DataDictionary
 
 
 class TestXForm(TestBase):
@@ -26,6 +27,14 @@ class TestXForm(TestBase):
         self.xform._set_title()
         self.assertIn(self.xform.title, self.xform.xml)
 
+    def test_deleting_form_deletes_submission_changes(self):
+        for model in (XForm, DataDictionary):
+            self._publish_transportation_form_and_submit_instance()
+            xform_id = self.xform.pk
+            model.objects.get(pk=xform_id).delete()
+            self.assertFalse(SubmissionChange.objects.filter(
+                xform_id=xform_id).exists())
+
     @unittest.skip('Fails under Django 1.6')
     def test_reversion(self):
         self.assertTrue(reversion.is_registered(XForm))
@@ -4,9 +4,10 @@ import os
 from django.core.files.storage import get_storage_class
 from django.urls import reverse
 from django.conf import settings
+from mock import patch
 
 from onadata.apps.main.tests.test_base import TestBase
-from onadata.apps.logger.models import Instance
+from onadata.apps.logger.models import Instance, XForm
 from onadata.apps.logger.import_tools import import_instances_from_zip
 from onadata.apps.logger.views import bulksubmission
 from onadata.libs.utils.storage import delete_user_storage
@@ -76,6 +77,44 @@ class TestImportingDatabase(TestBase):
         # by 1 (or 2) based on the b1 & b2 data sets
         self.assertEqual(instance_count, initial_instances_count + 2)
 
+    # Tests run inside a transaction which never commits, and batches only
+    # reach Mongo once theirs does
+    @patch('django.db.transaction.on_commit', side_effect=lambda func: func())
+    def test_importing_in_batches(self, on_commit):
+        zip_file_path = os.path.join(DB_FIXTURES_PATH, "bulk_submission.zip")
+        with self.settings(BULK_SUBMISSION_BATCH_SIZE=1):
+            one_by_one = import_instances_from_zip(zip_file_path, self.user)
+        instance_ids = set(Instance.objects.values_list('pk', flat=True))
+        Instance.objects.all().delete()
+
+        total, success, errors = import_instances_from_zip(
+            zip_file_path, self.user)
+        self.assertEqual((total, success, len(errors)),
+                         (one_by_one[0], one_by_one[1], len(one_by_one[2])))
+        self.assertEqual(Instance.objects.count(), len(instance_ids))
+        xform = XForm.objects.get()
+        self.assertEqual(xform.num_of_submissions, len(instance_ids))
+        for instance in Instance.objects.all():
+            self.assertTrue(instance.is_synced_with_mongo)
+            self.assertIsNotNone(instance.parsed_instance)
+
+    @patch('onadata.libs.utils.logger_tools.increment_user_submissions_counter',
+           side_effect=Exception('Bulk save failed'))
+    def test_failed_bulk_save_is_undone(self, increment):
+        import_instances_from_zip(os.path.join(
+            DB_FIXTURES_PATH, "bulk_submission.zip"), self.user)
+        # Submissions saved one at a time instead
+        self.assertTrue(increment.called)
+        self.assertEqual(Instance.objects.count(), 2)
+        images_count = 0
+        for instance in Instance.objects.all():
+            images_count += self._images_count(instance)
+        # The attachments stored by the failed attempt are deleted
+        self.assertEqual(images_count, 2)
+        # and the documents of its submissions never written
+        self.assertEqual(
+            settings.MONGO_DB.instances.count_documents(filter={}), 2)
+
     def test_badzipfile_import(self):
         total, success, errors = import_instances_from_zip(
             os.path.join(
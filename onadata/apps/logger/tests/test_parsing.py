@@ -3,12 +3,17 @@ import os
 import re
 from xml.dom import minidom
 
+from mock import patch
+
 from onadata.apps.main.tests.test_base import TestBase
 from onadata.apps.logger.xform_instance_parser import XFormInstanceParser,\
-    xpath_from_xml_node
+    xpath_from_xml_node, ParsedSubmission, PARSER_ENGINE_ITERPARSE,\
+    PARSER_ENGINE_MINIDOM
 from onadata.apps.logger.xform_instance_parser import get_uuid_from_xml,\
     get_meta_from_xml, get_deprecated_uuid_from_xml,\
-    _xml_node_to_dict, clean_and_parse_xml
+    get_submission_date_from_xml,\
+    _xml_node_to_dict, _xml_str_to_dict_iterparse, _get_all_attributes,\
+    clean_and_parse_xml
 from onadata.libs.utils.common_tags import XFORM_ID_STRING
 
 
@@ -187,3 +192,108 @@ class TestXFormInstanceParser(TestBase):
                 import json
                 jfile_content = jfile.read()
                 self.assertEqual(jfile_content.strip(), json.dumps(dict_).strip())
+
+    def test_iterparse_engine_matches_minidom(self):
+        self._publish_and_submit_new_repeats()
+        dd = self.xform.data_dictionary()
+        minidom_parser = XFormInstanceParser(
+            self.xml, dd, engine=PARSER_ENGINE_MINIDOM)
+        iterparse_parser = XFormInstanceParser(
+            self.xml, dd, engine=PARSER_ENGINE_ITERPARSE)
+        self.assertEqual(minidom_parser.to_dict(), iterparse_parser.to_dict())
+        self.assertEqual(minidom_parser.to_flat_dict(),
+                         iterparse_parser.to_flat_dict())
+        self.assertEqual(minidom_parser.get_attributes(),
+                         iterparse_parser.get_attributes())
+        self.assertEqual(minidom_parser.get_root_node_name(),
+                         iterparse_parser.get_root_node_name())
+        # A DOM is only built on demand
+        self.assertEqual(iterparse_parser.get_root_node().toxml(),
+                         minidom_parser.get_root_node().toxml())
+
+    def test_iterparse_xml_repeated_group_to_dict(self):
+        xml_file = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "../fixtures/repeated_group/repeated_group.xml"
+        )
+        with open(xml_file) as file:
+            xml_str = file.read()
+        root_node = clean_and_parse_xml(xml_str).documentElement
+        for repeats in ([], ['question_group']):
+            dict_, root_node_name, attributes = _xml_str_to_dict_iterparse(
+                xml_str, repeats)
+            self.assertEqual(dict_, _xml_node_to_dict(root_node, repeats))
+            self.assertEqual(root_node_name, root_node.nodeName)
+            self.assertEqual(attributes,
+                             list(_get_all_attributes(root_node)))
+
+    def test_iterparse_namespaces_comments_and_blank_nodes(self):
+        xml_str = (
+            '<?xml version="1.0" encoding="ISO-8859-1"?>'
+            '<data id="test" xmlns:orx="http://openrosa.org/xforms">'
+            '<name>Jos\u00e9</name><empty>   </empty>'
+            '<commented><!-- nothing --></commented>'
+            '<orx:meta><orx:instanceID>uuid:1</orx:instanceID></orx:meta>'
+            '</data>'
+        )
+        root_node = clean_and_parse_xml(xml_str).documentElement
+        dict_, root_node_name, attributes = _xml_str_to_dict_iterparse(
+            xml_str)
+        self.assertEqual(dict_, _xml_node_to_dict(root_node))
+        self.assertEqual(dict_, {
+            'data': {
+                'name': 'Jos\u00e9',
+                'orx:meta': {'orx:instanceID': 'uuid:1'},
+            }
+        })
+        self.assertEqual(attributes, list(_get_all_attributes(root_node)))
+
+    def test_parsed_submission_parses_xml_once(self):
+        with open(
+            os.path.join(
+                os.path.dirname(__file__), "..", "fixtures", "tutorial",
+                "instances", "tutorial_2012-06-27_11-27-53_w_uuid_edited.xml"),
+                "r") as xml_file:
+            xml_str = xml_file.read()
+        with patch(
+            'onadata.apps.logger.xform_instance_parser.clean_and_parse_xml',
+            wraps=clean_and_parse_xml
+        ) as mock_parse:
+            parsed_submission = ParsedSubmission(xml_str)
+            self.assertEqual(parsed_submission.uuid,
+                             "2d8c59eb-94e9-485d-a679-b28ffe2e9b98")
+            self.assertEqual(parsed_submission.deprecated_uuid,
+                             "729f173c688e482486a48661700455ff")
+            self.assertEqual(parsed_submission.id_string, "tutorial")
+            self.assertEqual(parsed_submission.root_node_name, "tutorial")
+            self.assertIsNone(parsed_submission.submission_date)
+            # No DOM is built
+            self.assertEqual(mock_parse.call_count, 0)
+
+    def test_parsed_submission_matches_dom_helpers(self):
+        this_directory = os.path.dirname(__file__)
+        for path in (
+            os.path.join(this_directory, "..", "fixtures", "tutorial",
+                         "instances",
+                         "tutorial_2012-06-27_11-27-53_w_uuid_edited.xml"),
+            os.path.join(this_directory, "..", "..", "..", "libs", "tests",
+                         "fixtures", "single.xml"),
+        ):
+            with open(path, "r") as xml_file:
+                xml_str = xml_file.read()
+            parsed_submission = ParsedSubmission(xml_str)
+            self.assertEqual(parsed_submission.uuid,
+                             get_uuid_from_xml(xml_str))
+            self.assertEqual(parsed_submission.deprecated_uuid,
+                             get_deprecated_uuid_from_xml(xml_str))
+            self.assertEqual(parsed_submission.submission_date,
+                             get_submission_date_from_xml(xml_str))
+            self.assertEqual(
+                parsed_submission.root_node_name,
+                clean_and_parse_xml(xml_str).documentElement.nodeName)
+
+        # The id string may be hidden in `submission/data`
+        parsed_submission = ParsedSubmission(
+            '<submission><data><id_string id="id_string">'
+            '<data>random</data></id_string></data></submission>')
+        self.assertEqual(parsed_submission.id_string, 'id_string')
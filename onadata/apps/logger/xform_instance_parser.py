@@ -2,17 +2,24 @@
 import logging
 import re
 import sys
+from io import BytesIO
 
 import dateutil.parser
 import six
+from django.conf import settings
 from django.utils.encoding import smart_str
 from django.utils.translation import ugettext as _
 from django.utils.six import text_type
+from lxml import etree
 from xml.dom import minidom, Node
 
 from onadata.libs.utils.common_tags import XFORM_ID_STRING
 
 
+PARSER_ENGINE_MINIDOM = 'minidom'
+PARSER_ENGINE_ITERPARSE = 'iterparse'
+
+
 class XLSFormError(Exception):
     pass
 
@@ -43,6 +50,10 @@ class InstanceMultipleNodeError(Exception):
 
 def get_meta_from_xml(xml_str, meta_name):
     xml = clean_and_parse_xml(xml_str)
+    return _get_meta_from_xml_obj(xml, meta_name)
+
+
+def _get_meta_from_xml_obj(xml, meta_name):
     children = xml.childNodes
     # children ideally contains a single element
     # that is the parent of all survey elements
@@ -71,17 +82,20 @@ def get_meta_from_xml(xml_str, meta_name):
 
 
 def get_uuid_from_xml(xml):
+    return _get_uuid_from_xml_obj(clean_and_parse_xml(xml))
+
+
+def _get_uuid_from_xml_obj(xml):
     def _uuid_only(uuid, regex):
         matches = regex.match(uuid)
         if matches and len(matches.groups()) > 0:
             return matches.groups()[0]
         return None
-    uuid = get_meta_from_xml(xml, "instanceID")
+    uuid = _get_meta_from_xml_obj(xml, "instanceID")
     regex = re.compile(r"uuid:(.*)")
     if uuid:
         return _uuid_only(uuid, regex)
     # check in survey_node attributes
-    xml = clean_and_parse_xml(xml)
     children = xml.childNodes
     # children ideally contains a single element
     # that is the parent of all survey elements
@@ -95,8 +109,11 @@ def get_uuid_from_xml(xml):
 
 
 def get_submission_date_from_xml(xml):
+    return _get_submission_date_from_xml_obj(clean_and_parse_xml(xml))
+
+
+def _get_submission_date_from_xml_obj(xml):
     # check in survey_node attributes
-    xml = clean_and_parse_xml(xml)
     children = xml.childNodes
     # children ideally contains a single element
     # that is the parent of all survey elements
@@ -110,7 +127,11 @@ def get_submission_date_from_xml(xml):
 
 
 def get_deprecated_uuid_from_xml(xml):
-    uuid = get_meta_from_xml(xml, "deprecatedID")
+    return _get_deprecated_uuid_from_xml_obj(clean_and_parse_xml(xml))
+
+
+def _get_deprecated_uuid_from_xml_obj(xml):
+    uuid = _get_meta_from_xml_obj(xml, "deprecatedID")
     regex = re.compile(r"uuid:(.*)")
     if uuid:
         matches = regex.match(uuid)
@@ -271,10 +292,204 @@ def _get_all_attributes(node):
             yield pair
 
 
+def _qualified_name(element, name):
+    """
+    Convert an lxml `{uri}local` name back to the `prefix:local` form that
+    minidom reports.
+    """
+    if not name.startswith('{'):
+        return name
+    uri, local_name = name[1:].split('}', 1)
+    for prefix, prefix_uri in element.nsmap.items():
+        if prefix and prefix_uri == uri:
+            return '%s:%s' % (prefix, local_name)
+    return local_name
+
+
+def _xml_str_to_dict_iterparse(xml_str, repeats=[]):
+    """
+    Streaming counterpart of `_xml_node_to_dict()`: build the same dict from
+    lxml `iterparse()` events without keeping a DOM around. The xpath of the
+    current node is carried on a stack instead of walking up its parents.
+
+    Returns a `(dict, root node name, attributes)` tuple, where attributes
+    are listed in document order like `_get_all_attributes()` does.
+    """
+    repeats = set(repeats)
+    attributes = []
+    namespaces = []
+    # Each frame is `[name, xpath, value, number of non-text child nodes]`
+    stack = []
+    result = root_node_name = None
+
+    clean_xml_str = smart_str(xml_str).strip().encode('utf-8')
+    events = etree.iterparse(
+        BytesIO(clean_xml_str),
+        events=('start-ns', 'start', 'end', 'comment', 'pi'),
+        # Mimic `minidom.parseString()`, which always decodes a `str` as
+        # UTF-8 whatever the XML declaration says
+        encoding='utf-8',
+        resolve_entities=False,
+        no_network=True,
+    )
+    for event, node in events:
+        if event == 'start-ns':
+            namespaces.append(node)
+            continue
+        if event in ('comment', 'pi'):
+            # minidom keeps them as child nodes, which turns a leaf into an
+            # (empty) internal node
+            if stack:
+                stack[-1][3] += 1
+            continue
+
+        if event == 'start':
+            # Namespace declarations are attributes for minidom
+            for prefix, uri in namespaces:
+                key = 'xmlns:%s' % prefix if prefix else 'xmlns'
+                attributes.append((key, uri))
+            namespaces = []
+            for key, value in node.attrib.items():
+                attributes.append((_qualified_name(node, key), value))
+
+            name = _qualified_name(node, node.tag)
+            if not stack:
+                root_node_name = name
+                xpath = ''
+            else:
+                stack[-1][3] += 1
+                parent_xpath = stack[-1][1]
+                xpath = '%s/%s' % (parent_xpath, name) if parent_xpath \
+                    else name
+            stack.append([name, xpath, {}, 0])
+            continue
+
+        # event == 'end'
+        name, xpath, value, child_count = stack.pop()
+        if child_count == 0:
+            # Whitespace-only text is what `clean_and_parse_xml()` strips
+            text = node.text
+            d = {name: text} if text and text.strip() else None
+        else:
+            d = {name: value} if value else None
+
+        # Nothing below this node is needed anymore
+        node.clear()
+        parent = node.getparent()
+        if parent is not None:
+            parent.remove(node)
+
+        if not stack:
+            result = d
+        elif d is not None:
+            parent_value = stack[-1][2]
+            if xpath in repeats:
+                parent_value.setdefault(name, []).append(d[name])
+            elif name not in parent_value:
+                parent_value[name] = d[name]
+            else:
+                # See the duplicate node handling in `_xml_node_to_dict()`
+                if not isinstance(parent_value[name], list):
+                    parent_value[name] = [parent_value[name]]
+                parent_value[name].append(d[name])
+
+    return result, root_node_name, attributes
+
+
+def _get_header_from_xml_iterparse(xml_str):
+    """
+    Lightweight counterpart of the `_get_*_from_xml_obj()` helpers: read what
+    identifies a submission with lxml `iterparse()`, without keeping a DOM
+    around, before knowing which form, hence which data dictionary, it
+    belongs to.
+
+    Returns a dict with the root node name, the uuid, the deprecated uuid,
+    the form id string and the submission date.
+    """
+    uuid_regex = re.compile(r"uuid:(.*)")
+
+    def _uuid_only(uuid):
+        matches = uuid_regex.match(uuid) if uuid else None
+        if matches and len(matches.groups()) > 0:
+            return matches.groups()[0]
+        return None
+
+    root_attributes = {}
+    # Texts of the children of the first `meta` node, by lowercase name
+    # without the `orx:` prefix; the first one of each name wins
+    meta = {}
+    meta_depth = None
+    meta_done = False
+    # First non-empty `id` of the first child of a `data` node
+    data_id_string = ''
+    # Each frame is `[name, number of child elements]`
+    stack = []
+    root_node_name = None
+
+    clean_xml_str = smart_str(xml_str).strip().encode('utf-8')
+    events = etree.iterparse(
+        BytesIO(clean_xml_str),
+        events=('start', 'end'),
+        encoding='utf-8',
+        resolve_entities=False,
+        no_network=True,
+    )
+    for event, node in events:
+        if event == 'start':
+            name = _qualified_name(node, node.tag)
+            if not stack:
+                root_node_name = name
+                root_attributes = dict(node.attrib)
+            else:
+                parent = stack[-1]
+                if parent[0] == 'data' and parent[1] == 0 and \
+                        not data_id_string and len(stack) > 1:
+                    data_id_string = node.get('id', '')
+                parent[1] += 1
+                if len(stack) == 1 and not meta_done and \
+                        name.lower() in ('meta', 'orx:meta'):
+                    meta_depth = len(stack)
+            stack.append([name, 0])
+            continue
+
+        # event == 'end'
+        name, _ = stack.pop()
+        if meta_depth is not None:
+            if len(stack) == meta_depth + 1:
+                key = name.lower()
+                if key.startswith('orx:'):
+                    key = key[len('orx:'):]
+                text = node.text.strip() if node.text else None
+                meta.setdefault(key, text)
+            elif len(stack) == meta_depth:
+                meta_depth = None
+                meta_done = True
+
+        # Nothing below this node is needed anymore
+        node.clear()
+        parent_node = node.getparent()
+        if parent_node is not None:
+            parent_node.remove(node)
+
+    submission_date = root_attributes.get('submissionDate')
+
+    return {
+        'root_node_name': root_node_name,
+        # Like `_get_uuid_from_xml_obj()`, fall back to the root attribute
+        'uuid': _uuid_only(
+            meta.get('instanceid') or root_attributes.get('instanceID')),
+        'deprecated_uuid': _uuid_only(meta.get('deprecatedid')),
+        'id_string': root_attributes.get('id') or data_id_string,
+        'submission_date': dateutil.parser.parse(submission_date)
+        if submission_date else None,
+    }
+
+
 class XFormInstanceParser:
 
-    def __init__(self, xml_str, data_dictionary):
+    def __init__(self, xml_str, data_dictionary, engine=None):
         self.dd = data_dictionary
+        self.engine = engine or settings.XFORM_INSTANCE_PARSER_ENGINE
         # The two following variables need to be initialized in the constructor, in case parsing fails.
         self._flat_dict = {}
         self._attributes = {}
@@ -291,22 +506,38 @@ class XFormInstanceParser:
             six.reraise(*sys.exc_info())
 
     def parse(self, xml_str):
-        self._xml_obj = clean_and_parse_xml(xml_str)
-        self._root_node = self._xml_obj.documentElement
-        repeats = [e.get_abbreviated_xpath()
-                   for e in self.dd.get_survey_elements_of_type("repeat")]
-        self._dict = _xml_node_to_dict(self._root_node, repeats)
+        # A set makes the membership tests done for every node O(1)
+        repeats = set(self.dd.repeat_xpaths())
+        if self.engine == PARSER_ENGINE_ITERPARSE:
+            # No DOM is kept; `get_root_node()` builds one if ever needed
+            self._xml_str = xml_str
+            self._dict, self._root_node_name, all_attributes = \
+                _xml_str_to_dict_iterparse(xml_str, repeats)
+        elif self.engine == PARSER_ENGINE_MINIDOM:
+            self._xml_obj = clean_and_parse_xml(xml_str)
+            self._root_node = self._xml_obj.documentElement
+            self._root_node_name = self._root_node.nodeName
+            self._dict = _xml_node_to_dict(self._root_node, repeats)
+            all_attributes = list(_get_all_attributes(self._root_node))
+        else:
+            raise ValueError(
+                _("Unknown XML parser engine: %s") % self.engine)
+
         if self._dict is None:
             raise InstanceEmptyError
         for path, value in _flatten_dict_nest_repeats(self._dict, []):
             self._flat_dict["/".join(path[1:])] = value
-        self._set_attributes()
+        self._set_attributes(all_attributes)
 
     def get_root_node(self):
+        if not hasattr(self, "_root_node"):
+            if not hasattr(self, "_xml_obj"):
+                self._xml_obj = clean_and_parse_xml(self._xml_str)
+            self._root_node = self._xml_obj.documentElement
         return self._root_node
 
     def get_root_node_name(self):
-        return self._root_node.nodeName
+        return self._root_node_name
 
     def get(self, abbreviated_xpath):
         return self.to_flat_dict()[abbreviated_xpath]
@@ -320,8 +551,7 @@ class XFormInstanceParser:
     def get_attributes(self):
         return self._attributes
 
-    def _set_attributes(self):
-        all_attributes = list(_get_all_attributes(self._root_node))
+    def _set_attributes(self, all_attributes):
         for key, value in all_attributes:
             # commented since enketo forms may have the template attribute in
             # multiple xml tags and I dont see the harm in overiding
@@ -345,6 +575,71 @@ class XFormInstanceParser:
         return result
 
 
+class ParsedSubmission:
+    """
+    Everything the save path needs to know about a submission's XML. Each
+    value is computed lazily and at most once: what identifies the
+    submission comes from a single lightweight `iterparse()` pass, see
+    `_get_header_from_xml_iterparse()`, and its data from the
+    `XFormInstanceParser`. Create one of these at ingest and hand it along
+    instead of the raw XML string.
+    """
+
+    def __init__(self, xml_str):
+        self.xml = xml_str
+
+    def _get_header(self):
+        if not hasattr(self, "_header"):
+            self._header = _get_header_from_xml_iterparse(self.xml)
+        return self._header
+
+    @property
+    def uuid(self):
+        return self._get_header()['uuid']
+
+    @property
+    def deprecated_uuid(self):
+        return self._get_header()['deprecated_uuid']
+
+    @property
+    def id_string(self):
+        return self._get_header()['id_string']
+
+    @property
+    def submission_date(self):
+        return self._get_header()['submission_date']
+
+    @property
+    def root_node_name(self):
+        return self._get_header()['root_node_name']
+
+    def get_parser(self, data_dictionary):
+        if not hasattr(self, "_parser"):
+            self._parser = XFormInstanceParser(self.xml, data_dictionary)
+        return self._parser
+
+    def get_flat_dict(self, data_dictionary):
+        return self.get_parser(data_dictionary).to_flat_dict()
+
+    def get_geopoints(self, data_dictionary):
+        """
+        Return a `(lat, lng)` tuple for each answered top-level geopoint
+        question, or `None` if the form has no geopoint questions at all.
+        """
+        if not hasattr(self, "_geopoints"):
+            geo_xpaths = data_dictionary.geopoint_xpaths()
+            if not geo_xpaths:
+                self._geopoints = None
+            else:
+                doc = self.get_flat_dict(data_dictionary)
+                self._geopoints = []
+                for xpath in geo_xpaths:
+                    geometry = [float(s) for s in doc.get(xpath, '').split()]
+                    if len(geometry):
+                        self._geopoints.append(tuple(geometry[0:2]))
+        return self._geopoints
+
+
 def xform_instance_to_dict(xml_str, data_dictionary):
     parser = XFormInstanceParser(xml_str, data_dictionary)
     return parser.to_dict()
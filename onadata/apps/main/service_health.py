@@ -5,6 +5,7 @@ from django.conf import settings
 from django.http import HttpResponse
 
 from onadata.apps.logger.models import Instance
+from onadata.libs.utils.compiled_form_cache import compiled_form_cache
 
 
 def service_health(request):
@@ -34,14 +35,19 @@ def service_health(request):
         postgres_message = 'OK'
     postgres_time = time.time() - t0
 
+    cache_stats = compiled_form_cache.get_stats()
+
     output = (
         '{}\r\n\r\n'
         'Mongo: {} in {:.3} seconds\r\n'
         'Postgres: {} in {:.3} seconds\r\n'
+        'Compiled form cache: {} hits, {} misses, {}/{} forms\r\n'
     ).format(
         'FAIL' if any_failure else 'OK',
         mongo_message, mongo_time,
         postgres_message, postgres_time,
+        cache_stats['hits'], cache_stats['misses'],
+        cache_stats['size'], cache_stats['max_size'],
     )
 
     return HttpResponse(
@@ -12,8 +12,10 @@ from .test_base import TestBase
 
 def dict_for_mongo_without_userform_id(parsed_instance):
     d = parsed_instance.to_dict_for_mongo()
-    # remove _userform_id since its not returned by the API
+    # remove _userform_id and _modified_epoch since they are not returned by
+    # the API
     d.pop(ParsedInstance.USERFORM_ID)
+    d.pop(ParsedInstance.MODIFIED_EPOCH)
     return d
 
 
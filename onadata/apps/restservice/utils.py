@@ -1,24 +1,50 @@
 # coding: utf-8
+from celery import group
+
 from onadata.apps.restservice.models import RestService
 from onadata.apps.restservice.tasks import service_definition_task
 
 
+def _get_service_data(parsed_instance):
+    # Celery can't pickle ParsedInstance object,
+    # let's use build a serializable object instead
+    # We don't really need `xform_id`, `xform_id_string`, `instance_uuid`
+    # We use them only for retro compatibility with all services (even if they are deprecated)
+    instance = parsed_instance.instance
+    return {
+        "xform_id": instance.xform.id,
+        "xform_id_string": instance.xform.id_string,
+        "instance_uuid": instance.uuid,
+        "instance_id": instance.id,
+        "xml": parsed_instance.instance.xml,
+        "json": parsed_instance.to_dict_for_mongo()
+    }
+
+
 def call_service(parsed_instance):
     # lookup service
     instance = parsed_instance.instance
     rest_services = RestService.objects.filter(xform=instance.xform)
     # call service send with url and data parameters
     for rest_service in rest_services:
-        # Celery can't pickle ParsedInstance object,
-        # let's use build a serializable object instead
-        # We don't really need `xform_id`, `xform_id_string`, `instance_uuid`
-        # We use them only for retro compatibility with all services (even if they are deprecated)
-        data = {
-            "xform_id": instance.xform.id,
-            "xform_id_string": instance.xform.id_string,
-            "instance_uuid": instance.uuid,
-            "instance_id": instance.id,
-            "xml": parsed_instance.instance.xml,
-            "json": parsed_instance.to_dict_for_mongo()
-        }
+        data = _get_service_data(parsed_instance)
         service_definition_task.delay(rest_service.pk, data)
+
+
+def call_services(parsed_instances):
+    """
+    Same as `call_service()` for a batch of submissions: services are looked
+    up once per form and all the tasks are queued as a single group.
+    """
+    rest_services = {}
+    tasks = []
+    for parsed_instance in parsed_instances:
+        xform_id = parsed_instance.instance.xform_id
+        if xform_id not in rest_services:
+            rest_services[xform_id] = list(
+                RestService.objects.filter(xform_id=xform_id))
+        for rest_service in rest_services[xform_id]:
+            data = _get_service_data(parsed_instance)
+            tasks.append(service_definition_task.s(rest_service.pk, data))
+    if tasks:
+        group(tasks).apply_async()
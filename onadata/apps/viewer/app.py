@@ -0,0 +1,43 @@
+# coding: utf-8
+from django.apps import AppConfig
+from django.conf import settings
+from django.core import checks
+
+from onadata.libs.utils.mongo_indexes import (
+    ensure_indexes,
+    get_missing_indexes,
+)
+
+
+class ViewerConfig(AppConfig):
+    name = "onadata.apps.viewer"
+    verbose_name = "viewer"
+
+    def ready(self):
+        checks.register(check_mongo_indexes, checks.Tags.database)
+        if settings.MONGO_ENSURE_INDEXES_ON_STARTUP:
+            ensure_indexes()
+
+
+def check_mongo_indexes(app_configs, **kwargs):
+    """
+    Warn about the declared Mongo indexes which do not exist; run by
+    `migrate` and `check --database`
+    """
+    try:
+        missing = get_missing_indexes()
+    except Exception as e:
+        return [checks.Warning(
+            'Mongo indexes could not be checked: {}'.format(e),
+            id='viewer.W002',
+        )]
+    return [
+        checks.Warning(
+            'Mongo collection `{}` has no index on {}'.format(
+                collection, keys),
+            hint='Run `python manage.py ensure_mongo_indexes`.',
+            id='viewer.W001',
+        )
+        for collection, indexes in sorted(missing.items())
+        for keys in indexes
+    ]
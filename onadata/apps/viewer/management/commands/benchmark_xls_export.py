@@ -0,0 +1,187 @@
+# coding: utf-8
+import random
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import ugettext_lazy
+from pyxform import Survey
+from pyxform.builder import create_survey_element_from_dict
+
+from onadata.libs.utils.common_tags import (
+    ID,
+    INDEX,
+    NOTES,
+    PARENT_INDEX,
+    PARENT_TABLE_NAME,
+    SUBMISSION_TIME,
+    TAGS,
+    UUID,
+)
+from onadata.libs.utils.export_tools import (
+    ExportBuilder,
+    dict_to_joined_export,
+)
+
+CHOICES = ['apple', 'banana', 'cherry', 'date', 'elderberry', 'fig']
+
+
+def _choices():
+    return [{'name': name, 'label': name.title()} for name in CHOICES]
+
+
+def _build_survey(questions):
+    """
+    A survey with `questions` questions of each type in a group, a geopoint
+    and a repeat
+    """
+    survey = Survey(name='benchmark', id_string='benchmark')
+    group = []
+    for i in range(questions):
+        group += [
+            {'type': 'text', 'name': 'text_{}'.format(i)},
+            {'type': 'integer', 'name': 'integer_{}'.format(i)},
+            {'type': 'decimal', 'name': 'decimal_{}'.format(i)},
+            {'type': 'date', 'name': 'date_{}'.format(i)},
+            {'type': 'select all that apply', 'name': 'fruits_{}'.format(i),
+             'children': _choices()},
+        ]
+    survey.add_child(create_survey_element_from_dict(
+        {'type': 'group', 'name': 'household', 'children': group}))
+    survey.add_child(create_survey_element_from_dict(
+        {'type': 'geopoint', 'name': 'location'}))
+    survey.add_child(create_survey_element_from_dict(
+        {'type': 'repeat', 'name': 'members', 'children': [
+            {'type': 'text', 'name': 'name'},
+            {'type': 'integer', 'name': 'age'},
+            {'type': 'select all that apply', 'name': 'likes',
+             'children': _choices()},
+        ]}))
+    return survey
+
+
+def _generate_submissions(count, questions, repeats, seed=1):
+    """
+    Yield `count` submissions shaped like the documents saved in Mongo
+    """
+    rand = random.Random(seed)
+    for pk in range(1, count + 1):
+        submission = {
+            ID: pk,
+            UUID: 'uuid-{}'.format(pk),
+            SUBMISSION_TIME: '2020-01-01T00:00:00',
+            TAGS: [],
+            NOTES: [],
+            'location': '{} {} 0 10'.format(rand.uniform(-90, 90),
+                                            rand.uniform(-180, 180)),
+            'members': [
+                {
+                    'members/name': 'member {}'.format(i),
+                    'members/age': str(rand.randint(0, 99)),
+                    'members/likes': ' '.join(rand.sample(CHOICES, 2)),
+                }
+                for i in range(repeats)
+            ],
+        }
+        for i in range(questions):
+            prefix = 'household/{{}}_{}'.format(i)
+            submission[prefix.format('text')] = 'text {}'.format(pk)
+            submission[prefix.format('integer')] = str(rand.randint(0, 1000))
+            submission[prefix.format('decimal')] = str(rand.random())
+            submission[prefix.format('date')] = (
+                date(2020, 1, 1) + timedelta(days=rand.randint(0, 365))
+            ).isoformat()
+            submission[prefix.format('fruits')] = ' '.join(
+                rand.sample(CHOICES, rand.randint(0, 3)))
+        yield submission
+
+
+def _joined_outputs(export_builder, submissions):
+    indices = {}
+    survey_name = export_builder.survey.name
+    for index, submission in enumerate(submissions, start=1):
+        output = ExportBuilder.decode_mongo_encoded_section_names(
+            dict_to_joined_export(submission, index, indices, survey_name))
+        output[survey_name][INDEX] = index
+        output[survey_name][PARENT_INDEX] = -1
+        yield output
+
+
+def _rows(output, name):
+    row = output.get(name)
+    if type(row) == dict:
+        return [row]
+    return row or []
+
+
+def _write_rows_per_row_lookups(export_builder, outputs, sink):
+    """
+    How `ExportBuilder.to_xls_export()` wrote rows before section plans
+    """
+    rows = 0
+    work_sheet_titles = {}
+    for output in outputs:
+        for section in export_builder.sections:
+            fields = [element['xpath'] for element in section['elements']] \
+                + export_builder.EXTRA_FIELDS
+            for row in _rows(output, section['name']):
+                row = export_builder.pre_process_row(row, section)
+                row[PARENT_TABLE_NAME] = work_sheet_titles.get(
+                    row.get(PARENT_TABLE_NAME))
+                sink([row.get(f) for f in fields])
+                rows += 1
+    return rows
+
+
+def _write_rows_with_section_plans(export_builder, outputs, sink):
+    rows = 0
+    work_sheet_titles = {}
+    for output in outputs:
+        for plan in export_builder.section_plans:
+            for row in _rows(output, plan.name):
+                sink(plan.to_values(plan.process(row), work_sheet_titles))
+                rows += 1
+    return rows
+
+
+class Command(BaseCommand):
+    help = ugettext_lazy(
+        "Measure how many rows per second the XLSX export prepares for a "
+        "synthetic form, with per-row lookups (before) and with section "
+        "plans (after). Nothing is read from or written to any database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--submissions',
+            type=int,
+            default=100000,
+            help=ugettext_lazy("Number of synthetic submissions"))
+        parser.add_argument(
+            '--questions',
+            type=int,
+            default=10,
+            help=ugettext_lazy("Number of questions of each type"))
+        parser.add_argument(
+            '--repeats',
+            type=int,
+            default=2,
+            help=ugettext_lazy("Number of repeat instances per submission"))
+
+    def handle(self, *args, **options):
+        export_builder = ExportBuilder()
+        export_builder.set_survey(_build_survey(options['questions']))
+
+        for label, write_rows in [
+            ('per-row lookups', _write_rows_per_row_lookups),
+            ('section plans', _write_rows_with_section_plans),
+        ]:
+            # Submissions are generated on the fly, so that both runs start
+            # from identical, unprocessed rows
+            outputs = _joined_outputs(export_builder, _generate_submissions(
+                options['submissions'], options['questions'],
+                options['repeats']))
+            start = time.time()
+            rows = write_rows(export_builder, outputs, lambda values: None)
+            elapsed = time.time() - start
+            self.stdout.write('{}: {} rows in {:.2f}s, {:.0f} rows/s'.format(
+                label, rows, elapsed, rows / elapsed if elapsed else 0))
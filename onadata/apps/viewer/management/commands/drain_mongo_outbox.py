@@ -0,0 +1,32 @@
+# coding: utf-8
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.translation import ugettext_lazy
+
+from onadata.apps.viewer.models.mongo_outbox import MongoOutboxEntry
+
+
+class Command(BaseCommand):
+    help = ugettext_lazy("Write the submissions pending in the Mongo outbox "
+                         "to MongoDB")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batchsize',
+            type=int,
+            default=settings.MONGO_OUTBOX_BATCH_SIZE,
+            help=ugettext_lazy("Number of submissions to write per batch"))
+
+    def handle(self, *args, **kwargs):
+        total_synced = total_failed = 0
+        while True:
+            synced, failed = MongoOutboxEntry.drain(kwargs['batchsize'])
+            total_synced += synced
+            total_failed += failed
+            # Stop once the outbox is empty, or only holds entries which
+            # have already failed
+            if not synced and not MongoOutboxEntry.objects.filter(
+                    attempts=0).exists():
+                break
+        self.stdout.write('{} submissions written to Mongo, {} failed'.format(
+            total_synced, total_failed))
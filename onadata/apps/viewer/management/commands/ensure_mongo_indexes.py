@@ -0,0 +1,46 @@
+# coding: utf-8
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import ugettext_lazy
+
+from onadata.libs.utils.mongo_indexes import (
+    ensure_indexes,
+    get_missing_indexes,
+    get_undeclared_indexes,
+)
+
+
+class Command(BaseCommand):
+    help = ugettext_lazy("Create the declared MongoDB indexes which do not "
+                         "exist, and list the ones which are not declared")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            default=False,
+            help=ugettext_lazy("Only list the missing indexes, and exit with "
+                               "an error if there are any"))
+
+    def handle(self, *args, **options):
+        missing = None
+        if options['verify']:
+            missing = get_missing_indexes()
+            for collection, indexes in sorted(missing.items()):
+                for keys in indexes:
+                    self.stdout.write('Missing index on `{}`: {}'.format(
+                        collection, keys))
+        else:
+            for collection, names in sorted(ensure_indexes().items()):
+                for name in names:
+                    self.stdout.write('Created index `{}` on `{}`'.format(
+                        name, collection))
+
+        for collection, names in sorted(get_undeclared_indexes().items()):
+            for name in names:
+                self.stdout.write(
+                    'Index `{}` on `{}` is not declared; drop it if the '
+                    'declared ones cover its queries'.format(
+                        name, collection))
+
+        if missing:
+            raise CommandError("Some declared indexes are missing")
@@ -1,10 +1,12 @@
 # coding: utf-8
-from django.conf import settings
+import os
+
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.translation import ugettext_lazy
 
-from onadata.apps.viewer.models.parsed_instance import ParsedInstance
-from onadata.libs.utils.common_tags import USERFORM_ID
+from onadata.apps.logger.models import XForm
+from onadata.libs.utils.mongo_indexes import ensure_indexes
+from onadata.libs.utils.mongo_rebuild import rebuild_mongo
 
 
 class Command(BaseCommand):
@@ -23,40 +25,39 @@ class Command(BaseCommand):
         parser.add_argument('-i', '--id_string',
                             help=ugettext_lazy("id string of the form"))
 
+        parser.add_argument(
+            '--workers',
+            type=int,
+            help=ugettext_lazy("Number of processes parsing submissions; 0 "
+                               "parses them in this process. Defaults to the "
+                               "number of CPUs"))
+
     def handle(self, *args, **kwargs):
-        ids = None
         # check for username AND id_string - if one exists so must the other
         if (kwargs.get('username') and not kwargs.get('id_string')) or (
                 not kwargs.get('username') and kwargs.get('id_string')):
             raise CommandError("username and id_string must either both be "
                                "specified or neither")
-        elif kwargs.get('username') and kwargs.get('id_string'):
-            from onadata.apps.logger.models import XForm, Instance
-            xform = XForm.objects.get(user__username=kwargs.get('username'),
-                                      id_string=kwargs.get('id_string'))
-            ids = [i.pk for i in Instance.objects.filter(xform=xform)]
-        # num records per run
-        batchsize = kwargs['batchsize']
-        start = 0
-        end = start + batchsize
-        filter_queryset = ParsedInstance.objects.all()
-        # instance ids for when we have a username and id_string
-        if ids:
-            filter_queryset = ParsedInstance.objects.filter(instance__in=ids)
-        # total number of records
-        record_count = filter_queryset.count()
-        i = 0
-        while start < record_count:
-            print('Querying record %s to %s' % (start, end-1))
-            queryset = filter_queryset.order_by('pk')[start:end]
-            for pi in queryset.iterator():
-                if pi.update_mongo(asynchronous=False):
-                    i += 1
-                else:
-                    print("\033[91m[ERROR] Could not parse instance {}\033[0m".format(pi.instance.uuid))
-
-            start = start + batchsize
-            end = min(record_count, start + batchsize)
+        xforms = XForm.objects.select_related('user').order_by('pk')
+        if kwargs.get('username') and kwargs.get('id_string'):
+            xforms = xforms.filter(user__username=kwargs.get('username'),
+                                   id_string=kwargs.get('id_string'))
+
+        workers = kwargs.get('workers')
+        if workers is None:
+            workers = os.cpu_count()
+
+        def progress(stats):
+            print('%d records written, %d per second' % (
+                stats['written'], stats['documents_per_second']))
+
+        stats = rebuild_mongo(xforms.iterator(),
+                              chunk_size=kwargs.get('batchsize', 100),
+                              workers=workers,
+                              progress_callback=progress)
+        for pk, error in sorted(stats['errors'].items()):
+            print("\033[91m[ERROR] Could not parse instance {}: {}\033[0m"
+                  .format(pk, error))
         # add indexes after writing so the writing operation above is not
         # slowed
-        settings.MONGO_DB.instances.create_index(USERFORM_ID)
+        ensure_indexes()
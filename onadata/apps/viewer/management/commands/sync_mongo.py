@@ -1,5 +1,7 @@
 #!/usr/bin/env python
 # coding: utf-8
+import os
+
 from django.contrib.auth.models import User
 from django.core.management.base import BaseCommand, CommandError
 from django.utils.translation import ugettext_lazy
@@ -36,7 +38,25 @@ class Command(BaseCommand):
                                 "Only makes sense when used with the -r option")
                             )
 
-    def handle(self, username, id_string, remongo, update_all, *args, **kwargs):
+        parser.add_argument('-d', '--deep',
+                            action='store_true', dest='deep',
+                            default=False,
+                            help=ugettext_lazy(
+                                "Also compare checksums of ranges of "
+                                "records to find which ones are missing, "
+                                "stale or extra, not just how many. Stale "
+                                "records are rewritten by the -a option")
+                            )
+
+        parser.add_argument('-w', '--workers', type=int,
+                            help=ugettext_lazy(
+                                "Number of processes parsing submissions "
+                                "when running remongo; 0 parses them in this "
+                                "process. Defaults to the number of CPUs")
+                            )
+
+    def handle(self, username, id_string, remongo, update_all, *args,
+               **kwargs):
         user = xform = None
         if username:
             try:
@@ -50,5 +70,10 @@ class Command(BaseCommand):
                 raise CommandError("Xform %s does not exist for user %s" %
                                    (id_string, user.username))
 
-        report_string = mongo_sync_status(remongo, update_all, user, xform)
+        workers = kwargs.get('workers')
+        if workers is None:
+            workers = os.cpu_count()
+        report_string = mongo_sync_status(remongo, update_all, user, xform,
+                                          workers=workers,
+                                          deep=kwargs.get('deep', False))
         self.stdout.write(report_string)
@@ -0,0 +1,25 @@
+# coding: utf-8
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logger', '0019_purge_deleted_instances'),
+        ('viewer', '0004_update_meta_data_export_types'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MongoOutboxEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('date_created', models.DateTimeField(auto_now_add=True)),
+                ('date_modified', models.DateTimeField(auto_now=True)),
+                ('instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='mongo_outbox_entry', to='logger.Instance')),
+            ],
+        ),
+    ]
@@ -0,0 +1,38 @@
+# coding: utf-8
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0005_mongooutboxentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='export',
+            name='rows_done',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='rows_total',
+            field=models.PositiveIntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='checkpoint_last_id',
+            field=models.IntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='checkpoint',
+            field=jsonfield.fields.JSONField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='checkpoint_updated',
+            field=models.DateTimeField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# coding: utf-8
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0006_export_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='export',
+            name='high_water_mark',
+            field=models.IntegerField(default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name='export',
+            name='incremental_state',
+            field=jsonfield.fields.JSONField(default=None, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# coding: utf-8
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0007_export_incremental_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportCacheEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('export_type', models.CharField(max_length=10)),
+                ('status', models.SmallIntegerField(default=0)),
+                ('filedir', models.CharField(blank=True, max_length=255, null=True)),
+                ('filename', models.CharField(blank=True, max_length=255, null=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('date_created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_accessed', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('xform', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_cache_entries', to='logger.XForm')),
+            ],
+        ),
+    ]
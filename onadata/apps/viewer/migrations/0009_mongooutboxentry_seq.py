@@ -0,0 +1,17 @@
+# coding: utf-8
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0008_exportcacheentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mongooutboxentry',
+            name='seq',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# coding: utf-8
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('viewer', '0009_mongooutboxentry_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='export',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -3,3 +3,5 @@ from onadata.apps.viewer.models.parsed_instance import ParsedInstance  # flake8:
 from onadata.apps.viewer.models.data_dictionary import DataDictionary
 from onadata.apps.viewer.models.instance_modification import InstanceModification
 from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.mongo_outbox import MongoOutboxEntry
+from onadata.apps.viewer.models.export_cache import ExportCacheEntry
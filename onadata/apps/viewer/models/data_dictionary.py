@@ -4,7 +4,8 @@ import re
 from xml.dom import Node
 
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import DEFERRED
+from django.db.models.signals import post_save, post_delete
 from django.utils.encoding import smart_text
 from django.utils.six import text_type
 from guardian.shortcuts import assign_perm, get_perms_for_model
@@ -14,10 +15,16 @@ from pyxform.question import Question
 from pyxform.section import RepeatingSection
 from pyxform.xform2json import create_survey_element_from_xml
 
-from onadata.apps.logger.models.xform import XForm
+from onadata.apps.logger.models.xform import (
+    XForm,
+    delete_submission_changes,
+)
 from onadata.apps.logger.xform_instance_parser import clean_and_parse_xml
-from onadata.apps.api.mongo_helper import MongoHelper
 from onadata.libs.utils.common_tags import UUID, SUBMISSION_TIME, TAGS, NOTES
+from onadata.libs.utils.compiled_form_cache import (
+    compiled_form_cache,
+    invalidate_compiled_form,
+)
 from onadata.libs.utils.export_tools import question_types_to_exclude,\
     DictOrganizer
 from onadata.libs.utils.model_tools import queryset_iterator, set_uuid
@@ -55,6 +62,7 @@ class DataDictionary(XForm):
     ]
 
     PREFIX_NAME_REGEX = re.compile(r'(?P<prefix>.+/)(?P<name>[^/]+)$')
+    INDICES_REGEX = re.compile(r"\[\d+\]")
 
     class Meta:
         app_label = "viewer"
@@ -64,6 +72,18 @@ class DataDictionary(XForm):
         self.instances_for_export = lambda d: d.instances.all()
         super().__init__(*args, **kwargs)
 
+    @classmethod
+    def from_xform(cls, xform):
+        """
+        Return `xform` as a `DataDictionary` without querying the database
+        again. Fields deferred on `xform` stay deferred.
+        """
+        deferred_fields = xform.get_deferred_fields()
+        field_names = [f.attname for f in cls._meta.concrete_fields]
+        values = [DEFERRED if name in deferred_fields else getattr(xform, name)
+                  for name in field_names]
+        return cls.from_db(xform._state.db, field_names, values)
+
     def set_uuid_in_xml(self, file_name=None, id_string=None):
         """
         Add bind to automatically set UUID node in XML.
@@ -168,31 +188,36 @@ class DataDictionary(XForm):
     def file_name(self):
         return os.path.split(self.xls.name)[-1]
 
+    def build_survey(self):
+        try:
+            builder = SurveyElementBuilder()
+            return builder.create_survey_element_from_json(self.json)
+        except ValueError:
+            xml = bytes(bytearray(self.xml, encoding='utf-8'))
+            return create_survey_element_from_xml(xml)
+
+    def get_compiled_form(self):
+        if not hasattr(self, "_compiled_form"):
+            self._compiled_form = compiled_form_cache.get(self)
+        return self._compiled_form
+
+    compiled_form = property(get_compiled_form)
+
     def get_survey(self):
         if not hasattr(self, "_survey"):
-            try:
-                builder = SurveyElementBuilder()
-                self._survey = \
-                    builder.create_survey_element_from_json(self.json)
-            except ValueError:
-                xml = bytes(bytearray(self.xml, encoding='utf-8'))
-                self._survey = create_survey_element_from_xml(xml)
+            self._survey = self.compiled_form.survey
         return self._survey
 
     survey = property(get_survey)
 
     def get_survey_elements(self):
-        return self.survey.iter_descendants()
+        return list(self.compiled_form.elements)
 
     def get_survey_element(self, name_or_xpath):
         element = self.get_element(name_or_xpath)
         name = (element and element['name']) or name_or_xpath
 
-        for field in self.get_survey_elements():
-            if field.name == name:
-                return field
-
-        return None
+        return self.compiled_form.elements_by_name.get(name)
 
     def get_choice_label(self, field, choice_value, lang='English'):
         for choice in field.children:
@@ -211,22 +236,15 @@ class DataDictionary(XForm):
         Return a dictionary of fieldnames as saved in mongodb with
         corresponding xform field names e.g {"Q1Lg==1": "Q1.1"}
         """
-        names = {}
-        for elem in self.get_survey_elements():
-            names[MongoHelper.encode(text_type(elem.get_abbreviated_xpath()))] = \
-                elem.get_abbreviated_xpath()
-        return names
+        return dict(self.compiled_form.mongo_field_names)
 
     survey_elements = property(get_survey_elements)
 
     def geopoint_xpaths(self):
-        geo_xpaths = []
-
-        for e in self.get_survey_elements():
-            if e.bind.get('type') == 'geopoint':
-                geo_xpaths.append(e.get_abbreviated_xpath())
+        return list(self.compiled_form.geopoint_xpaths)
 
-        return geo_xpaths
+    def repeat_xpaths(self):
+        return list(self.compiled_form.repeat_xpaths)
 
     def xpath_of_first_geopoint(self):
         geo_xpaths = self.geopoint_xpaths()
@@ -242,6 +260,14 @@ class DataDictionary(XForm):
         Return a list of XPaths for this survey that will be used as
         headers for the csv export.
         """
+        if survey_element is None and result is None and not prefix:
+            # Top-level call: the result only depends on the form version
+            xpaths = self.compiled_form.xpaths.get(repeat_iterations)
+            if xpaths is None:
+                xpaths = compiled_form_cache.set_xpaths(
+                    self.compiled_form, repeat_iterations,
+                    self.xpaths(prefix, self.survey, [], repeat_iterations))
+            return list(xpaths)
         if survey_element is None:
             survey_element = self.survey
         elif question_types_to_exclude(survey_element.type):
@@ -315,16 +341,10 @@ class DataDictionary(XForm):
         return [remove_first_index(header) for header in self.get_headers()]
 
     def get_element(self, abbreviated_xpath):
-        if not hasattr(self, "_survey_elements"):
-            self._survey_elements = {}
-            for e in self.get_survey_elements():
-                self._survey_elements[e.get_abbreviated_xpath()] = e
-
-        def remove_all_indices(xpath):
-            return re.sub(r"\[\d+\]", "", xpath)
-
-        clean_xpath = remove_all_indices(abbreviated_xpath)
-        return self._survey_elements.get(clean_xpath)
+        clean_xpath = abbreviated_xpath
+        if '[' in clean_xpath:
+            clean_xpath = self.INDICES_REGEX.sub('', clean_xpath)
+        return self.compiled_form.elements_by_xpath.get(clean_xpath)
 
     def get_label(self, abbreviated_xpath):
         e = self.get_element(abbreviated_xpath)
@@ -421,8 +441,7 @@ class DataDictionary(XForm):
             self.has_start_time = False
 
     def get_survey_elements_of_type(self, element_type):
-        return [e for e in self.get_survey_elements()
-                if e.type == element_type]
+        return list(self.compiled_form.elements_by_type.get(element_type, []))
 
 
 def set_object_permissions(sender, instance=None, created=False, **kwargs):
@@ -431,3 +450,16 @@ def set_object_permissions(sender, instance=None, created=False, **kwargs):
             assign_perm(perm.codename, instance.user, instance)
 post_save.connect(set_object_permissions, sender=DataDictionary,
                   dispatch_uid='xform_object_permissions')
+
+# Forms can be saved, i.e. republished, through either model
+post_save.connect(invalidate_compiled_form, sender=XForm,
+                  dispatch_uid='invalidate_compiled_form')
+post_save.connect(invalidate_compiled_form, sender=DataDictionary,
+                  dispatch_uid='invalidate_compiled_form')
+post_delete.connect(invalidate_compiled_form, sender=XForm,
+                    dispatch_uid='invalidate_compiled_form')
+post_delete.connect(invalidate_compiled_form, sender=DataDictionary,
+                    dispatch_uid='invalidate_compiled_form')
+# Signals of the proxy model are sent with it as sender
+post_delete.connect(delete_submission_changes, sender=DataDictionary,
+                    dispatch_uid='delete_submission_changes')
@@ -6,6 +6,7 @@ from django.core.files.storage import get_storage_class
 from django.db import models
 from django.db.models.signals import post_delete
 from django.utils.translation import ugettext as _
+from jsonfield import JSONField
 
 from onadata.apps.logger.models import XForm
 
@@ -67,6 +68,21 @@ class Export(models.Model):
     # status
     internal_status = models.SmallIntegerField(default=PENDING)
     export_url = models.URLField(null=True, default=None)
+    # progress of a pending export, in submissions (attachments for ZIP
+    # exports)
+    rows_done = models.PositiveIntegerField(default=0)
+    rows_total = models.PositiveIntegerField(null=True, default=None)
+    # checkpoint from which an interrupted export resumes, see
+    # `onadata.libs.utils.checkpointed_export`
+    checkpoint_last_id = models.IntegerField(null=True, default=None)
+    checkpoint = JSONField(null=True, default=None)
+    checkpoint_updated = models.DateTimeField(null=True, default=None)
+    # runs of the export task, including redeliveries after its worker died
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # `_id` of the last submission, and columns, of an export to which the
+    # next one can append, see `onadata.libs.utils.incremental_export`
+    high_water_mark = models.IntegerField(null=True, default=None)
+    incremental_state = JSONField(null=True, default=None)
 
     class Meta:
         app_label = "viewer"
@@ -0,0 +1,53 @@
+# coding: utf-8
+import os
+
+from django.core.files.storage import get_storage_class
+from django.db import models
+from django.db.models.signals import post_delete
+from django.utils import timezone
+
+from onadata.apps.logger.models import XForm
+
+
+class ExportCacheEntry(models.Model):
+    """
+    A filtered export kept for identical requests, see
+    `onadata.libs.utils.export_cache`.
+
+    Entries are created `READY`, once the export is generated; `PENDING` ones
+    were left by older versions, which claimed keys with entries.
+    """
+    PENDING = 0
+    READY = 1
+
+    # See `export_cache.get_cache_key()`
+    key = models.CharField(max_length=64, unique=True)
+    xform = models.ForeignKey(XForm, related_name='export_cache_entries',
+                              on_delete=models.CASCADE)
+    export_type = models.CharField(max_length=10)
+    status = models.SmallIntegerField(default=PENDING)
+    filedir = models.CharField(max_length=255, null=True, blank=True)
+    filename = models.CharField(max_length=255, null=True, blank=True)
+    # in bytes
+    size = models.BigIntegerField(default=0)
+    date_created = models.DateTimeField(default=timezone.now)
+    last_accessed = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        app_label = 'viewer'
+
+    @property
+    def filepath(self):
+        if self.filedir and self.filename:
+            return os.path.join(self.filedir, self.filename)
+        return None
+
+
+def export_cache_entry_delete_callback(sender, instance, **kwargs):
+    storage = get_storage_class()()
+    if instance.filepath and storage.exists(instance.filepath):
+        storage.delete(instance.filepath)
+
+
+post_delete.connect(export_cache_entry_delete_callback,
+                    sender=ExportCacheEntry)
@@ -0,0 +1,110 @@
+# coding: utf-8
+from functools import reduce
+from operator import or_
+
+from django.db import connection, models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from onadata.apps.logger.models import Instance
+
+
+class MongoOutboxEntry(models.Model):
+    """
+    A submission whose Mongo document still has to be written.
+
+    When `settings.MONGO_OUTBOX_ENABLED` is `True`, ingesting a submission
+    only records an entry here, inside the same Postgres transaction as the
+    `Instance` itself, instead of waiting on Mongo. `drain()`, run by the
+    `drain_mongo_outbox` Celery task or management command, writes the
+    documents in batches.
+    """
+    instance = models.OneToOneField(Instance, related_name='mongo_outbox_entry',
+                                    on_delete=models.CASCADE)
+    # Incremented each time the submission is enqueued again, so that
+    # `drain()` can tell whether it changed since it was read
+    seq = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    date_created = models.DateTimeField(auto_now_add=True)
+    date_modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        app_label = 'viewer'
+
+    @classmethod
+    def enqueue(cls, instance_ids):
+        """
+        Record that the Mongo documents of `instance_ids` must be (re)written,
+        and have a worker write them once the current transaction commits.
+        """
+        # Avoid circular import
+        from onadata.apps.viewer.tasks import drain_mongo_outbox
+
+        instance_ids = sorted(set(instance_ids))
+        if not instance_ids:
+            return
+        # Entries which exist already, possibly being drained, are bumped
+        # rather than skipped: see `drain()`
+        now = timezone.now()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO {table} (instance_id, seq, attempts, last_error, '
+                'date_created, date_modified) VALUES {values} '
+                'ON CONFLICT (instance_id) DO UPDATE '
+                'SET seq = {table}.seq + 1, '
+                'date_modified = EXCLUDED.date_modified'.format(
+                    table=cls._meta.db_table,
+                    values=', '.join(
+                        ["(%s, 0, 0, '', %s, %s)"] * len(instance_ids))),
+                [param for instance_id in instance_ids
+                 for param in (instance_id, now, now)])
+        Instance.objects.filter(pk__in=instance_ids).update(
+            is_synced_with_mongo=False)
+        transaction.on_commit(lambda: drain_mongo_outbox.delay())
+
+    @classmethod
+    def drain(cls, batch_size):
+        """
+        Write the Mongo documents of up to `batch_size` pending submissions
+        with a single `bulk_write()`. Writes are upserts keyed on the
+        submission id, so entries that fail are simply retried by a later
+        call. Entries with the fewest attempts go first, so that a poison
+        entry cannot starve the others. Entries enqueued again while being
+        drained are kept, since the document written may predate the change.
+
+        :returns: A `(synced, failed)` tuple of counts.
+        """
+        # Avoid circular import
+        from onadata.apps.viewer.models.parsed_instance import ParsedInstance
+
+        with transaction.atomic():
+            entries = list(
+                cls.objects.select_for_update(skip_locked=True)
+                .order_by('attempts', 'pk')[:batch_size])
+            if not entries:
+                return 0, 0
+
+            parsed_instances = ParsedInstance.objects.filter(
+                instance_id__in=[entry.instance_id for entry in entries]
+            ).select_related('instance__xform__user', 'instance__user')
+            synced, errors = ParsedInstance.bulk_update_mongo(
+                list(parsed_instances))
+
+            synced_ids = set(pi.instance_id for pi in synced)
+            failed_ids = set(errors)
+            # Entries which are neither synced nor failed cannot be written to
+            # Mongo at all, e.g. unparsable submissions; see `update_mongo()`
+            written = [Q(pk=entry.pk, seq=entry.seq) for entry in entries
+                       if entry.instance_id not in failed_ids]
+            if written:
+                cls.objects.filter(reduce(or_, written)).delete()
+            for entry in entries:
+                if entry.instance_id in failed_ids:
+                    cls.objects.filter(pk=entry.pk).update(
+                        attempts=F('attempts') + 1,
+                        last_error=errors[entry.instance_id],
+                    )
+
+        return len(synced_ids), len(failed_ids)
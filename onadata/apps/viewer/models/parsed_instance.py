@@ -7,15 +7,18 @@ from bson import json_util, ObjectId
 from celery import task
 from dateutil import parser
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import pre_delete
 from django.utils.six import string_types
 from django.utils.translation import ugettext as _
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
 
 from onadata.apps.api.mongo_helper import MongoHelper
 from onadata.apps.logger.models import Instance
 from onadata.apps.logger.models import Note
-from onadata.apps.restservice.utils import call_service
+from onadata.apps.logger.models import SubmissionChange
+from onadata.apps.restservice.utils import call_service, call_services
 from onadata.libs.utils.common_tags import (
     ID,
     UUID,
@@ -67,6 +70,9 @@ def update_mongo_instance(record):
 
 class ParsedInstance(models.Model):
     USERFORM_ID = '_userform_id'
+    # Epoch of `Instance.date_modified` when the document was written, for
+    # `onadata.libs.utils.mongo_drift`; hidden from the API like `USERFORM_ID`
+    MODIFIED_EPOCH = '_modified_epoch'
     STATUS = '_status'
     DEFAULT_LIMIT = 30000
     DEFAULT_BATCHSIZE = 1000
@@ -187,6 +193,27 @@ class ParsedInstance(models.Model):
 
         return cls._get_mongo_cursor(query, fields)
 
+    @classmethod
+    def query_mongo_keyset(cls, query, fields, last_id=None,
+                           limit=DEFAULT_BATCHSIZE):
+        """
+        Return a cursor over at most `limit` records matching `query`, in
+        `_id` order, starting right after `last_id`. Unlike `skip()`, the
+        cost of fetching a page does not grow with its position.
+        """
+        query = cls._get_mongo_cursor_query(query)
+        if last_id is not None:
+            query = {'$and': [query, {'_id': {'$gt': last_id}}]}
+
+        if limit <= 0:
+            raise ValueError(_("Invalid limit param"))
+        limit = min(limit, cls.DEFAULT_LIMIT)
+
+        cursor = cls._get_mongo_cursor(query, fields)
+        cursor.sort('_id', 1).limit(limit)
+        cursor.batch_size(min(limit, cls.DEFAULT_BATCHSIZE))
+        return cursor
+
     @classmethod
     def _get_mongo_cursor(cls, query, fields):
         """
@@ -196,7 +223,7 @@ class ParsedInstance(models.Model):
         :param fields: Array string
         :return: pymongo Cursor
         """
-        fields_to_select = {cls.USERFORM_ID: 0}
+        fields_to_select = {cls.USERFORM_ID: 0, cls.MODIFIED_EPOCH: 0}
 
         # fields must be a string array i.e. '["name", "age"]'
         if isinstance(fields, string_types):
@@ -268,12 +295,13 @@ class ParsedInstance(models.Model):
             self.USERFORM_ID: '%s_%s' % (
                 self.instance.xform.user.username,
                 self.instance.xform.id_string),
+            self.MODIFIED_EPOCH: int(self.instance.date_modified.timestamp()),
             ATTACHMENTS: _get_attachments_from_instance(self.instance),
             self.STATUS: self.instance.status,
             GEOLOCATION: [self.lat, self.lng],
             SUBMISSION_TIME: self.instance.date_created.strftime(
                 MONGO_STRFTIME),
-            TAGS: list(self.instance.tags.names()),
+            TAGS: self.get_tag_names(),
             NOTES: self.get_notes(),
             VALIDATION_STATUS: self.instance.get_validation_status(),
             SUBMITTED_BY: self.instance.user.username
@@ -284,7 +312,19 @@ class ParsedInstance(models.Model):
 
         return MongoHelper.to_safe_dict(d)
 
-    def update_mongo(self, asynchronous=True):
+    def update_mongo(self, asynchronous=True, outbox=False):
+        """
+        Write the Mongo document of this submission: right away, through a
+        Celery task if `asynchronous`, or, if `outbox`, by recording a
+        `MongoOutboxEntry` in the current transaction for a worker to drain.
+        """
+        if outbox:
+            # Avoid circular import
+            from onadata.apps.viewer.models.mongo_outbox import \
+                MongoOutboxEntry
+            MongoOutboxEntry.enqueue([self.instance.pk])
+            return True
+
         d = self.to_dict_for_mongo()
         if d.get("_xform_id_string") is None:
             # if _xform_id_string, Instance could not be parsed.
@@ -307,6 +347,88 @@ class ParsedInstance(models.Model):
 
         return True
 
+    @classmethod
+    def bulk_save(cls, parsed_instances):
+        """
+        Batch counterpart of `save(asynchronous=False)` for *new*
+        `ParsedInstance`s: one `INSERT`, then either one Mongo `bulk_write()`
+        or, with `settings.MONGO_OUTBOX_ENABLED`, one outbox `INSERT`. Rest
+        services are called for every submission that reached Mongo or the
+        outbox.
+
+        Mongo and rest services are only reached once the current
+        transaction commits: the submissions of a batch which gets rolled
+        back must not leave documents behind, nor be sent anywhere.
+        """
+        for parsed_instance in parsed_instances:
+            parsed_instance.start_time = None
+            parsed_instance.end_time = None
+            parsed_instance._set_geopoint()
+        cls.objects.bulk_create(parsed_instances)
+
+        if settings.MONGO_OUTBOX_ENABLED:
+            # Avoid circular import
+            from onadata.apps.viewer.models.mongo_outbox import \
+                MongoOutboxEntry
+            # Rolled back along with the submissions
+            MongoOutboxEntry.enqueue(
+                [parsed_instance.instance.pk
+                 for parsed_instance in parsed_instances])
+            transaction.on_commit(lambda: call_services(parsed_instances))
+        else:
+            def _write():
+                synced, errors = cls.bulk_update_mongo(parsed_instances)
+                call_services(synced)
+            transaction.on_commit(_write)
+
+    @staticmethod
+    def bulk_update_mongo(parsed_instances):
+        """
+        Upsert the Mongo documents of `parsed_instances` with a single
+        `bulk_write()` and flag the `Instance`s that were written as synced.
+
+        :returns: A `(synced, errors)` tuple: the `ParsedInstance`s written
+            to Mongo, and a dict mapping the id of each `Instance` that could
+            not be written to the error message.
+        """
+        records = []
+        for parsed_instance in parsed_instances:
+            d = parsed_instance.to_dict_for_mongo()
+            # See `update_mongo()`
+            if d.get("_xform_id_string") is not None:
+                records.append((parsed_instance, d))
+        if not records:
+            return [], {}
+
+        errors = {}
+        try:
+            xform_instances.bulk_write(
+                [ReplaceOne({'_id': d['_id']}, d, upsert=True)
+                 for parsed_instance, d in records],
+                ordered=False,
+            )
+        except BulkWriteError as e:
+            for error in e.details['writeErrors']:
+                parsed_instance = records[error['index']][0]
+                errors[parsed_instance.instance.pk] = error.get('errmsg', '')
+            logging.getLogger().warning(
+                'Submissions could not be saved to Mongo.', exc_info=True)
+        except Exception as e:
+            for parsed_instance, d in records:
+                errors[parsed_instance.instance.pk] = str(e)
+            logging.getLogger().error(
+                "bulk_update_mongo - {}".format(str(e)), exc_info=True)
+
+        synced = [parsed_instance for parsed_instance, d in records
+                  if parsed_instance.instance.pk not in errors]
+        Instance.objects.filter(
+            pk__in=[parsed_instance.instance.pk for parsed_instance in synced]
+        ).update(is_synced_with_mongo=True)
+        for parsed_instance in synced:
+            parsed_instance.instance.is_synced_with_mongo = True
+
+        return synced, errors
+
     @staticmethod
     def bulk_update_validation_statuses(query, validation_status):
         return xform_instances.update(
@@ -363,6 +485,7 @@ class ParsedInstance(models.Model):
             self.lng = self.instance.point.x
 
     def save(self, asynchronous=False, *args, **kwargs):
+        outbox = kwargs.pop('outbox', False)
         # start/end_time obsolete: originally used to approximate for
         # instanceID, before instanceIDs were implemented
         created = self.pk is None
@@ -370,11 +493,14 @@ class ParsedInstance(models.Model):
         self.end_time = None
         self._set_geopoint()
         super().save(*args, **kwargs)
+        if not created:
+            # e.g. new notes or tags, which are only written to Mongo
+            SubmissionChange.log(self.instance.xform_id, self.instance_id)
 
         # insert into Mongo.
         # Signal has been removed because of a race condition.
         # Rest Services were called before data was saved in DB.
-        success = self.update_mongo(asynchronous)
+        success = self.update_mongo(asynchronous, outbox)
         if success and created:
             call_service(self)
         return success
@@ -387,10 +513,31 @@ class ParsedInstance(models.Model):
         note = self.instance.notes.get(pk=pk)
         note.delete()
 
+    def _get_prefetched(self, name):
+        """
+        Related objects of the instance prefetched by bulk callers, e.g.
+        `onadata.libs.utils.mongo_rebuild`, or `None`
+        """
+        return getattr(self.instance, '_prefetched_objects_cache', {}).get(
+            name)
+
+    def get_tag_names(self):
+        tags = self._get_prefetched('tags')
+        if tags is not None:
+            return [tag.name for tag in tags]
+        return list(self.instance.tags.names())
+
     def get_notes(self):
         notes = []
-        note_qs = self.instance.notes.values(
-            'id', 'note', 'date_created', 'date_modified')
+        note_qs = self._get_prefetched('notes')
+        if note_qs is not None:
+            note_qs = [
+                dict((field, getattr(note, field)) for field in (
+                    'id', 'note', 'date_created', 'date_modified'))
+                for note in note_qs]
+        else:
+            note_qs = self.instance.notes.values(
+                'id', 'note', 'date_created', 'date_modified')
         for note in note_qs:
             note['date_created'] = \
                 note['date_created'].strftime(MONGO_STRFTIME)
@@ -1,4 +1,5 @@
 # coding: utf-8
+import csv
 import time
 from collections import OrderedDict
 from itertools import chain
@@ -35,6 +36,7 @@ from onadata.libs.utils.common_tags import (
     SUBMITTED_BY,
     VALIDATION_STATUS
 )
+from onadata.libs.utils.decorators import decode_form_field_names
 from onadata.libs.utils.export_tools import question_types_to_exclude
 
 
@@ -595,8 +597,7 @@ class CSVDataFrameBuilder(AbstractDataFrameBuilder):
                     # generated when we reindex
                 ordered_columns[child.get_abbreviated_xpath()] = None
 
-    def _format_for_dataframe(self, cursor):
-        # TODO: check for and handle empty results
+    def _add_ordered_columns_for_split_fields(self):
         # add ordered columns for select multiples
         if self.split_select_multiples:
             for key, choices in self.select_multiples.items():
@@ -607,29 +608,51 @@ class CSVDataFrameBuilder(AbstractDataFrameBuilder):
         for key in self.gps_fields:
             gps_xpaths = self.dd.get_additional_geopoint_xpaths(key)
             self.ordered_columns[key] = [key] + gps_xpaths
-        data = []
-        for record in cursor:
-            # split select multiples
-            if self.split_select_multiples:
-                record = self._split_select_multiples(
-                    record, self.select_multiples,
-                    self.BINARY_SELECT_MULTIPLES)
-            # check for gps and split into components i.e. latitude, longitude,
-            # altitude, precision
-            self._split_gps_fields(record, self.gps_fields)
-            self._tag_edit_string(record)
-            flat_dict = {}
-            # re index repeats
-            for key, value in record.items():
-                reindexed = self._reindex(key, value, self.ordered_columns)
-                flat_dict.update(reindexed)
-
-            # if delimiter is different, replace within record as well
-            if self.group_delimiter != DEFAULT_GROUP_DELIMITER:
-                flat_dict = dict((self.group_delimiter.join(k.split('/')), v)
-                                 for k, v in flat_dict.items())
-            data.append(flat_dict)
-        return data
+
+    def _format_record(self, record):
+        """
+        Flatten one record into a dict of column => value, adding the columns
+        of its repeats to `self.ordered_columns`
+        """
+        # split select multiples
+        if self.split_select_multiples:
+            record = self._split_select_multiples(
+                record, self.select_multiples,
+                self.BINARY_SELECT_MULTIPLES)
+        # check for gps and split into components i.e. latitude, longitude,
+        # altitude, precision
+        self._split_gps_fields(record, self.gps_fields)
+        self._tag_edit_string(record)
+        flat_dict = {}
+        # re index repeats
+        for key, value in record.items():
+            reindexed = self._reindex(key, value, self.ordered_columns)
+            flat_dict.update(reindexed)
+
+        # if delimiter is different, replace within record as well
+        if self.group_delimiter != DEFAULT_GROUP_DELIMITER:
+            flat_dict = dict((self.group_delimiter.join(k.split('/')), v)
+                             for k, v in flat_dict.items())
+        return flat_dict
+
+    def _format_for_dataframe(self, cursor):
+        # TODO: check for and handle empty results
+        self._add_ordered_columns_for_split_fields()
+        return [self._format_record(record) for record in cursor]
+
+    def _get_columns(self):
+        columns = list(chain.from_iterable(
+            [[xpath] if cols is None else cols
+             for xpath, cols in self.ordered_columns.items()]))
+
+        # use a different group delimiter if needed
+        if self.group_delimiter != DEFAULT_GROUP_DELIMITER:
+            columns = [self.group_delimiter.join(col.split("/"))
+                       for col in columns]
+
+        # add extra columns
+        columns += [col for col in self.ADDITIONAL_COLUMNS]
+        return columns
 
     def export_to(self, file_or_path, data_frame_max_size=30000):
         from math import ceil
@@ -653,17 +676,7 @@ class CSVDataFrameBuilder(AbstractDataFrameBuilder):
             data = self._format_for_dataframe(cursor)
             datas.append(data)
 
-        columns = list(chain.from_iterable(
-            [[xpath] if cols is None else cols
-             for xpath, cols in self.ordered_columns.items()]))
-
-        # use a different group delimiter if needed
-        if self.group_delimiter != DEFAULT_GROUP_DELIMITER:
-            columns = [self.group_delimiter.join(col.split("/"))
-                       for col in columns]
-
-        # add extra columns
-        columns += [col for col in self.ADDITIONAL_COLUMNS]
+        columns = self._get_columns()
 
         header = True
         if hasattr(file_or_path, 'read'):
@@ -681,6 +694,182 @@ class CSVDataFrameBuilder(AbstractDataFrameBuilder):
             csv_file.close()
 
 
+class CSVStreamingBuilder(CSVDataFrameBuilder):
+    """
+    Writes the same CSV as `CSVDataFrameBuilder` without building
+    DataFrames, so memory use does not grow with the number of submissions.
+
+    Submissions are read twice, in `_id` order: the first pass discovers the
+    repeat columns (and which numeric columns pandas would have turned into
+    floats), the second one writes each row as soon as it is formatted.
+    """
+
+    def _iterate_records(self, first_id=None, last_id=None):
+        query = ParsedInstance._get_mongo_cursor_query(
+            self.filter_query, self.username, self.id_string)
+        id_range = {}
+        if first_id is not None:
+            id_range['$gte'] = first_id
+        if last_id is not None:
+            id_range['$lte'] = last_id
+        if id_range:
+            query = {'$and': [query, {'_id': id_range}]}
+        field_names = self.dd.get_mongo_field_names_dict()
+        last_seen_id = None
+        while True:
+            records = 0
+            cursor = ParsedInstance.query_mongo_keyset(
+                query, '[]', last_seen_id, ParsedInstance.DEFAULT_BATCHSIZE)
+            for record in cursor:
+                records += 1
+                last_seen_id = record['_id']
+                yield decode_form_field_names(record, field_names)
+            if records < ParsedInstance.DEFAULT_BATCHSIZE:
+                break
+
+    @staticmethod
+    def _is_missing(value):
+        # NaN is the only value which is not equal to itself
+        return value is None or (isinstance(value, float) and value != value)
+
+    @classmethod
+    def _update_numeric_columns(cls, flat_dict, numeric_columns):
+        """
+        Keep track, for one chunk of `data_frame_max_size` records, of the
+        columns holding only numbers: `[number of values, has floats]`, or
+        `None` once any other value shows up
+        """
+        for column, value in flat_dict.items():
+            if cls._is_missing(value):
+                continue
+            stats = numeric_columns.setdefault(column, [0, False])
+            if stats is None:
+                continue
+            if isinstance(value, bool) or \
+                    not isinstance(value, (int, float)):
+                numeric_columns[column] = None
+            else:
+                stats[0] += 1
+                stats[1] = stats[1] or isinstance(value, float)
+
+    def init_ordered_columns(self):
+        self.ordered_columns = OrderedDict()
+        self._build_ordered_columns(self.dd.survey, self.ordered_columns)
+        self._add_ordered_columns_for_split_fields()
+
+    def discover_columns(self, first_id=None, last_id=None,
+                         data_frame_max_size=30000):
+        """
+        First pass over the submissions whose `_id` is between `first_id`
+        and `last_id`: add their repeat columns to `self.ordered_columns`.
+
+        pandas casts integers to floats in a column which also has floats or
+        missing values, one DataFrame of `data_frame_max_size` records at a
+        time; the columns to cast are returned too, as one set per chunk.
+
+        :returns: The list of columns to cast for each chunk, and the `_id`
+            of the last submission, or `None` if there is none.
+        """
+        self.init_ordered_columns()
+        float_columns = []
+        chunk_size = 0
+        max_id = None
+        for record in self._iterate_records(first_id, last_id):
+            if chunk_size % data_frame_max_size == 0:
+                numeric_columns = {}
+                float_columns.append(numeric_columns)
+                chunk_size = 0
+            max_id = record['_id']
+            self._update_numeric_columns(
+                self._format_record(record), numeric_columns)
+            chunk_size += 1
+        for index, numeric_columns in enumerate(float_columns):
+            size = data_frame_max_size \
+                if index < len(float_columns) - 1 else chunk_size
+            float_columns[index] = set(
+                column for column, stats in numeric_columns.items()
+                if stats is not None and (stats[1] or stats[0] < size))
+        return float_columns, max_id
+
+    def merge_ordered_columns(self, ordered_columns):
+        """
+        Add the repeat columns discovered by another builder, e.g. for
+        another range of submissions, to `self.ordered_columns`
+        """
+        for key, columns in ordered_columns:
+            if isinstance(self.ordered_columns.get(key), list):
+                for column in columns:
+                    if column not in self.ordered_columns[key]:
+                        self.ordered_columns[key].append(column)
+
+    def get_csv_columns(self):
+        return [col for col in self._get_columns()
+                if col not in self.IGNORED_COLUMNS]
+
+    def write_rows(self, csv_file, columns, float_columns, first_id=None,
+                   last_id=None, data_frame_max_size=30000, first_index=0,
+                   limit=None):
+        """
+        Second pass: write the submissions whose `_id` is between `first_id`
+        and `last_id` to `csv_file`, without header
+
+        :param first_index: Position of the first of these submissions within
+            the whole export, to pick the right chunk of `float_columns`
+        :param limit: Maximum number of submissions to write
+        :returns: The number of rows written, and the `_id` of the last one
+        """
+        float_columns = [set(chunk) for chunk in float_columns] or [set()]
+        na_rep = getattr(settings, 'NA_REP', NA_REP)
+        # Same dialect as `DataFrame.to_csv()`
+        writer = csv.writer(csv_file, lineterminator='\n')
+        rows = 0
+        last_written_id = None
+        for record in self._iterate_records(first_id, last_id):
+            if limit is not None and rows >= limit:
+                break
+            chunk_float_columns = float_columns[min(
+                (first_index + rows) // data_frame_max_size,
+                len(float_columns) - 1)]
+            last_written_id = record['_id']
+            flat_dict = self._format_record(record)
+            row = []
+            for column in columns:
+                value = flat_dict.get(column)
+                if self._is_missing(value):
+                    value = na_rep
+                elif column in chunk_float_columns:
+                    value = float(value)
+                row.append(value)
+            writer.writerow(row)
+            rows += 1
+        return rows, last_written_id
+
+    def export_to(self, file_or_path, data_frame_max_size=30000):
+        # get record count, or raise `NoRecordsFoundError`
+        self._query_mongo(query=self.filter_query, count=True)
+
+        float_columns, max_id = self.discover_columns(
+            data_frame_max_size=data_frame_max_size)
+        if max_id is None:
+            raise NoRecordsFoundError("No records found for your query")
+        columns = self.get_csv_columns()
+
+        if hasattr(file_or_path, 'read'):
+            csv_file = file_or_path
+            close = False
+        else:
+            csv_file = open(file_or_path, "w")
+            close = True
+
+        csv.writer(csv_file, lineterminator='\n').writerow(columns)
+        # ignore submissions received since the first pass; their repeat
+        # columns may not be in the header
+        self.write_rows(csv_file, columns, float_columns, last_id=max_id,
+                        data_frame_max_size=data_frame_max_size)
+        if close:
+            csv_file.close()
+
+
 class XLSDataFrameWriter:
     def __init__(self, records, columns):
         self.dataframe = DataFrame(records, columns=columns)
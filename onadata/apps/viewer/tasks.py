@@ -3,10 +3,12 @@ import logging
 import pytz
 import re
 import sys
-from celery import task, shared_task
+from celery import chord, task, shared_task
+from celery.exceptions import SoftTimeLimitExceeded
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.core.mail import mail_admins
+from django.db.models import F
 from requests import ConnectionError
 
 from onadata.apps.viewer.models.export import Export
@@ -17,6 +19,18 @@ from onadata.libs.utils.export_tools import (
     generate_kml_export
 )
 from onadata.libs.utils.logger_tools import mongo_sync_status, report_exception
+from onadata.libs.utils import incremental_export, sharded_export
+from onadata.libs.utils.checkpointed_export import \
+    generate_checkpointed_export
+
+
+def _appends_to_previous_export(xform, export_type, arguments):
+    if not incremental_export.is_incremental(export_type,
+                                             arguments['query']):
+        return False
+    options = sharded_export.get_export_options(**arguments)
+    return incremental_export.get_base_export(xform, options) is not None
+
 
 def create_async_export(xform, export_type, query, force_xlsx, options=None):
     username = xform.user.username
@@ -45,7 +59,14 @@ def create_async_export(xform, export_type, query, force_xlsx, options=None):
                 options["binary_select_multiples"]
 
         # start async export
-        if export_type == Export.XLS_EXPORT:
+        if (settings.SHARDED_EXPORT_MIN_SUBMISSIONS and
+                xform.num_of_submissions >=
+                settings.SHARDED_EXPORT_MIN_SUBMISSIONS and
+                not _appends_to_previous_export(xform, export_type,
+                                                arguments)):
+            result = create_sharded_export.apply_async(
+                (export_type,), arguments, countdown=10)
+        elif export_type == Export.XLS_EXPORT:
             result = create_xls_export.apply_async((), arguments, countdown=10)
         elif export_type == Export.CSV_EXPORT:
             result = create_csv_export.apply_async(
@@ -74,8 +95,69 @@ def create_async_export(xform, export_type, query, force_xlsx, options=None):
     return None
 
 
-@task()
-def create_xls_export(username, id_string, export_id, query=None,
+def _generate_export(export_type, extension, username, id_string, export_id,
+                     query, group_delimiter, split_select_multiples,
+                     binary_select_multiples):
+    # Incremental exports are only checkpointed when rebuilt; appending to
+    # the previous export beats checkpointing a new one
+    if (settings.EXPORT_CHECKPOINT_ROWS and extension != 'xls' and
+            not incremental_export.is_incremental(export_type, query)):
+        options = sharded_export.get_export_options(
+            username, id_string, export_id, query, group_delimiter,
+            split_select_multiples, binary_select_multiples)
+        return generate_checkpointed_export(
+            export_type, options, settings.EXPORT_CHECKPOINT_ROWS)
+    return generate_export(
+        export_type, extension, username, id_string, export_id, query,
+        group_delimiter, split_select_multiples, binary_select_multiples)
+
+
+def _resume_if_interrupted(export_task, exception):
+    """
+    Retry an export which hit the soft time limit; it resumes from its
+    checkpoint
+    """
+    if (settings.EXPORT_CHECKPOINT_ROWS and
+            isinstance(exception, SoftTimeLimitExceeded) and
+            export_task.request.retries < export_task.max_retries):
+        raise export_task.retry(exc=exception, countdown=0)
+
+
+def _start_attempt(export):
+    """
+    Count a run of the task of `export`, including redeliveries after its
+    worker died, which `request.retries` does not count
+
+    :returns: Whether the export may run, i.e. whether it did not run
+        `EXPORT_MAX_ATTEMPTS` times already
+    """
+    if not settings.EXPORT_CHECKPOINT_ROWS:
+        return True
+    # Committed right away: a worker killed by the export still counts
+    Export.objects.filter(pk=export.pk).update(attempts=F('attempts') + 1)
+    export.refresh_from_db(fields=['attempts'])
+    if export.attempts <= settings.EXPORT_MAX_ATTEMPTS:
+        return True
+    export.internal_status = Export.FAILED
+    export.save()
+    report_exception("Export Exception: Export ID - %s, gave up after %d "
+                     "attempts" % (export.pk, export.attempts - 1),
+                     "The export may kill its worker, e.g. out of memory")
+    return False
+
+
+# With checkpoints, `acks_late` and `reject_on_worker_lost` get the task
+# redelivered, and resumed from its checkpoint, when its worker dies, up to
+# `EXPORT_MAX_ATTEMPTS` times. Without, an export which kills its worker
+# would start over from scratch, forever
+EXPORT_TASK_OPTIONS = {
+    'acks_late': bool(settings.EXPORT_CHECKPOINT_ROWS),
+    'reject_on_worker_lost': bool(settings.EXPORT_CHECKPOINT_ROWS),
+}
+
+
+@task(bind=True, **EXPORT_TASK_OPTIONS)
+def create_xls_export(self, username, id_string, export_id, query=None,
                       force_xlsx=True, group_delimiter='/',
                       split_select_multiples=True,
                       binary_select_multiples=False):
@@ -88,14 +170,17 @@ def create_xls_export(username, id_string, export_id, query=None,
     except Export.DoesNotExist:
         # no export for this ID return None.
         return None
+    if not _start_attempt(export):
+        return None
 
     # though export is not available when for has 0 submissions, we
     # catch this since it potentially stops celery
     try:
-        gen_export = generate_export(
+        gen_export = _generate_export(
             Export.XLS_EXPORT, ext, username, id_string, export_id, query,
             group_delimiter, split_select_multiples, binary_select_multiples)
     except (Exception, NoRecordsFoundError) as e:
+        _resume_if_interrupted(self, e)
         export.internal_status = Export.FAILED
         export.save()
         # mail admins
@@ -114,17 +199,19 @@ def create_xls_export(username, id_string, export_id, query=None,
         return gen_export.id
 
 
-@task()
-def create_csv_export(username, id_string, export_id, query=None,
+@task(bind=True, **EXPORT_TASK_OPTIONS)
+def create_csv_export(self, username, id_string, export_id, query=None,
                       group_delimiter='/', split_select_multiples=True,
                       binary_select_multiples=False):
     # we re-query the db instead of passing model objects according to
     # http://docs.celeryproject.org/en/latest/userguide/tasks.html#state
     export = Export.objects.get(id=export_id)
+    if not _start_attempt(export):
+        return None
     try:
         # though export is not available when for has 0 submissions, we
         # catch this since it potentially stops celery
-        gen_export = generate_export(
+        gen_export = _generate_export(
             Export.CSV_EXPORT, 'csv', username, id_string, export_id, query,
             group_delimiter, split_select_multiples, binary_select_multiples)
     except NoRecordsFoundError:
@@ -133,6 +220,7 @@ def create_csv_export(username, id_string, export_id, query=None,
         export.internal_status = Export.FAILED
         export.save()
     except Exception as e:
+        _resume_if_interrupted(self, e)
         export.internal_status = Export.FAILED
         export.save()
         # mail admins
@@ -149,6 +237,92 @@ def create_csv_export(username, id_string, export_id, query=None,
         return gen_export.id
 
 
+@task()
+def create_sharded_export(export_type, username, id_string, export_id,
+                          query=None, group_delimiter='/',
+                          split_select_multiples=True,
+                          binary_select_multiples=False):
+    """
+    Render a CSV or XLSX export in shards of `EXPORT_SHARD_SIZE` submissions,
+    each by its own worker; see `onadata.libs.utils.sharded_export`
+    """
+    options = sharded_export.get_export_options(
+        username, id_string, export_id, query, group_delimiter,
+        split_select_multiples, binary_select_multiples)
+    shards = sharded_export.get_shards(options, settings.EXPORT_SHARD_SIZE)
+    if not shards:
+        Export.objects.filter(pk=export_id).update(
+            internal_status=Export.FAILED)
+        return None
+
+    on_error = mark_sharded_export_failed.si(options)
+    if export_type == Export.CSV_EXPORT:
+        # Every shard must know the repeat columns of all the others before
+        # writing its rows, hence two chords
+        chord(
+            discover_csv_export_shard.s(options, first_id, last_id)
+            for first_id, last_id in shards
+        )(plan_csv_export_shards.s(options, shards).on_error(on_error))
+    elif export_type == Export.XLS_EXPORT:
+        chord(
+            write_xls_export_shard.s(options, number, first_id, last_id)
+            for number, (first_id, last_id) in enumerate(shards)
+        )(merge_xls_export_shards.s(options).on_error(on_error))
+    else:
+        raise Export.ExportTypeError
+    return len(shards)
+
+
+@task()
+def discover_csv_export_shard(options, first_id, last_id):
+    return sharded_export.discover_csv_shard(options, first_id, last_id)
+
+
+@task()
+def plan_csv_export_shards(discoveries, options, shards):
+    columns = sharded_export.get_csv_columns(options, discoveries)
+    chord(
+        write_csv_export_shard.s(
+            options, number, first_id, last_id, columns,
+            discoveries[number]['float_columns'])
+        for number, (first_id, last_id) in enumerate(shards)
+    )(concatenate_csv_export_shards.s(options, columns).on_error(
+        mark_sharded_export_failed.si(options)))
+
+
+@task()
+def write_csv_export_shard(options, number, first_id, last_id, columns,
+                           float_columns):
+    return sharded_export.write_csv_shard(
+        options, number, first_id, last_id, columns, float_columns)
+
+
+@task()
+def concatenate_csv_export_shards(shard_paths, options, columns):
+    return sharded_export.concatenate_csv_shards(
+        options, columns, shard_paths).id
+
+
+@task()
+def write_xls_export_shard(options, number, first_id, last_id):
+    return sharded_export.write_xls_shard(options, number, first_id, last_id)
+
+
+@task()
+def merge_xls_export_shards(shards, options):
+    return sharded_export.merge_xls_shards(options, shards).id
+
+
+@task()
+def mark_sharded_export_failed(options):
+    Export.objects.filter(pk=options['export_id']).update(
+        internal_status=Export.FAILED)
+    sharded_export.delete_shards(options)
+    report_exception("Sharded Export Exception: Export ID - "
+                     "%(export_id)s, /%(username)s/%(id_string)s" % options,
+                     "A shard of this export failed, see the worker logs")
+
+
 @task()
 def create_kml_export(username, id_string, export_id, query=None):
     # we re-query the db instead of passing model objects according to
@@ -242,7 +416,8 @@ def email_mongo_sync_status():
     before_report = mongo_sync_status()
     if REMONGO_PATTERN.search(before_report):
         # synchronization is necessary
-        after_report = mongo_sync_status(remongo=True)
+        # Celery workers are daemonic processes: parse in this one
+        after_report = mongo_sync_status(remongo=True, workers=0)
     else:
         # no synchronization is needed
         after_report = "No synchronization needed"
@@ -267,6 +442,9 @@ def log_stuck_exports_and_mark_failed():
     stuck_exports = Export.objects.filter(
         internal_status=Export.PENDING,
         created_on__lt=oldest_allowed_timestamp
+    ).exclude(
+        # resumable exports are only stuck once they stop making progress
+        checkpoint_updated__gte=oldest_allowed_timestamp
     )
     for stuck_export in stuck_exports:
         logging.warning(
@@ -283,4 +461,21 @@ def log_stuck_exports_and_mark_failed():
         stuck_exports.filter(pk=stuck_export.pk).update(
             internal_status=Export.FAILED)
 
-        
\ No newline at end of file
+
+@shared_task(soft_time_limit=60, time_limit=90)
+def drain_mongo_outbox():
+    """
+    Write one batch of pending Mongo documents; see `MongoOutboxEntry`.
+    Also scheduled periodically to retry the entries which failed.
+    """
+    from onadata.apps.viewer.models.mongo_outbox import MongoOutboxEntry
+    return MongoOutboxEntry.drain(settings.MONGO_OUTBOX_BATCH_SIZE)
+
+
+@shared_task(soft_time_limit=60, time_limit=90)
+def evict_export_cache():
+    """
+    Delete expired filtered exports; see `onadata.libs.utils.export_cache`
+    """
+    from onadata.libs.utils.export_cache import evict
+    evict()
@@ -1,9 +1,16 @@
 # coding: utf-8
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from guardian.shortcuts import assign_perm, remove_perm
 
 from onadata.apps.main.tests.test_base import TestBase
 from onadata.apps.logger.models import Attachment
 from onadata.apps.viewer.views import attachment_url
+from onadata.libs.constants import CAN_VIEW_XFORM
+from onadata.libs.utils.attachment_lookup import attachment_lookup_cache
 from onadata.libs.utils.storage import delete_user_storage
 
 
@@ -17,6 +24,9 @@ class TestAttachmentUrl(TestBase):
         self._submit_transport_instance_w_attachment()
         self.url = reverse(
             'attachment_url', kwargs={'size': 'original'})
+        attachment_lookup_cache.clear()
+        self.legacy_media_file = '%s/attachments/%s' % (
+            self.user.username, self.attachment.media_file_basename)
 
     def test_attachment_url(self):
         self.assertEqual(
@@ -34,6 +44,68 @@ class TestAttachmentUrl(TestBase):
         attachment = Attachment.objects.all().reverse()[0]
         self.assertEqual(attachment.mimetype, 'image/jpeg')
 
+    def test_attachment_url_by_owner_and_file_name(self):
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.owner, self.user)
+        response = self.client.get(
+            self.url, {"media_file": self.legacy_media_file})
+        self.assertEqual(response.status_code, 200)
+
+    def test_attachment_without_owner(self):
+        Attachment.objects.update(owner=None, media_file_basename=None)
+        with override_settings(ATTACHMENT_LOOKUP_LEGACY_FALLBACK=False):
+            response = self.client.get(
+                self.url, {"media_file": self.legacy_media_file})
+            self.assertEqual(response.status_code, 404)
+        response = self.client.get(
+            self.url, {"media_file": self.legacy_media_file})
+        self.assertEqual(response.status_code, 200)
+
+        attachment_lookup_cache.clear()
+        call_command('populate_media_file_basename')
+        self.attachment.refresh_from_db()
+        self.assertEqual(self.attachment.owner, self.user)
+        self.assertEqual(self.attachment.media_file_basename,
+                         self.attachment.filename)
+        with override_settings(ATTACHMENT_LOOKUP_LEGACY_FALLBACK=False):
+            response = self.client.get(
+                self.url, {"media_file": self.legacy_media_file})
+            self.assertEqual(response.status_code, 200)
+
+    def test_repeated_views_skip_joins(self):
+        with CaptureQueriesContext(connection) as first_view:
+            self.client.get(
+                self.url, {"media_file": self.attachment_media_file})
+        with CaptureQueriesContext(connection) as second_view:
+            response = self.client.get(
+                self.url, {"media_file": self.attachment_media_file})
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(second_view), len(first_view))
+        for query in second_view.captured_queries:
+            self.assertNotIn('logger_instance', query['sql'])
+
+    def test_shared_form_is_not_cached_as_private(self):
+        response = self.anon.get(
+            self.url, {"media_file": self.attachment_media_file})
+        self.assertEqual(response.status_code, 403)
+        self.xform.shared_data = True
+        self.xform.save()
+        response = self.anon.get(
+            self.url, {"media_file": self.attachment_media_file})
+        self.assertEqual(response.status_code, 200)
+
+    def test_revoked_permission_is_not_honored(self):
+        alice = self._create_user('alice', 'alice')
+        client = self._login('alice', 'alice')
+        assign_perm(CAN_VIEW_XFORM, alice, self.xform)
+        response = client.get(
+            self.url, {"media_file": self.attachment_media_file})
+        self.assertEqual(response.status_code, 200)
+        remove_perm(CAN_VIEW_XFORM, alice, self.xform)
+        response = client.get(
+            self.url, {"media_file": self.attachment_media_file})
+        self.assertEqual(response.status_code, 403)
+
     def tearDown(self):
         if self.user:
             delete_user_storage(self.user.username)
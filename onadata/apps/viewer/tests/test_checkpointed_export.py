@@ -0,0 +1,110 @@
+# coding: utf-8
+from celery.exceptions import SoftTimeLimitExceeded
+from django.core.files.storage import get_storage_class
+from django.test import override_settings
+from mock import patch
+from openpyxl import load_workbook
+
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.tasks import create_csv_export, create_xls_export
+from onadata.libs.utils.checkpointed_export import generate_checkpointed_export
+from onadata.libs.utils.export_tools import generate_export
+from onadata.libs.utils.sharded_export import get_export_options, save_shard
+
+
+class TestCheckpointedExport(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self._make_submissions()
+
+    def _interrupted_export(self, export_type):
+        """
+        Start an export which gets interrupted after two submissions
+        """
+        export = Export.objects.create(xform=self.xform,
+                                       export_type=export_type)
+        options = get_export_options(self.user.username, self.xform.id_string,
+                                     export.pk)
+        parts = []
+
+        def _save_two_parts(*args, **kwargs):
+            if len(parts) == 2:
+                raise SoftTimeLimitExceeded()
+            parts.append(save_shard(*args, **kwargs))
+            return parts[-1]
+
+        with patch('onadata.libs.utils.checkpointed_export.save_shard',
+                   side_effect=_save_two_parts):
+            with self.assertRaises(SoftTimeLimitExceeded):
+                generate_checkpointed_export(export_type, options, 1)
+
+        export.refresh_from_db()
+        self.assertEqual(export.status, Export.PENDING)
+        self.assertEqual(export.rows_done, 2)
+        self.assertEqual(export.rows_total, 4)
+        self.assertEqual(export.checkpoint['parts'], parts)
+        ids = sorted(self.xform.instances.values_list('pk', flat=True))
+        self.assertEqual(export.checkpoint_last_id, ids[1])
+        return options
+
+    def test_csv_export_resumes_from_checkpoint(self):
+        options = self._interrupted_export(Export.CSV_EXPORT)
+        export = generate_checkpointed_export(Export.CSV_EXPORT, options, 1)
+        self.assertEqual(export.status, Export.SUCCESSFUL)
+        export.refresh_from_db()
+        self.assertEqual(export.rows_done, 4)
+        self.assertIsNone(export.checkpoint)
+
+        with override_settings(CSV_EXPORT_ENGINE='streaming'):
+            expected = generate_export(Export.CSV_EXPORT, 'csv',
+                                       self.user.username,
+                                       self.xform.id_string)
+        storage = get_storage_class()()
+        with storage.open(export.filepath) as f:
+            content = f.read()
+        with storage.open(expected.filepath) as f:
+            self.assertEqual(content, f.read())
+
+    def test_xlsx_export_resumes_from_checkpoint(self):
+        options = self._interrupted_export(Export.XLS_EXPORT)
+        export = generate_checkpointed_export(Export.XLS_EXPORT, options, 1)
+        self.assertEqual(export.status, Export.SUCCESSFUL)
+
+        expected = generate_export(Export.XLS_EXPORT, 'xlsx',
+                                   self.user.username, self.xform.id_string)
+        storage = get_storage_class()()
+        workbook = load_workbook(storage.path(export.filepath))
+        expected_workbook = load_workbook(storage.path(expected.filepath))
+        for name in expected_workbook.sheetnames:
+            self.assertEqual(
+                list(workbook[name].values),
+                list(expected_workbook[name].values))
+
+    def test_tasks_are_not_redelivered_without_checkpoints(self):
+        # An export killing its worker would start over from scratch forever
+        for export_task in (create_csv_export, create_xls_export):
+            self.assertFalse(export_task.acks_late)
+            self.assertFalse(export_task.reject_on_worker_lost)
+
+    @override_settings(EXPORT_CHECKPOINT_ROWS=1, EXPORT_MAX_ATTEMPTS=2)
+    def test_export_is_given_up_after_too_many_attempts(self):
+        export = Export.objects.create(xform=self.xform,
+                                       export_type=Export.CSV_EXPORT)
+        self.assertIsNotNone(create_csv_export(
+            self.user.username, self.xform.id_string, export.pk))
+        export.refresh_from_db()
+        self.assertEqual(export.attempts, 1)
+
+        # e.g. redelivered again after its worker got killed
+        Export.objects.filter(pk=export.pk).update(
+            attempts=2, internal_status=Export.PENDING)
+        with patch('onadata.apps.viewer.tasks._generate_export') as generate:
+            self.assertIsNone(create_csv_export(
+                self.user.username, self.xform.id_string, export.pk))
+        generate.assert_not_called()
+        export.refresh_from_db()
+        self.assertEqual(export.attempts, 3)
+        self.assertEqual(export.internal_status, Export.FAILED)
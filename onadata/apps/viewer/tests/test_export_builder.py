@@ -1,4 +1,5 @@
 # coding: utf-8
+import copy
 import csv
 import datetime
 import os
@@ -797,3 +798,26 @@ class TestExportBuilder(TestBase):
         converted_val = ExportBuilder.convert_type(val, 'date')
         self.assertIsInstance(converted_val, datetime.date)
         self.assertEqual(converted_val, expected_val)
+
+    def test_section_plans_match_pre_process_row(self):
+        survey = self._create_childrens_survey()
+        export_builder = ExportBuilder()
+        export_builder.set_survey(survey)
+        data = self.data + [{'name': 'Ben', 'children': [
+            {'children/name': 'Ann', 'children/fav_colors': ' '}]}]
+        for section, plan in zip(export_builder.sections,
+                                 export_builder.section_plans):
+            self.assertEqual(plan.name, section['name'])
+            indices = {}
+            for index, d in enumerate(data, start=1):
+                expected = ExportBuilder.decode_mongo_encoded_section_names(
+                    dict_to_joined_export(d, index, indices, survey.name))
+                output = copy.deepcopy(expected)
+                rows = output.get(section['name'])
+                expected_rows = expected.get(section['name'])
+                if type(rows) == dict:
+                    rows, expected_rows = [rows], [expected_rows]
+                for row, expected_row in zip(rows or [], expected_rows or []):
+                    self.assertEqual(
+                        plan.process(row),
+                        export_builder.pre_process_row(expected_row, section))
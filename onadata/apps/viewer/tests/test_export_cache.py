@@ -0,0 +1,170 @@
+# coding: utf-8
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.core.files.storage import get_storage_class
+from django.db import connection, transaction
+from django.test import override_settings
+from django.utils import timezone
+from mock import patch
+
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.export_cache import ExportCacheEntry
+from onadata.libs.utils import export_cache
+from onadata.libs.utils.export_cache import (
+    generate_cached_export,
+    get_cache_key,
+    normalize_query,
+)
+
+QUERY = '{"_submission_time": {"$gte": "2000-01-01T00:00:00"}}'
+OTHER_QUERY = '{"_submission_time": {"$gte": "2001-01-01T00:00:00"}}'
+OPTIONS = {
+    'group_delimiter': '/',
+    'split_select_multiples': True,
+    'binary_select_multiples': False,
+}
+
+
+class TestExportCache(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self._make_submissions()
+
+    def _generate(self, query=QUERY):
+        with patch('onadata.libs.utils.export_cache.generate_export',
+                   wraps=export_cache.generate_export) as generate_export:
+            export = generate_cached_export(Export.CSV_EXPORT, 'csv',
+                                            self.xform, query)
+        return export, generate_export.call_count
+
+    def test_normalize_query(self):
+        self.assertEqual(normalize_query('{"b": 1, "a": {"$gt": 2}}'),
+                         normalize_query({'a': {'$gt': 2}, 'b': 1}))
+        self.assertEqual(normalize_query(None), normalize_query('{}'))
+
+    def test_identical_requests_generate_once(self):
+        export, calls = self._generate()
+        self.assertEqual(calls, 1)
+        cached_export, calls = self._generate()
+        self.assertEqual(calls, 0)
+        self.assertEqual(cached_export.filepath, export.filepath)
+
+        _, calls = self._generate(OTHER_QUERY)
+        self.assertEqual(calls, 1)
+        self.assertEqual(ExportCacheEntry.objects.count(), 2)
+
+    def test_new_submission_changes_key(self):
+        key = get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                            OPTIONS)
+        self._make_submission(os.path.join(
+            self.this_directory, 'fixtures', 'transportation', 'instances',
+            self.surveys[0], self.surveys[0] + '.xml'))
+        self.assertNotEqual(
+            get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                          OPTIONS), key)
+
+    @override_settings(SUBMISSION_COUNTER_BUFFER_ENABLED=True)
+    def test_new_submission_changes_key_with_buffered_counters(self):
+        key = get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                            OPTIONS)
+        # Counters are only buffered once the transaction commits, which it
+        # never does in tests: they lag behind
+        self._make_submission(os.path.join(
+            self.this_directory, 'fixtures', 'transportation', 'instances',
+            self.surveys[0], self.surveys[0] + '.xml'))
+        self.assertNotEqual(
+            get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                          OPTIONS), key)
+
+    def test_deleted_submission_changes_key(self):
+        key = get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                            OPTIONS)
+        self.xform.instances.earliest('pk').delete()
+        self.assertNotEqual(
+            get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                          OPTIONS), key)
+
+    def test_expired_entries_are_regenerated(self):
+        export, _ = self._generate()
+        ExportCacheEntry.objects.update(
+            date_created=timezone.now() - timedelta(days=1))
+        _, calls = self._generate()
+        self.assertEqual(calls, 1)
+        self.assertFalse(get_storage_class()().exists(export.filepath))
+
+    @override_settings(EXPORT_CACHE_MAX_SIZE=1)
+    def test_least_recently_used_entries_are_evicted(self):
+        export, _ = self._generate()
+        self._generate(OTHER_QUERY)
+        self.assertEqual(ExportCacheEntry.objects.count(), 1)
+        self.assertFalse(get_storage_class()().exists(export.filepath))
+
+    def _lock_in_another_thread(self, release):
+        """
+        Hold the lock of the key of the export, like an identical request
+        generating it, on the connection of another thread until `release`
+        is set
+        """
+        key = get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                            OPTIONS)
+        locked = threading.Event()
+
+        def hold():
+            try:
+                with transaction.atomic():
+                    export_cache._try_lock(key)
+                    locked.set()
+                    release.wait()
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        locked.wait()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+
+    @override_settings(EXPORT_CACHE_WAIT_TIMEOUT=0)
+    def test_locked_export_is_not_waited_for_forever(self):
+        self._lock_in_another_thread(threading.Event())
+        _, calls = self._generate()
+        self.assertEqual(calls, 1)
+        # Left to the request holding the lock
+        self.assertFalse(ExportCacheEntry.objects.exists())
+
+    @patch('onadata.libs.utils.export_cache.POLL_INTERVAL', 0.1)
+    def test_export_is_taken_over_when_the_lock_is_released(self):
+        release = threading.Event()
+        self._lock_in_another_thread(release)
+        # The other request fails, after a while
+        threading.Timer(0.5, release.set).start()
+        started = time.time()
+        _, calls = self._generate()
+        self.assertGreaterEqual(time.time() - started, 0.5)
+        self.assertEqual(calls, 1)
+        self.assertEqual(ExportCacheEntry.objects.get().status,
+                         ExportCacheEntry.READY)
+
+    def test_abandoned_pending_export_is_taken_over(self):
+        ExportCacheEntry.objects.create(
+            key=get_cache_key(self.xform, Export.CSV_EXPORT, 'csv', QUERY,
+                              OPTIONS),
+            xform=self.xform, export_type=Export.CSV_EXPORT,
+            date_created=timezone.now() - timedelta(days=1))
+        _, calls = self._generate()
+        self.assertEqual(calls, 1)
+        self.assertEqual(ExportCacheEntry.objects.get().status,
+                         ExportCacheEntry.READY)
+
+    @override_settings(EXPORT_CACHE_TTL=0)
+    def test_disabled_cache(self):
+        self._generate()
+        _, calls = self._generate()
+        self.assertEqual(calls, 1)
+        self.assertFalse(ExportCacheEntry.objects.exists())
@@ -244,7 +244,8 @@ class TestExports(TestBase):
         response = self.client.get(progress_url, get_data)
         content = json.loads(response.content)
         self.assertEqual(len(content), 2)
-        self.assertEqual(sorted(['url', 'export_id', 'complete', 'filename']),
+        self.assertEqual(sorted(['url', 'export_id', 'complete', 'filename',
+                                 'rows_done', 'rows_total']),
                          sorted(content[0].keys()))
 
     def test_dont_auto_export_if_exports_exist(self):
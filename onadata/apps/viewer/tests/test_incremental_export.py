@@ -0,0 +1,113 @@
+# coding: utf-8
+import os
+
+from django.core.files.storage import get_storage_class
+from django.test import override_settings
+from mock import patch
+
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.parsed_instance import xform_instances
+from onadata.libs.utils import incremental_export
+from onadata.libs.utils.export_tools import generate_export
+
+
+@override_settings(CSV_EXPORT_INCREMENTAL=True)
+class TestIncrementalExport(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self.paths = [os.path.join(
+            self.this_directory, 'fixtures', 'transportation',
+            'instances', s, s + '.xml') for s in self.surveys]
+        for path in self.paths[:2]:
+            self._make_submission(path)
+
+    def _generate_export(self):
+        with patch('onadata.libs.utils.incremental_export._write_all_rows',
+                   wraps=incremental_export._write_all_rows) as write_all:
+            export = generate_export(Export.CSV_EXPORT, 'csv',
+                                     self.user.username, self.xform.id_string)
+        return export, write_all.called
+
+    def _read(self, export):
+        with get_storage_class()().open(export.filepath) as f:
+            return f.read()
+
+    def _full_export(self):
+        with override_settings(CSV_EXPORT_INCREMENTAL=False,
+                               CSV_EXPORT_ENGINE='streaming'):
+            return self._read(generate_export(
+                Export.CSV_EXPORT, 'csv', self.user.username,
+                self.xform.id_string))
+
+    def test_new_submissions_are_appended(self):
+        export, rebuilt = self._generate_export()
+        self.assertTrue(rebuilt)
+        self.assertEqual(export.high_water_mark,
+                         self.xform.instances.latest('pk').pk)
+
+        for path in self.paths[2:]:
+            self._make_submission(path)
+        export, rebuilt = self._generate_export()
+        self.assertFalse(rebuilt)
+        self.assertEqual(export.high_water_mark,
+                         self.xform.instances.latest('pk').pk)
+        self.assertEqual(self._read(export), self._full_export())
+
+    def test_deleting_an_exported_submission_rebuilds(self):
+        self._generate_export()
+        self.xform.instances.earliest('pk').delete()
+        self._make_submission(self.paths[2])
+
+        export, rebuilt = self._generate_export()
+        self.assertTrue(rebuilt)
+        self.assertEqual(self._read(export), self._full_export())
+
+    def test_late_mongo_document_rebuilds(self):
+        # The document of the first submission is written to Mongo after the
+        # export, e.g. by the Mongo outbox or `remongo`
+        instance = self.xform.instances.earliest('pk')
+        xform_instances.delete_one({'_id': instance.pk})
+        export, _ = self._generate_export()
+        self.assertEqual(export.incremental_state['rows'], 1)
+        instance.parsed_instance.update_mongo(asynchronous=False)
+        self._make_submission(self.paths[2])
+
+        export, rebuilt = self._generate_export()
+        self.assertTrue(rebuilt)
+        self.assertEqual(export.incremental_state['rows'], 3)
+        self.assertEqual(self._read(export), self._full_export())
+
+    @override_settings(EXPORT_CHECKPOINT_ROWS=1)
+    def test_rebuild_is_checkpointed(self):
+        export = Export.objects.create(xform=self.xform,
+                                       export_type=Export.CSV_EXPORT)
+        with patch('onadata.libs.utils.incremental_export.'
+                   'generate_checkpointed_export',
+                   wraps=incremental_export.generate_checkpointed_export) \
+                as checkpointed:
+            export = generate_export(Export.CSV_EXPORT, 'csv',
+                                     self.user.username, self.xform.id_string,
+                                     export.pk)
+        self.assertTrue(checkpointed.called)
+        self.assertEqual(export.high_water_mark,
+                         self.xform.instances.latest('pk').pk)
+        self.assertEqual(export.incremental_state['rows'], 2)
+        self.assertEqual(self._read(export), self._full_export())
+
+        self._make_submission(self.paths[2])
+        export, rebuilt = self._generate_export()
+        self.assertFalse(rebuilt)
+        self.assertEqual(self._read(export), self._full_export())
+
+    def test_editing_a_new_submission_appends(self):
+        self._generate_export()
+        self._make_submission(self.paths[2])
+        # changes after the high-water mark don't matter
+        self.xform.instances.latest('pk').save()
+
+        export, rebuilt = self._generate_export()
+        self.assertFalse(rebuilt)
+        self.assertEqual(self._read(export), self._full_export())
@@ -0,0 +1,85 @@
+# coding: utf-8
+from django.conf import settings
+from django.core.management import call_command
+from django.test import override_settings
+from mock import patch
+from pymongo.errors import AutoReconnect
+
+from onadata.apps.logger.models import Instance
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.apps.viewer.models import MongoOutboxEntry
+from onadata.apps.viewer.models.parsed_instance import (
+    ParsedInstance,
+    xform_instances,
+)
+
+
+@override_settings(MONGO_OUTBOX_ENABLED=True)
+class TestMongoOutbox(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        settings.MONGO_DB.instances.drop()
+
+    def _mongo_count(self):
+        return settings.MONGO_DB.instances.count_documents(filter={})
+
+    def test_submissions_are_queued_instead_of_written(self):
+        self._make_submissions()
+        self.assertEqual(MongoOutboxEntry.objects.count(), 4)
+        self.assertEqual(self._mongo_count(), 0)
+        self.assertFalse(Instance.objects.filter(
+            is_synced_with_mongo=True).exists())
+
+        self.assertEqual(MongoOutboxEntry.drain(batch_size=3), (3, 0))
+        self.assertEqual(MongoOutboxEntry.drain(batch_size=3), (1, 0))
+        self.assertEqual(MongoOutboxEntry.drain(batch_size=3), (0, 0))
+        self.assertEqual(self._mongo_count(), 4)
+        self.assertFalse(MongoOutboxEntry.objects.exists())
+        self.assertFalse(Instance.objects.filter(
+            is_synced_with_mongo=False).exists())
+
+    def test_failed_writes_are_retried(self):
+        self._make_submissions()
+        with patch.object(xform_instances, 'bulk_write',
+                          side_effect=AutoReconnect('Mongo is down')):
+            self.assertEqual(MongoOutboxEntry.drain(batch_size=10), (0, 4))
+        self.assertEqual(self._mongo_count(), 0)
+        self.assertEqual(
+            list(MongoOutboxEntry.objects.values_list(
+                'attempts', 'last_error').distinct()),
+            [(1, 'Mongo is down')])
+
+        call_command('drain_mongo_outbox')
+        self.assertEqual(self._mongo_count(), 4)
+        self.assertFalse(MongoOutboxEntry.objects.exists())
+
+    def test_entries_enqueued_while_draining_are_kept(self):
+        self._make_submissions()
+        instance = Instance.objects.order_by('pk').first()
+        bulk_update_mongo = ParsedInstance.bulk_update_mongo
+
+        def edit_while_draining(parsed_instances):
+            # An edit committed after `drain()` read the submissions, and
+            # before it deleted their entries
+            MongoOutboxEntry.enqueue([instance.pk])
+            return bulk_update_mongo(parsed_instances)
+
+        with patch.object(ParsedInstance, 'bulk_update_mongo',
+                          side_effect=edit_while_draining):
+            self.assertEqual(MongoOutboxEntry.drain(batch_size=10), (4, 0))
+        self.assertEqual(
+            list(MongoOutboxEntry.objects.values_list('instance_id', 'seq')),
+            [(instance.pk, 1)])
+
+        self.assertEqual(MongoOutboxEntry.drain(batch_size=10), (1, 0))
+        self.assertFalse(MongoOutboxEntry.objects.exists())
+
+    def test_enqueue_twice(self):
+        self._make_submissions()
+        instance = Instance.objects.order_by('pk').first()
+        MongoOutboxEntry.enqueue([instance.pk, instance.pk])
+        self.assertEqual(MongoOutboxEntry.objects.count(), 4)
+        self.assertEqual(
+            MongoOutboxEntry.objects.get(instance=instance).seq, 1)
@@ -10,7 +10,8 @@ from onadata.apps.main.tests.test_base import TestBase
 from onadata.apps.logger.models.xform import XForm
 from onadata.apps.logger.xform_instance_parser import xform_instance_to_dict
 from onadata.apps.viewer.pandas_mongo_bridge import AbstractDataFrameBuilder,\
-    CSVDataFrameBuilder, CSVDataFrameWriter, ExcelWriter,\
+    CSVDataFrameBuilder, CSVDataFrameWriter, CSVStreamingBuilder,\
+    ExcelWriter,\
     get_prefix_from_xpath, get_valid_sheet_name, XLSDataFrameBuilder,\
     XLSDataFrameWriter, remove_dups_from_list_maintain_order
 from onadata.libs.utils.common_tags import NA_REP
@@ -588,6 +589,53 @@ class TestPandasMongoBridge(TestBase):
         csv_file.close()
         os.unlink(temp_file.name)
 
+    def _export_to_string(self, builder_class, **kwargs):
+        builder = builder_class(self.user.username, self.xform.id_string,
+                                **kwargs)
+        temp_file = NamedTemporaryFile(suffix=".csv", delete=False)
+        temp_file.close()
+        builder.export_to(temp_file.name, data_frame_max_size=3)
+        with open(temp_file.name) as f:
+            output = f.read()
+        os.unlink(temp_file.name)
+        return output
+
+    def test_csv_streaming_export_to(self):
+        self._publish_nested_repeats_form()
+        self._submit_fixture_instance(
+            "nested_repeats", "01", submission_time=self._submission_time)
+        self._submit_fixture_instance(
+            "nested_repeats", "02", submission_time=self._submission_time)
+        csv_builder = CSVStreamingBuilder(self.user.username,
+                                          self.xform.id_string)
+        temp_file = NamedTemporaryFile(suffix=".csv", delete=False)
+        csv_builder.export_to(temp_file.name)
+        csv_fixture_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "fixtures", "nested_repeats", "nested_repeats.csv"
+        )
+        temp_file.close()
+        with open(csv_fixture_path) as f:
+            fixture = f.read()
+        with open(temp_file.name) as f:
+            output = f.read()
+        os.unlink(temp_file.name)
+        self.assertEqual(fixture, output)
+
+    def test_csv_streaming_export_matches_dataframes(self):
+        self._publish_single_level_repeat_form()
+        for i in range(4):
+            self._submit_fixture_instance("new_repeats", "01")
+        self._submit_fixture_instance("new_repeats", "02")
+        for i in range(2):
+            self._submit_fixture_instance("new_repeats", "01")
+        for kwargs in [{}, {'binary_select_multiples': True},
+                       {'split_select_multiples': False},
+                       {'group_delimiter': '.'}]:
+            self.assertEqual(
+                self._export_to_string(CSVStreamingBuilder, **kwargs),
+                self._export_to_string(CSVDataFrameBuilder, **kwargs))
+
     def test_csv_column_indices_in_groups_within_repeats(self):
         self._publish_xls_fixture_set_xform("groups_in_repeats")
         self._submit_fixture_instance("groups_in_repeats", "01")
@@ -2,14 +2,20 @@
 import os
 
 from django.conf import settings
+from django.core import mail
 from django.core.management import call_command
+from django.test.utils import override_settings
 from django_digest.test import DigestAuth
 from django.utils.six import string_types
+from mock import patch
 
+from onadata.apps.logger.models import Instance
 from onadata.apps.main.tests.test_base import TestBase
 from onadata.apps.viewer.models.parsed_instance import ParsedInstance
 from onadata.apps.viewer.management.commands.remongo import Command
+from onadata.apps.viewer.tasks import email_mongo_sync_status
 from onadata.libs.utils.common_tags import USERFORM_ID
+from onadata.libs.utils.mongo_rebuild import rebuild_mongo
 
 
 class TestRemongo(TestBase):
@@ -107,3 +113,55 @@ class TestRemongo(TestBase):
             {USERFORM_ID: userform_id})
         self.assertEqual(mongo_count,
                          initial_mongo_count + len(self.surveys))
+
+    def test_rebuild_mongo_in_parallel(self):
+        self._publish_transportation_form()
+        self._make_submissions()
+        settings.MONGO_DB.instances.drop()
+        progress = []
+        stats = rebuild_mongo([self.xform], chunk_size=1, workers=2,
+                              progress_callback=progress.append)
+        self.assertEqual(stats['written'], 4)
+        self.assertEqual(stats['errors'], {})
+        self.assertEqual(progress[-1]['written'], 4)
+        self.assertEqual(settings.MONGO_DB.instances.count_documents(
+            filter={}), 4)
+
+    def test_rebuild_mongo_only_missing(self):
+        self._publish_transportation_form()
+        self._make_submissions()
+        instance = Instance.objects.order_by('pk').first()
+        settings.MONGO_DB.instances.delete_one({'_id': instance.pk})
+        ParsedInstance.objects.filter(instance=instance).delete()
+        stats = rebuild_mongo([self.xform], only_missing=True, workers=0)
+        self.assertEqual(stats['written'], 1)
+        self.assertTrue(ParsedInstance.objects.filter(
+            instance=instance).exists())
+        self.assertEqual(settings.MONGO_DB.instances.count_documents(
+            filter={}), 4)
+
+    def test_rebuild_mongo_reports_unparsable_submissions(self):
+        self._publish_transportation_form()
+        self._make_submissions()
+        settings.MONGO_DB.instances.drop()
+        instance = Instance.objects.order_by('pk').first()
+        Instance.objects.filter(pk=instance.pk).update(xml='<not-xml')
+        stats = rebuild_mongo([self.xform], workers=0)
+        self.assertEqual(stats['written'], 3)
+        self.assertEqual(list(stats['errors']), [instance.pk])
+
+    @override_settings(ADMINS=[('Admin', 'admin@example.com')])
+    def test_email_mongo_sync_status_remongo(self):
+        self._publish_transportation_form()
+        self._make_submissions()
+        settings.MONGO_DB.instances.drop()
+        with patch('onadata.libs.utils.mongo_rebuild.ProcessPoolExecutor') \
+                as executor:
+            email_mongo_sync_status()
+        # Celery workers are daemonic: they cannot start processes
+        executor.assert_not_called()
+        self.assertEqual(settings.MONGO_DB.instances.count_documents(
+            filter={}), 4)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('Total # of records to remongo: 4',
+                      mail.outbox[0].body)
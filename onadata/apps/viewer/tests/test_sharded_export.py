@@ -0,0 +1,61 @@
+# coding: utf-8
+from django.core.files.storage import get_storage_class
+from django.test import override_settings
+from openpyxl import load_workbook
+
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.tasks import create_sharded_export
+from onadata.libs.utils.export_tools import generate_export
+from onadata.libs.utils.sharded_export import get_export_options, get_shards
+
+
+@override_settings(EXPORT_SHARD_SIZE=1)
+class TestShardedExport(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self._make_submissions()
+
+    def _create_sharded_export(self, export_type):
+        export = Export.objects.create(xform=self.xform,
+                                       export_type=export_type)
+        shard_count = create_sharded_export(
+            export_type, self.user.username, self.xform.id_string, export.pk)
+        self.assertEqual(shard_count, self.xform.instances.count())
+        return Export.objects.get(pk=export.pk)
+
+    def _read(self, export, mode='r'):
+        storage = get_storage_class()()
+        with storage.open(export.filepath, mode) as f:
+            return f.read()
+
+    def test_shards_cover_every_submission(self):
+        options = get_export_options(self.user.username, self.xform.id_string,
+                                     export_id=None)
+        shards = get_shards(options, 3)
+        ids = sorted(self.xform.instances.values_list('pk', flat=True))
+        self.assertEqual(shards, [[ids[0], ids[2]], [ids[3], ids[3]]])
+
+    @override_settings(CSV_EXPORT_ENGINE='streaming')
+    def test_sharded_csv_export_matches_export(self):
+        export = self._create_sharded_export(Export.CSV_EXPORT)
+        self.assertEqual(export.internal_status, Export.SUCCESSFUL)
+        expected = generate_export(Export.CSV_EXPORT, 'csv',
+                                   self.user.username, self.xform.id_string)
+        self.assertEqual(self._read(export), self._read(expected))
+
+    def test_sharded_xlsx_export_matches_export(self):
+        export = self._create_sharded_export(Export.XLS_EXPORT)
+        self.assertEqual(export.internal_status, Export.SUCCESSFUL)
+        expected = generate_export(Export.XLS_EXPORT, 'xlsx',
+                                   self.user.username, self.xform.id_string)
+        storage = get_storage_class()()
+        workbook = load_workbook(storage.path(export.filepath))
+        expected_workbook = load_workbook(storage.path(expected.filepath))
+        self.assertEqual(workbook.sheetnames, expected_workbook.sheetnames)
+        for name in workbook.sheetnames:
+            self.assertEqual(
+                list(workbook[name].values),
+                list(expected_workbook[name].values))
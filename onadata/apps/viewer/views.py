@@ -2,7 +2,6 @@
 import json
 import logging
 import os
-import re
 from datetime import datetime
 
 import rest_framework.request
@@ -12,7 +11,6 @@ from django.contrib.auth.models import User
 from django.core.files.storage import FileSystemStorage
 from django.core.files.storage import get_storage_class
 from django.urls import reverse
-from django.db.models import Q
 from django.http import (
     HttpResponseForbidden, HttpResponseRedirect, HttpResponseNotFound,
     HttpResponseBadRequest, HttpResponse)
@@ -27,7 +25,13 @@ from onadata.apps.logger.models import XForm, Attachment
 from onadata.apps.viewer.models.export import Export
 from onadata.apps.viewer.tasks import create_async_export
 from onadata.libs.exceptions import NoRecordsFoundError
+from onadata.libs.utils.attachment_lookup import (
+    find_attachment,
+    get_xform,
+    has_attachment_permission,
+)
 from onadata.libs.utils.common_tags import SUBMISSION_TIME
+from onadata.libs.utils.export_cache import generate_cached_export
 from onadata.libs.utils.export_tools import (
     generate_export,
     should_create_new_export,
@@ -94,8 +98,13 @@ def data_export(request, username, id_string, export_type):
             query = json.dumps(
                 _set_submission_time_to_query(json.loads(query), request))
         try:
-            export = generate_export(
-                export_type, extension, username, id_string, None, query)
+            if query is None:
+                export = generate_export(
+                    export_type, extension, username, id_string, None, query)
+            else:
+                # filtered exports are not saved, but cached
+                export = generate_cached_export(
+                    export_type, extension, xform, query)
             audit_log(
                 Actions.EXPORT_CREATED, request.user, owner,
                 _("Created %(export_type)s export on '%(id_string)s'.") %
@@ -230,7 +239,10 @@ def export_progress(request, username, id_string, export_type):
             'complete': False,
             'url': None,
             'filename': None,
-            'export_id': export.id
+            'export_id': export.id,
+            # only known for exports which save checkpoints
+            'rows_done': export.rows_done,
+            'rows_total': export.rows_total,
         }
 
         if export.status == Export.SUCCESSFUL:
@@ -371,34 +383,14 @@ def attachment_url(request, size='medium'):
     if media_file:
         # Strip out garbage (cache buster?) added by Galleria.js
         media_file = media_file.split('?')[0]
-        mtch = re.search(r'^([^/]+)/attachments/([^/]+)$', media_file)
-        if mtch:
-            # in cases where the media_file url created by instance.html's
-            # _attachment_url function is in the wrong format, this will
-            # match attachments with the correct owner and the same file name
-            (username, filename) = mtch.groups()
-            result = Attachment.objects.filter(
-                    instance__xform__user__username=username,
-                ).filter(
-                    Q(media_file_basename=filename) | Q(
-                        media_file_basename=None,
-                        media_file__endswith='/' + filename
-                    )
-                )[0:1]
-        else:
-            # search for media_file with exact matching name
-            result = Attachment.objects.filter(media_file=media_file)[0:1]
-
-        try:
-            attachment = result[0]
-        except IndexError:
+        attachment, xform_id = find_attachment(media_file)
+        xform = get_xform(xform_id) if attachment else None
+        if xform is None:
             media_file_logger.info('attachment not found')
             return HttpResponseNotFound(_('Attachment not found'))
 
         # Checks whether users are allowed to see the media file before giving them
         # the url
-        xform = attachment.instance.xform
-
         if not request.user.is_authenticated:
             # This is not a DRF view, but we need to honor things like
             # `DigestAuthentication` (ODK Briefcase uses it!) and
@@ -415,7 +407,7 @@ def attachment_url(request, size='medium'):
                     # first match wins; don't look any further
                     break
 
-        if not has_permission(xform, xform.user, request):
+        if not has_attachment_permission(xform, request):
             return HttpResponseForbidden(_('Not shared.'))
 
         media_url = None
@@ -0,0 +1,221 @@
+# coding: utf-8
+"""
+Statistics of the submissions of a form, for dashboards: mean, median,
+percentiles and histogram of numeric fields, and counts of the submissions
+grouped by the values of other fields.
+
+Unlike `onadata.libs.data.query`, which reads all the submissions of a form
+for each field, the values of all numeric fields are fetched together, as
+floats, into one NumPy array per field, and all the group counts come from a
+single grouped query. Results are cached by each process until a submission
+of the form is added, edited or deleted.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+
+from onadata.libs.data.query import (
+    _get_fields_of_type,
+    get_date_fields,
+    get_numeric_fields,
+)
+from onadata.libs.utils.export_cache import get_submissions_version
+
+DEFAULT_PERCENTILES = (25, 50, 75, 90)
+DEFAULT_BINS = 10
+MAX_BINS = 100
+
+# Text which PostgreSQL can cast to a number; other values are ignored
+NUMBER_PATTERN = r'^\s*[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?\s*$'
+NUMBER_SQL = ("CASE WHEN json::jsonb->>%s ~ %s "
+              "THEN (json::jsonb->>%s)::float8 END")
+# Like `onadata.libs.data.query._postgres_count_group()`
+DATE_SQL = "to_char(to_date(json::jsonb->>%s, 'YYYY-MM-DD'), 'YYYY-MM-DD')"
+VALUE_SQL = "json::jsonb->>%s"
+
+NUMERIC_VALUES_SQL = '''
+SELECT {columns}
+FROM logger_instance
+WHERE xform_id = %s
+'''
+
+GROUP_COUNTS_SQL = '''
+SELECT fields.field, fields.value, COUNT(*)
+FROM logger_instance
+CROSS JOIN LATERAL (VALUES {values}) AS fields (field, value)
+WHERE xform_id = %s
+GROUP BY fields.field, fields.value
+'''
+
+
+class StatisticsCache:
+    """
+    Process-local LRU cache of statistics, keyed by the form's primary key,
+    the version of its submissions and the fields
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._statistics = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            statistics = self._statistics.get(key)
+            if statistics is None:
+                self.misses += 1
+                return None
+            self._statistics.move_to_end(key)
+            self.hits += 1
+            return statistics
+
+    def set(self, key, statistics):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._statistics[key] = statistics
+            while len(self._statistics) > self.max_size:
+                self._statistics.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._statistics.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._statistics),
+                'max_size': self.max_size,
+            }
+
+
+statistics_cache = StatisticsCache(settings.FORM_STATISTICS_CACHE_MAX_SIZE)
+
+
+def get_numeric_values(xform, fields):
+    """
+    :returns: `{field: NumPy array of its numeric values}`, read in one query
+    """
+    if not fields:
+        return {}
+    params = []
+    for field in fields:
+        params.extend([field, NUMBER_PATTERN, field])
+    with connection.cursor() as cursor:
+        cursor.execute(NUMERIC_VALUES_SQL.format(
+            columns=', '.join([NUMBER_SQL] * len(fields))),
+            params + [xform.pk])
+        # `None`s become NaNs
+        values = np.array(cursor.fetchall(), dtype=float).reshape(
+            -1, len(fields))
+    return dict((field, column[~np.isnan(column)])
+                for field, column in zip(fields, values.T))
+
+
+def describe(values, percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS):
+    """
+    :param values: NumPy array
+    :returns: Statistics of `values`, which are all `None` without values
+    """
+    if not values.size:
+        return {
+            'count': 0,
+            'mean': None,
+            'median': None,
+            'stdev': None,
+            'min': None,
+            'max': None,
+            'percentiles': dict((p, None) for p in percentiles),
+            'histogram': {'counts': [], 'edges': []},
+        }
+    counts, edges = np.histogram(values, bins=bins)
+    return {
+        'count': int(values.size),
+        'mean': float(np.mean(values)),
+        'median': float(np.median(values)),
+        'stdev': float(np.std(values)),
+        'min': float(np.min(values)),
+        'max': float(np.max(values)),
+        'percentiles': dict(
+            (p, float(value)) for p, value in
+            zip(percentiles, np.percentile(values, percentiles))),
+        'histogram': {
+            'counts': counts.tolist(),
+            'edges': edges.tolist(),
+        },
+    }
+
+
+def get_group_counts(xform, fields, date_fields=()):
+    """
+    :returns: `{field: [{'value': value, 'count': count}, ...]}`, most
+        common values first, read in one query; dates are grouped by day
+    """
+    if not fields:
+        return {}
+    values = []
+    params = []
+    for index, field in enumerate(fields):
+        values.append('({}, {})'.format(
+            index, DATE_SQL if field in date_fields else VALUE_SQL))
+        params.append(field)
+    with connection.cursor() as cursor:
+        cursor.execute(GROUP_COUNTS_SQL.format(values=', '.join(values)),
+                       params + [xform.pk])
+        rows = cursor.fetchall()
+
+    counts = OrderedDict((field, []) for field in fields)
+    for index, value, count in sorted(
+            rows, key=lambda row: (row[0], -row[2], str(row[1]))):
+        counts[fields[index]].append({'value': value, 'count': count})
+    return counts
+
+
+def get_form_statistics(xform, numeric_fields=None, group_fields=None,
+                        percentiles=DEFAULT_PERCENTILES, bins=DEFAULT_BINS):
+    """
+    Statistics of the submissions of `xform`, cached until one of them is
+    added, edited or deleted
+
+    :param list numeric_fields: Defaults to the integer and decimal
+        questions
+    :param list group_fields: Fields to count the submissions by the values
+        of; defaults to the select one and date questions, and the
+        submission time
+    :returns: A dict with the `numeric` statistics and the `groups` counts
+        by field
+    """
+    date_fields = get_date_fields(xform)
+    if numeric_fields is None:
+        numeric_fields = get_numeric_fields(xform)
+    if group_fields is None:
+        group_fields = _get_fields_of_type(xform, ['select one']) + \
+            date_fields
+    percentiles = tuple(percentiles)
+
+    version = get_submissions_version(xform)
+    key = json.dumps([xform.pk, version, list(numeric_fields),
+                      list(group_fields), percentiles, bins])
+    statistics = statistics_cache.get(key)
+    if statistics is None:
+        statistics = {
+            'submissions_version': version,
+            'numeric': dict(
+                (field, describe(values, percentiles, bins))
+                for field, values in get_numeric_values(
+                    xform, list(numeric_fields)).items()),
+            'groups': get_group_counts(xform, list(group_fields),
+                                       date_fields),
+        }
+        statistics_cache.set(key, statistics)
+    return statistics
@@ -0,0 +1,99 @@
+# coding: utf-8
+import os
+
+import numpy as np
+from django.test import override_settings
+from mock import patch
+
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.data import statistics
+from onadata.libs.data.statistics import (
+    describe,
+    get_form_statistics,
+    statistics_cache,
+)
+
+
+class TestStatistics(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._create_user_and_login()
+        self._publish_xls_file_and_set_xform(os.path.join(
+            os.path.dirname(__file__), "fixtures", "tutorial", "tutorial.xls"))
+        statistics_cache.clear()
+
+    def _submit(self, *names):
+        for name in names:
+            self._make_submission(os.path.join(
+                self.this_directory, '..', '..', 'api', 'tests',
+                'fixtures', 'forms', 'tutorial', 'instances',
+                '{}.xml'.format(name)))
+
+    def test_describe(self):
+        stats = describe(np.array([1., 2., 3., 4.]), percentiles=(50,),
+                         bins=2)
+        self.assertEqual(stats['count'], 4)
+        self.assertEqual(stats['mean'], 2.5)
+        self.assertEqual(stats['median'], 2.5)
+        self.assertEqual((stats['min'], stats['max']), (1, 4))
+        self.assertEqual(stats['percentiles'], {50: 2.5})
+        self.assertEqual(stats['histogram'],
+                         {'counts': [2, 2], 'edges': [1, 2.5, 4]})
+
+        stats = describe(np.array([]), percentiles=(50,))
+        self.assertEqual(stats['count'], 0)
+        self.assertIsNone(stats['mean'])
+        self.assertEqual(stats['percentiles'], {50: None})
+
+    def test_get_form_statistics(self):
+        self._submit('1', '2', '3', 'no_age')
+        stats = get_form_statistics(self.xform, numeric_fields=['age'],
+                                    group_fields=['gender'])
+
+        age = stats['numeric']['age']
+        # `no_age` has no age
+        self.assertEqual(age['count'], 3)
+        self.assertAlmostEqual(age['mean'], 27.67, places=2)
+        self.assertEqual(age['median'], 23)
+        self.assertEqual((age['min'], age['max']), (23, 35))
+        self.assertEqual(sum(age['histogram']['counts']), 3)
+
+        self.assertEqual(stats['groups']['gender'], [
+            {'value': 'female', 'count': 3},
+            {'value': 'male', 'count': 1},
+        ])
+
+    def test_group_by_date(self):
+        self._submit('1', '2', '3', 'no_age')
+        stats = get_form_statistics(self.xform, numeric_fields=[],
+                                    group_fields=['_submission_time'])
+        self.assertEqual(sum(group['count'] for group in
+                             stats['groups']['_submission_time']), 4)
+
+    def test_statistics_are_cached_until_a_submission(self):
+        self._submit('1', '2')
+        with patch.object(statistics, 'get_numeric_values',
+                          wraps=statistics.get_numeric_values) as values:
+            first = get_form_statistics(self.xform, numeric_fields=['age'])
+            second = get_form_statistics(self.xform, numeric_fields=['age'])
+            self.assertEqual(first, second)
+            self.assertEqual(values.call_count, 1)
+
+            self._submit('3')
+            third = get_form_statistics(self.xform, numeric_fields=['age'])
+            self.assertEqual(values.call_count, 2)
+        self.assertEqual(third['numeric']['age']['count'], 3)
+        self.assertNotEqual(first['submissions_version'],
+                            third['submissions_version'])
+
+    @override_settings(SUBMISSION_COUNTER_BUFFER_ENABLED=True)
+    def test_statistics_are_not_stale_with_buffered_counters(self):
+        self._submit('1', '2')
+        first = get_form_statistics(self.xform, numeric_fields=['age'])
+        # Counters are only buffered once the transaction commits, which it
+        # never does in tests: they lag behind
+        self._submit('3')
+        second = get_form_statistics(self.xform, numeric_fields=['age'])
+        self.assertEqual(first['numeric']['age']['count'], 2)
+        self.assertEqual(second['numeric']['age']['count'], 3)
@@ -8,6 +8,10 @@ from rest_framework.exceptions import ParseError
 from onadata.apps.logger.models.xform import XForm
 from onadata.apps.viewer.models.parsed_instance import ParsedInstance
 from onadata.apps.api.mongo_helper import MongoHelper
+from onadata.libs.utils.query_backends import (
+    UnsupportedQueryError,
+    get_query_backend,
+)
 
 
 class DataSerializer(serializers.HyperlinkedModelSerializer):
@@ -64,7 +68,10 @@ class DataListSerializer(serializers.Serializer):
             if start:
                 query_kwargs['start'] = int(start)
 
-        cursor = ParsedInstance.query_mongo_minimal(**query_kwargs)
+        try:
+            cursor = get_query_backend().query(obj, **query_kwargs)
+        except UnsupportedQueryError as e:
+            raise ParseError(str(e))
 
         # if we want the count, we only need the first index of the list.
         if count:
@@ -94,7 +101,10 @@ class DataInstanceSerializer(serializers.Serializer):
             'fields': query_params.get('fields'),
             'sort': query_params.get('sort')
         }
-        cursor = ParsedInstance.query_mongo_minimal(**query_kwargs)
+        try:
+            cursor = get_query_backend().query(obj.xform, **query_kwargs)
+        except UnsupportedQueryError as e:
+            raise ParseError(str(e))
         records = list(record for record in cursor)
 
         returned_dict = (len(records) and records[0]) or records
@@ -0,0 +1,127 @@
+# coding: utf-8
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from types import SimpleNamespace
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, Storage
+from django.test import TestCase, override_settings
+from mock import patch
+
+from onadata.libs.utils.viewer_tools import create_attachments_zipfile
+
+FILES = {
+    'bob/attachments/form/a/1.jpg': b'first' * 1000,
+    'bob/attachments/form/a/2.jpg': b'second',
+    'bob/attachments/form/b/3.mp3': b'',
+    'bob/attachments/form/b/4.jpg': bytes(range(256)) * 5000,
+}
+
+
+class S3StandInStorage(Storage):
+    """
+    Keeps files in memory and, like S3, has no `path()`; records calls to
+    `exists()` and how many files are read at the same time
+    """
+
+    def __init__(self, files, delay=0):
+        self.files = files
+        self.delay = delay
+        self.exists_calls = 0
+        self.reading = 0
+        self.max_reading = 0
+        self.lock = threading.Lock()
+
+    def exists(self, name):
+        self.exists_calls += 1
+        return name in self.files
+
+    def _open(self, name, mode='rb'):
+        with self.lock:
+            self.reading += 1
+            self.max_reading = max(self.max_reading, self.reading)
+        try:
+            # a network round trip
+            time.sleep(self.delay)
+            return ContentFile(self.files[name], name=name)
+        finally:
+            with self.lock:
+                self.reading -= 1
+
+
+def _attachments(files, sizes=True):
+    return [
+        SimpleNamespace(media_file=SimpleNamespace(name=name),
+                        media_file_size=len(content) if sizes else None)
+        for name, content in files.items()
+    ]
+
+
+def _read_zip(output_file):
+    output_file.seek(0)
+    with zipfile.ZipFile(output_file) as zip_file:
+        return dict((name, zip_file.read(name))
+                    for name in zip_file.namelist())
+
+
+class TestAttachmentsZipfile(TestCase):
+
+    def _create_zipfile(self, storage, attachments, engine='streaming',
+                        progress_callback=None):
+        with override_settings(ATTACHMENTS_ZIP_ENGINE=engine), \
+                patch('onadata.libs.utils.viewer_tools.get_storage_class',
+                      return_value=lambda: storage):
+            return _read_zip(create_attachments_zipfile(
+                attachments, progress_callback=progress_callback))
+
+    def test_local_storage(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = FileSystemStorage(location=location)
+        for name, content in FILES.items():
+            storage.save(name, ContentFile(content))
+
+        attachments = _attachments(FILES)
+        self.assertEqual(self._create_zipfile(storage, attachments), FILES)
+        self.assertEqual(
+            self._create_zipfile(storage, attachments, engine='legacy'),
+            FILES)
+
+    @override_settings(ATTACHMENTS_ZIP_PREFETCH=3)
+    def test_s3_storage_is_read_concurrently(self):
+        storage = S3StandInStorage(FILES, delay=0.1)
+        self.assertEqual(
+            self._create_zipfile(storage, _attachments(FILES)), FILES)
+        # sizes are known, so files are not looked up before being read
+        self.assertEqual(storage.exists_calls, 0)
+        self.assertGreater(storage.max_reading, 1)
+        self.assertLessEqual(storage.max_reading, 3)
+
+    def test_files_without_size_are_looked_up(self):
+        storage = S3StandInStorage(FILES)
+        attachments = _attachments(FILES, sizes=False) + [SimpleNamespace(
+            media_file=SimpleNamespace(name='bob/missing.jpg'),
+            media_file_size=None)]
+        self.assertEqual(self._create_zipfile(storage, attachments), FILES)
+        self.assertEqual(storage.exists_calls, len(attachments))
+
+    def test_unreadable_files_are_skipped(self):
+        storage = S3StandInStorage(FILES)
+        attachments = _attachments(FILES)
+        attachments.insert(1, SimpleNamespace(
+            media_file=SimpleNamespace(name='bob/missing.jpg'),
+            media_file_size=10))
+        with patch('onadata.libs.utils.viewer_tools.report_exception') \
+                as report_exception:
+            self.assertEqual(
+                self._create_zipfile(storage, attachments), FILES)
+        self.assertEqual(report_exception.call_count, 1)
+
+    def test_progress(self):
+        progress = []
+        self._create_zipfile(S3StandInStorage(FILES), _attachments(FILES),
+                             progress_callback=progress.append)
+        self.assertEqual(progress[-1], len(FILES))
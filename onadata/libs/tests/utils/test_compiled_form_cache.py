@@ -0,0 +1,102 @@
+# coding: utf-8
+import os
+
+from onadata.apps.logger.models import XForm
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.utils.compiled_form_cache import (
+    CompiledFormCache,
+    compiled_form_cache,
+)
+
+
+class TestCompiledFormCache(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        compiled_form_cache.clear()
+
+    def test_compiled_form_is_shared_across_data_dictionaries(self):
+        survey = self.xform.data_dictionary().survey
+        self.assertEqual(compiled_form_cache.get_stats()['misses'], 1)
+
+        xform = XForm.objects.get(pk=self.xform.pk)
+        self.assertIs(xform.data_dictionary().survey, survey)
+        stats = compiled_form_cache.get_stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_compiled_form_matches_survey(self):
+        dd = self.xform.data_dictionary()
+        elements = list(dd.survey.iter_descendants())
+        self.assertEqual(
+            dd.repeat_xpaths(),
+            [e.get_abbreviated_xpath() for e in elements
+             if e.type == 'repeat'])
+        self.assertEqual(
+            dd.geopoint_xpaths(),
+            [e.get_abbreviated_xpath() for e in elements
+             if e.bind.get('type') == 'geopoint'])
+        self.assertEqual(
+            sorted(dd.get_mongo_field_names_dict().values()),
+            sorted(e.get_abbreviated_xpath() for e in elements))
+
+    def test_saving_form_invalidates_compiled_form(self):
+        survey = self.xform.data_dictionary().survey
+        self.assertEqual(compiled_form_cache.get_stats()['size'], 1)
+
+        self.xform.save()
+        self.assertEqual(compiled_form_cache.get_stats()['size'], 0)
+        self.assertIsNot(self.xform.data_dictionary().survey, survey)
+
+    def test_least_recently_used_form_is_evicted(self):
+        self._publish_xls_file_and_set_xform(
+            os.path.join(self.this_directory, 'fixtures', 'gps', 'gps.xls'))
+        transportation_dd, gps_dd = [
+            xform.data_dictionary() for xform in XForm.objects.order_by('pk')]
+
+        cache = CompiledFormCache(max_size=1)
+        cache.get(transportation_dd)
+        cache.get(gps_dd)
+        self.assertEqual(cache.get_stats()['size'], 1)
+
+        cache.get(transportation_dd)
+        stats = cache.get_stats()
+        self.assertEqual(stats['hits'], 0)
+        self.assertEqual(stats['misses'], 3)
+
+    def test_data_dictionary_lookups_match_tree_walks(self):
+        dd = self.xform.data_dictionary()
+        elements = list(dd.survey.iter_descendants())
+        for element in elements:
+            xpath = element.get_abbreviated_xpath()
+            self.assertEqual(dd.get_element(xpath).get_abbreviated_xpath(),
+                             xpath)
+            self.assertIs(
+                dd.get_survey_element(element.name),
+                next(e for e in elements if e.name == element.name))
+            self.assertEqual(
+                dd.get_survey_elements_of_type(element.type),
+                [e for e in elements if e.type == element.type])
+
+        # Indices are ignored
+        xpath = 'transport/available_transportation_types_to_referral_facility'
+        self.assertIs(
+            dd.get_element(
+                'transport[2]/available_transportation_types_to_referral_facility'
+            ),
+            dd.get_element(xpath))
+        self.assertEqual(dd.xpaths(), dd.xpaths('', dd.survey, [], 4))
+        # Callers may modify the list they get back
+        dd.xpaths().append('foo')
+        self.assertNotIn('foo', dd.xpaths())
+
+    def test_lookups_return_copies(self):
+        dd = self.xform.data_dictionary()
+        for lookup in (dd.get_survey_elements, dd.geopoint_xpaths,
+                       dd.repeat_xpaths,
+                       lambda: dd.get_survey_elements_of_type('repeat')):
+            lookup().append('foo')
+            self.assertNotIn('foo', lookup())
+        dd.get_mongo_field_names_dict()['foo'] = 'foo'
+        self.assertNotIn('foo', dd.get_mongo_field_names_dict())
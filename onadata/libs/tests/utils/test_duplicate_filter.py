@@ -0,0 +1,144 @@
+# coding: utf-8
+import os
+
+from django.core.management import call_command
+from django.test import override_settings
+from mock import patch
+
+from onadata.apps.logger.models import Instance
+from onadata.apps.logger.tasks import forget_duplicate_filter
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.utils.duplicate_filter import (
+    LocalFilterStore,
+    duplicate_filter,
+    get_elements,
+    get_parameters,
+    get_positions,
+)
+
+
+class UnavailableFilterStore:
+    """
+    Wraps a store, and fails like `RedisFilterStore` while Redis is down
+    """
+    errors = (ConnectionError,)
+
+    def __init__(self, store):
+        self.store = store
+        self.available = True
+
+    def __getattr__(self, name):
+        if not self.available:
+            raise ConnectionError('Redis is down')
+        return getattr(self.store, name)
+
+
+@override_settings(DUPLICATE_FILTER_ENABLED=True)
+class TestDuplicateFilter(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        # Tests run inside a transaction which never commits
+        patcher = patch('django.db.transaction.on_commit',
+                        side_effect=lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(duplicate_filter, 'store', LocalFilterStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _submit(self, survey_at):
+        survey = self.surveys[survey_at]
+        self._make_submission(os.path.join(
+            self.this_directory, 'fixtures', 'transportation', 'instances',
+            survey, survey + '.xml'))
+        return self.response.status_code
+
+    def test_get_parameters(self):
+        size, hashes = get_parameters(1000, 0.01)
+        self.assertEqual(hashes, 7)
+        self.assertTrue(9000 < size < 10000)
+
+    def test_new_submissions_skip_duplicate_query(self):
+        # The filter gets built upon the first submission
+        self.assertEqual(self._submit(0), 201)
+        self.assertEqual(duplicate_filter.get_stats()['unavailable'], 1)
+
+        with patch.object(Instance.objects, 'filter',
+                          wraps=Instance.objects.filter) as filter_:
+            self.assertEqual(self._submit(1), 201)
+        self.assertFalse(any('xml_hash' in str(call)
+                             for call in filter_.call_args_list))
+        stats = duplicate_filter.get_stats()
+        self.assertEqual(stats['not_seen'], 1)
+        self.assertEqual(stats['maybe'], 0)
+
+    def test_duplicates_are_still_rejected(self):
+        self.assertEqual(self._submit(0), 201)
+        self.assertEqual(self._submit(1), 201)
+        self.assertEqual(self._submit(0), 202)
+        stats = duplicate_filter.get_stats()
+        self.assertEqual(stats['maybe'], 1)
+        self.assertEqual(stats['false_positives'], 0)
+        self.assertEqual(Instance.objects.count(), 2)
+
+    def test_false_positives_are_measured(self):
+        self._submit(0)
+        meta = duplicate_filter.store.get_meta(self.user.pk)
+        # A saturated filter: everything may have been seen
+        duplicate_filter.store.set_bits(
+            self.user.pk, meta['generation'], range(meta['size']))
+        self.assertEqual(self._submit(1), 201)
+        self.assertEqual(self._submit(2), 201)
+        stats = duplicate_filter.get_stats()
+        self.assertEqual(stats['false_positives'], 2)
+        self.assertEqual(stats['false_positive_rate'], 1)
+
+    def test_additions_during_rebuild_reach_next_filter(self):
+        self._submit(0)
+        duplicate_filter.store.update_meta(
+            self.user.pk, next_generation=10, next_size=1000, next_hashes=3)
+        duplicate_filter.add(self.user.pk, [('abc', None)])
+        positions = get_positions(get_elements('abc')[0], 1000, 3)
+        self.assertTrue(all(duplicate_filter.store.get_bits(
+            self.user.pk, 10, positions)))
+
+    def test_submissions_without_hash_disable_filter(self):
+        self._submit(0)
+        Instance.objects.update(xml_hash=Instance.DEFAULT_XML_HASH)
+        self.assertFalse(duplicate_filter.rebuild(self.user.pk))
+        self.assertIsNone(duplicate_filter.check(self.user.pk, 'abc'))
+        # Compared by XML, like before
+        self.assertEqual(self._submit(0), 202)
+
+    def test_rebuild_command(self):
+        self._submit(0)
+        self._submit(1)
+        call_command('rebuild_duplicate_filters', usernames=['bob'])
+        meta = duplicate_filter.store.get_meta(self.user.pk)
+        self.assertEqual(meta['count'], 2)
+        self.assertEqual(meta['generation'], 2)
+        instance = Instance.objects.first()
+        self.assertTrue(duplicate_filter.check(
+            self.user.pk, instance.xml_hash, instance.uuid))
+
+    def test_unavailable_store(self):
+        self._submit(0)
+        store = UnavailableFilterStore(duplicate_filter.store)
+        with patch.object(duplicate_filter, 'store', store), \
+                patch.object(forget_duplicate_filter, 'delay') as forget:
+            store.available = False
+            # Submissions are still saved, and duplicates rejected
+            self.assertEqual(self._submit(1), 201)
+            self.assertEqual(self._submit(0), 202)
+            self.assertEqual(Instance.objects.count(), 2)
+        # The filter missed a submission
+        forget.assert_called_once_with(self.user.pk)
+
+        forget_duplicate_filter(self.user.pk)
+        self.assertNotIn('generation',
+                         duplicate_filter.store.get_meta(self.user.pk))
+        instance = Instance.objects.order_by('pk').last()
+        self.assertIsNone(duplicate_filter.check(
+            self.user.pk, instance.xml_hash, instance.uuid))
@@ -0,0 +1,62 @@
+# coding: utf-8
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import call_command
+from django.utils import timezone
+
+from onadata.apps.logger.models import Instance, XForm
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.utils.logger_tools import mongo_sync_status
+from onadata.libs.utils.mongo_drift import get_drift
+
+
+class TestMongoDrift(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self._make_submissions()
+        self.userform_id = '{}_{}'.format(self.user.username,
+                                          self.xform.id_string)
+        self.pks = list(Instance.objects.order_by('pk').values_list(
+            'pk', flat=True))
+
+    def test_counts(self):
+        settings.MONGO_DB.instances.delete_one({'_id': self.pks[0]})
+        drift = get_drift()
+        self.assertEqual(len(drift), 1)
+        self.assertEqual(drift[0]['xform_id'], self.xform.pk)
+        self.assertEqual(drift[0]['postgres_count'], 4)
+        self.assertEqual(drift[0]['mongo_count'], 3)
+        self.assertNotIn('missing', drift[0])
+
+    def test_deep(self):
+        settings.MONGO_DB.instances.delete_one({'_id': self.pks[0]})
+        Instance.objects.filter(pk=self.pks[1]).update(
+            date_modified=timezone.now() + timedelta(days=1))
+        settings.MONGO_DB.instances.insert_one(
+            {'_id': self.pks[-1] + 1, '_userform_id': self.userform_id})
+
+        form, = get_drift(XForm.objects.filter(pk=self.xform.pk), deep=True,
+                          range_size=2)
+        self.assertEqual(form['missing'], [self.pks[0]])
+        self.assertEqual(form['stale'], [self.pks[1]])
+        self.assertEqual(form['extra'], [self.pks[-1] + 1])
+
+    def test_deep_in_sync(self):
+        form, = get_drift(deep=True)
+        self.assertEqual(
+            (form['missing'], form['stale'], form['extra']), ([], [], []))
+        self.assertIn('Total # of forms out of sync: 0',
+                      mongo_sync_status(deep=True))
+
+    def test_sync_status_report(self):
+        settings.MONGO_DB.instances.delete_one({'_id': self.pks[0]})
+        report = mongo_sync_status(deep=True)
+        self.assertIn('Instance count: 4\tMongo count: 3', report)
+        self.assertIn('Missing: 1\tStale: 0\tExtra: 0', report)
+        self.assertIn('Total # of records to remongo: 1', report)
+
+        call_command('sync_mongo', remongo=True, workers=0)
+        self.assertIn('Total # of forms out of sync: 0', mongo_sync_status())
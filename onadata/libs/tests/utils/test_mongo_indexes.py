@@ -0,0 +1,96 @@
+# coding: utf-8
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, override_settings
+from mock import MagicMock, patch
+
+from onadata.libs.utils.mongo_indexes import (
+    DECLARED_INDEXES,
+    SlowQueryListener,
+    ensure_indexes,
+    get_missing_indexes,
+    get_plan_stages,
+    get_undeclared_indexes,
+)
+
+
+class TestMongoIndexes(SimpleTestCase):
+
+    def setUp(self):
+        for collection in DECLARED_INDEXES:
+            settings.MONGO_DB[collection].drop()
+
+    def test_ensure_indexes(self):
+        settings.MONGO_DB.instances.create_index('_userform_id')
+        self.assertEqual(
+            sorted(get_missing_indexes()), sorted(DECLARED_INDEXES))
+
+        created = ensure_indexes()
+        self.assertEqual(len(created['instances']), 3)
+        self.assertEqual(get_missing_indexes(), {})
+        self.assertEqual(get_undeclared_indexes(),
+                         {'instances': ['_userform_id_1']})
+        # Nothing left to create
+        self.assertEqual(ensure_indexes(), {})
+
+    def test_command(self):
+        with self.assertRaises(CommandError):
+            call_command('ensure_mongo_indexes', verify=True)
+        call_command('ensure_mongo_indexes')
+        call_command('ensure_mongo_indexes', verify=True)
+
+    def test_get_plan_stages(self):
+        plan = {'stage': 'FETCH', 'inputStage': {
+            'stage': 'IXSCAN', 'indexName': '_userform_id_1__id_1'}}
+        self.assertEqual(get_plan_stages(plan), ['FETCH', 'IXSCAN'])
+        self.assertEqual(get_plan_stages({'stage': 'COLLSCAN'}),
+                         ['COLLSCAN'])
+
+
+@override_settings(MONGO_SLOW_QUERY_MS=100)
+class TestSlowQueryListener(SimpleTestCase):
+
+    def setUp(self):
+        self.listener = SlowQueryListener()
+        self.command = {'find': 'instances',
+                        'filter': {'_userform_id': 'bob_transportation',
+                                   'name': 'Bob'},
+                        'lsid': {'id': 1},
+                        '$db': 'formhub'}
+
+    def _run(self, duration_ms, command_name='find', command=None):
+        event = MagicMock(command_name=command_name, request_id=1,
+                          database_name='formhub',
+                          command=command or self.command,
+                          duration_micros=duration_ms * 1000)
+        self.listener.started(event)
+        connection = MagicMock()
+        connection.__getitem__.return_value.command.return_value = {
+            'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+        with override_settings(MONGO_CONNECTION=connection), \
+                patch('logging.Logger.warning') as warning:
+            self.listener.succeeded(event)
+        return connection.__getitem__.return_value.command, warning
+
+    def test_slow_queries_are_explained(self):
+        command, warning = self._run(250)
+        command.assert_called_once_with(
+            'explain', {'find': 'instances',
+                        'filter': self.command['filter']},
+            verbosity='queryPlanner')
+        self.assertEqual(warning.call_args[0][1:3], (250, 'COLLSCAN'))
+
+    def test_fast_queries_are_not_explained(self):
+        command, warning = self._run(50)
+        command.assert_not_called()
+        warning.assert_not_called()
+
+    def test_other_collections_are_ignored(self):
+        command, warning = self._run(
+            250, command={'find': 'other', 'filter': {}})
+        command.assert_not_called()
+
+    @override_settings(MONGO_SLOW_QUERY_MS=0)
+    def test_disabled(self):
+        command, warning = self._run(250)
+        command.assert_not_called()
@@ -0,0 +1,87 @@
+# coding: utf-8
+import json
+
+from django.test import override_settings
+
+from onadata.apps.logger.models import Instance
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.utils.query_backends import (
+    MongoQueryBackend,
+    PostgresQueryBackend,
+    UnsupportedQueryError,
+    get_query_backend,
+)
+
+TRANSPORT = 'transport/available_transportation_types_to_referral_facility'
+
+
+class TestQueryBackends(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self._make_submissions()
+        self.userform_id = '{}_{}'.format(self.user.username,
+                                          self.xform.id_string)
+
+    def _query(self, backend, query=None, **kwargs):
+        query = dict(query or {}, _userform_id=self.userform_id)
+        return list(backend.query(self.xform, json.dumps(query), **kwargs))
+
+    def _assert_same_ids(self, query=None, **kwargs):
+        mongo = self._query(MongoQueryBackend(), query, **kwargs)
+        postgres = self._query(PostgresQueryBackend(), query, **kwargs)
+        self.assertEqual([record['_id'] for record in postgres],
+                         [record['_id'] for record in mongo])
+        return postgres
+
+    def test_same_documents(self):
+        mongo = self._query(MongoQueryBackend())
+        postgres = self._query(PostgresQueryBackend())
+        self.assertEqual(len(postgres), 4)
+        for record in mongo:
+            record.pop('_userform_id', None)
+            record.pop('_modified_epoch', None)
+        self.assertEqual(postgres, mongo)
+
+    def test_operators(self):
+        pks = list(Instance.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        self.assertEqual(len(self._assert_same_ids({TRANSPORT: 'none'})), 1)
+        self._assert_same_ids({TRANSPORT: {'$in': ['none', 'ambulance']}})
+        self._assert_same_ids({'$or': [{TRANSPORT: 'none'},
+                                       {TRANSPORT: {'$regex': '^TAXI',
+                                                    '$options': 'i'}}]})
+        self._assert_same_ids({'$and': [{TRANSPORT: {'$exists': True}},
+                                        {TRANSPORT: {'$gte': 'b'}}]})
+        self._assert_same_ids({'_id': {'$gt': pks[1]}})
+        self._assert_same_ids({'_id': pks[0]})
+        self._assert_same_ids({'not_a_field': None})
+        self._assert_same_ids({'_uuid': {'$in': []}})
+
+    def test_sort_paging_and_fields(self):
+        postgres = self._assert_same_ids(
+            sort=json.dumps({TRANSPORT: -1}), start=1, limit=2,
+            fields=json.dumps([TRANSPORT]))
+        self.assertEqual(len(postgres), 2)
+        self.assertEqual(set(postgres[0]), {'_id', TRANSPORT})
+        self.assertEqual(
+            self._query(PostgresQueryBackend(), count=True), [{'count': 4}])
+
+    def test_unsupported_queries(self):
+        for query in ({'_tags': 'a'}, {TRANSPORT: {'$where': 'true'}}):
+            with self.assertRaises(UnsupportedQueryError):
+                self._query(PostgresQueryBackend(), query)
+
+    @override_settings(DATA_QUERY_BACKEND='postgres')
+    def test_data_api(self):
+        self.assertIsInstance(get_query_backend(), PostgresQueryBackend)
+        response = self.client.get(
+            '/api/v1/data/{}'.format(self.xform.pk),
+            {'query': json.dumps({TRANSPORT: 'none'})})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        response = self.client.get(
+            '/api/v1/data/{}'.format(self.xform.pk),
+            {'query': json.dumps({'_tags': 'a'})})
+        self.assertEqual(response.status_code, 400)
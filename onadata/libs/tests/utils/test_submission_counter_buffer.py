@@ -0,0 +1,108 @@
+# coding: utf-8
+import os
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import override_settings
+from mock import patch
+
+from onadata.apps.logger.models import Instance, XForm
+from onadata.apps.logger.models.submission_counter import SubmissionCounter
+from onadata.apps.main.models import UserProfile
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.utils.submission_counter_buffer import (
+    LocalCounterStore,
+    submission_counter_buffer,
+)
+
+
+@override_settings(SUBMISSION_COUNTER_BUFFER_ENABLED=True)
+class TestSubmissionCounterBuffer(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        # Tests run inside a transaction which never commits
+        patcher = patch('django.db.transaction.on_commit',
+                        side_effect=lambda func: func())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for attribute, value in (('store', LocalCounterStore()),
+                                 ('flush_interval', 3600)):
+            patcher = patch.object(submission_counter_buffer, attribute,
+                                   value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _submit(self):
+        # Unlike `_make_submissions()`, expect no counters to be up to date
+        for survey in self.surveys:
+            self._make_submission(os.path.join(
+                self.this_directory, 'fixtures', 'transportation',
+                'instances', survey, survey + '.xml'))
+            self.assertEqual(self.response.status_code, 201)
+
+    def _assert_counts(self, count):
+        xform = XForm.objects.get(pk=self.xform.pk)
+        self.assertEqual(xform.num_of_submissions, count)
+        self.assertEqual(
+            UserProfile.objects.get(user=self.user).num_of_submissions, count)
+
+    def test_increments_are_flushed_together(self):
+        self._submit()
+        self._assert_counts(0)
+        self.assertFalse(SubmissionCounter.objects.filter(
+            user=self.user).exists())
+
+        self.assertEqual(submission_counter_buffer.flush(), 1)
+        self._assert_counts(4)
+        self.assertEqual(
+            SubmissionCounter.objects.get(user=self.user).count, 4)
+        self.assertEqual(
+            XForm.objects.get(pk=self.xform.pk).last_submission_time,
+            Instance.objects.latest('pk').date_created)
+        self.assertEqual(submission_counter_buffer.flush(), 0)
+
+    def test_deletions_are_buffered(self):
+        self._submit()
+        submission_counter_buffer.flush()
+        Instance.objects.first().delete()
+        self._assert_counts(4)
+
+        submission_counter_buffer.flush()
+        self._assert_counts(3)
+        # Monthly counters are never decreased
+        self.assertEqual(
+            SubmissionCounter.objects.get(user=self.user).count, 4)
+
+    def test_failed_flush_is_retried(self):
+        self._submit()
+        with patch.object(UserProfile.objects, 'filter',
+                          side_effect=DatabaseError('connection lost')):
+            with self.assertRaises(DatabaseError):
+                submission_counter_buffer.flush()
+        self._assert_counts(0)
+
+        self.assertEqual(submission_counter_buffer.flush(), 1)
+        self._assert_counts(4)
+        self.assertEqual(
+            SubmissionCounter.objects.get(user=self.user).count, 4)
+        self.assertEqual(
+            XForm.objects.get(pk=self.xform.pk).last_submission_time,
+            Instance.objects.latest('pk').date_created)
+
+    def test_failed_flush_does_not_fail_submissions(self):
+        with patch.object(submission_counter_buffer, 'flush_interval', 0), \
+                patch.object(submission_counter_buffer, '_write',
+                             side_effect=DatabaseError('deadlock detected')):
+            self._submit()
+        self._assert_counts(0)
+
+        submission_counter_buffer.flush()
+        self._assert_counts(4)
+
+    def test_reconcile_command(self):
+        self._submit()
+        XForm.objects.filter(pk=self.xform.pk).update(num_of_submissions=99)
+        call_command('reconcile_submission_counters')
+        self._assert_counts(4)
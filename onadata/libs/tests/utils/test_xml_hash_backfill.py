@@ -0,0 +1,79 @@
+# coding: utf-8
+import os
+import shutil
+import tempfile
+
+from django.core.management import call_command
+
+from onadata.apps.logger.models import Instance
+from onadata.apps.main.tests.test_base import TestBase
+from onadata.libs.utils.xml_hash_backfill import (
+    backfill_xml_hashes,
+    read_checkpoint,
+)
+
+
+class TestXmlHashBackfill(TestBase):
+
+    def setUp(self):
+        super().setUp()
+        self._publish_transportation_form()
+        self._make_submissions()
+        Instance.objects.update(xml_hash=Instance.DEFAULT_XML_HASH)
+        self.last_pk = Instance.objects.order_by('-pk')[0].pk
+
+    def _assert_hashes_populated(self):
+        for pk, xml, xml_hash in Instance.objects.values_list(
+                'pk', 'xml', 'xml_hash'):
+            self.assertEqual(xml_hash, Instance.get_hash(xml))
+
+    def test_backfill(self):
+        progress = []
+        stats = backfill_xml_hashes(range_size=1, batch_size=2, workers=0,
+                                    progress_callback=progress.append)
+        self._assert_hashes_populated()
+        self.assertEqual(stats['rows_updated'], Instance.objects.count())
+        self.assertEqual(stats['next_pk'], self.last_pk + 1)
+        self.assertEqual(progress[-1]['eta'], 0)
+
+        # Nothing is left to do
+        stats = backfill_xml_hashes(workers=0)
+        self.assertEqual(stats['rows_updated'], 0)
+
+    def test_backfill_in_parallel(self):
+        stats = backfill_xml_hashes(range_size=2, workers=2)
+        self._assert_hashes_populated()
+        self.assertEqual(stats['rows_updated'], Instance.objects.count())
+
+    def test_backfill_resumes_from_checkpoint(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        checkpoint_file = os.path.join(directory, 'checkpoint.json')
+        first_pk = Instance.objects.order_by('pk')[0].pk
+
+        backfill_xml_hashes(end_pk=first_pk, workers=0,
+                            checkpoint_file=checkpoint_file)
+        self.assertEqual(read_checkpoint(checkpoint_file), first_pk + 1)
+        self.assertEqual(Instance.objects.filter(
+            xml_hash=Instance.DEFAULT_XML_HASH).count(),
+            Instance.objects.count() - 1)
+
+        # The first submission is not read again
+        Instance.objects.filter(pk=first_pk).update(
+            xml_hash=Instance.DEFAULT_XML_HASH)
+        stats = backfill_xml_hashes(workers=0,
+                                    checkpoint_file=checkpoint_file)
+        self.assertEqual(stats['rows_updated'], Instance.objects.count() - 1)
+        self.assertEqual(read_checkpoint(checkpoint_file), self.last_pk + 1)
+        self.assertIsNone(Instance.objects.get(pk=first_pk).xml_hash)
+
+    def test_repopulate(self):
+        backfill_xml_hashes(workers=0)
+        Instance.objects.update(xml_hash='stale')
+        stats = backfill_xml_hashes(workers=0, repopulate=True)
+        self.assertEqual(stats['rows_updated'], Instance.objects.count())
+        self._assert_hashes_populated()
+
+    def test_command(self):
+        call_command('backfill_xml_hashes', workers=0, verbosity=0)
+        self._assert_hashes_populated()
@@ -0,0 +1,152 @@
+# coding: utf-8
+"""
+Attachment lookup for the media redirector, `viewer.views.attachment_url`.
+
+Attachments are found through indexed columns only: `media_file`, or
+`(owner, media_file_basename)` for URLs in the `<username>/attachments/<file>`
+format. Which form an attachment belongs to is kept in a process-local cache,
+so that repeated views of the same images skip the joins. Permissions are
+checked on every view, so that revoking them takes effect right away.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+
+from onadata.apps.logger.models import Attachment, Instance, XForm
+from onadata.libs.utils.user_auth import has_permission
+
+LEGACY_URL_PATTERN = re.compile(r'^([^/]+)/attachments/([^/]+)$')
+
+
+class AttachmentLookupCache:
+    """
+    Process-local LRU cache whose entries expire after `ttl` seconds
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.time():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        if not self.max_size or not self.ttl:
+            return
+        with self._lock:
+            self._entries[key] = value, time.time() + self.ttl
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+            }
+
+
+attachment_lookup_cache = AttachmentLookupCache(
+    settings.ATTACHMENT_LOOKUP_CACHE_MAX_SIZE,
+    settings.ATTACHMENT_LOOKUP_CACHE_TTL)
+
+
+def _lookup_attachment(media_file):
+    mtch = LEGACY_URL_PATTERN.search(media_file)
+    if not mtch:
+        # search for media_file with exact matching name
+        return Attachment.objects.filter(media_file=media_file).first()
+
+    # in cases where the media_file url created by instance.html's
+    # _attachment_url function is in the wrong format, this will
+    # match attachments with the correct owner and the same file name
+    username, filename = mtch.groups()
+    owner_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if owner_id is None:
+        return None
+    attachment = Attachment.objects.filter(
+        owner_id=owner_id, media_file_basename=filename).first()
+    if attachment is None and settings.ATTACHMENT_LOOKUP_LEGACY_FALLBACK:
+        # Attachments which `populate_media_file_basename` has not completed
+        # yet. The `endswith` lookup scans the whole table
+        attachment = Attachment.objects.filter(
+            owner=None, instance__xform__user_id=owner_id,
+        ).filter(
+            Q(media_file_basename=filename) | Q(
+                media_file_basename=None,
+                media_file__endswith='/' + filename
+            )
+        ).first()
+    return attachment
+
+
+def find_attachment(media_file):
+    """
+    :returns: The attachment `media_file` refers to and the primary key of
+        its form, or `(None, None)`
+    """
+    key = ('attachment', media_file)
+    cached = attachment_lookup_cache.get(key)
+    if cached is not None:
+        attachment_id, xform_id = cached
+        attachment = Attachment.objects.filter(pk=attachment_id).first()
+        if attachment is not None:
+            return attachment, xform_id
+        # Deleted since
+        attachment_lookup_cache.delete(key)
+
+    attachment = _lookup_attachment(media_file)
+    if attachment is None:
+        return None, None
+    xform_id = Instance.objects.filter(pk=attachment.instance_id).values_list(
+        'xform_id', flat=True).first()
+    attachment_lookup_cache.set(key, (attachment.pk, xform_id))
+    return attachment, xform_id
+
+
+def get_xform(xform_id):
+    """
+    :returns: The form, with only what permission checks need, and its owner
+    """
+    return XForm.objects.select_related('user').only(
+        'pk', 'uuid', 'shared_data', 'user').filter(pk=xform_id).first()
+
+
+def has_attachment_permission(xform, request):
+    """
+    `has_permission()` for the attachments of `xform`
+    """
+    return has_permission(xform, xform.user, request)
@@ -0,0 +1,171 @@
+# coding: utf-8
+"""
+CSV and XLSX exports which survive the interruption of their task.
+
+Submissions are exported in `_id` order, `EXPORT_CHECKPOINT_ROWS` at a time.
+Each batch is written to its own part file in the default storage, then the
+`Export` records a checkpoint: the `_id` of the last exported submission, the
+number of submissions exported and the list of parts. A task retried after
+hitting its soft time limit, or redelivered after its worker died, continues
+from there. Once every submission is exported, the parts are concatenated
+like the shards of `onadata.libs.utils.sharded_export`.
+"""
+from django.conf import settings
+from django.core.files.temp import NamedTemporaryFile
+from django.utils import timezone
+
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.parsed_instance import (
+    ParsedInstance,
+    xform_instances,
+)
+from onadata.libs.exceptions import NoRecordsFoundError
+from onadata.libs.utils.sharded_export import (
+    concatenate_csv_shards,
+    delete_shards,
+    get_csv_builder,
+    get_export_builder,
+    get_query,
+    merge_xls_shards,
+    save_shard,
+    write_xls_rows,
+)
+
+PARTS = 'parts'
+
+
+def _count(options, last_id):
+    return xform_instances.count_documents(
+        get_query(options, last_id=last_id),
+        maxTimeMS=settings.MONGO_DB_MAX_TIME_MS)
+
+
+def _start_csv_export(options):
+    csv_builder = get_csv_builder(options)
+    float_columns, max_id = csv_builder.discover_columns()
+    if max_id is None:
+        raise NoRecordsFoundError("No records found for your query")
+    return {
+        'max_id': max_id,
+        'columns': csv_builder.get_csv_columns(),
+        'float_columns': [sorted(chunk) for chunk in float_columns],
+        'parts': [],
+    }
+
+
+def _write_csv_part(options, export, part_file, limit):
+    checkpoint = export.checkpoint
+    first_id = export.checkpoint_last_id + 1 \
+        if export.checkpoint_last_id is not None else None
+    return get_csv_builder(options).write_rows(
+        part_file, checkpoint['columns'], checkpoint['float_columns'],
+        first_id, checkpoint['max_id'], first_index=export.rows_done,
+        limit=limit)
+
+
+def _finish_csv_export(options, export):
+    return concatenate_csv_shards(
+        options, export.checkpoint['columns'], export.checkpoint['parts'])
+
+
+def _start_xls_export(options):
+    last_record = xform_instances.find(
+        get_query(options), {'_id': 1}).sort('_id', -1).limit(1)
+    last_record = next(iter(last_record), None)
+    if last_record is None:
+        raise NoRecordsFoundError("No records found for your query")
+    return {
+        'max_id': last_record['_id'],
+        # last `_index` of each repeat
+        'indices': {},
+        'parts': [],
+    }
+
+
+def _write_xls_part(options, export, part_file, limit):
+    checkpoint = export.checkpoint
+    first_id = export.checkpoint_last_id + 1 \
+        if export.checkpoint_last_id is not None else None
+    records = xform_instances.find(
+        get_query(options, first_id, checkpoint['max_id']),
+        max_time_ms=settings.MONGO_DB_MAX_TIME_MS,
+    ).sort('_id', 1).limit(limit).batch_size(
+        min(limit, ParsedInstance.DEFAULT_BATCHSIZE))
+
+    exported = []
+
+    def _iterate_records():
+        for record in records:
+            exported.append(record['_id'])
+            yield record
+
+    export_builder = get_export_builder(options, export.xform)
+    write_xls_rows(part_file, export_builder, _iterate_records(),
+                   index=export.rows_done + 1,
+                   indices=checkpoint['indices'])
+    return len(exported), exported[-1] if exported else None
+
+
+def _finish_xls_export(options, export):
+    # `_index`es already run across parts, there is nothing to shift
+    return merge_xls_shards(options, [
+        {'path': path, 'counts': {}} for path in export.checkpoint['parts']])
+
+
+ENGINES = {
+    Export.CSV_EXPORT: ('csv', _start_csv_export, _write_csv_part,
+                        _finish_csv_export),
+    Export.XLS_EXPORT: ('jsonl', _start_xls_export, _write_xls_part,
+                        _finish_xls_export),
+}
+
+
+def _save_checkpoint(export, **fields):
+    fields['checkpoint_updated'] = timezone.now()
+    for name, value in fields.items():
+        setattr(export, name, value)
+    # Export.save() is a busybody; bypass it with update()
+    Export.objects.filter(pk=export.pk).update(**fields)
+
+
+def generate_checkpointed_export(export_type, options, rows_per_checkpoint):
+    """
+    Export `EXPORT_CHECKPOINT_ROWS` submissions at a time, starting from the
+    checkpoint of the `Export` if there is one
+
+    :param options: See `sharded_export.get_export_options()`
+    """
+    extension, start, write_part, finish = ENGINES[export_type]
+    export = Export.objects.get(pk=options['export_id'])
+
+    if export.checkpoint is None:
+        checkpoint = start(options)
+        _save_checkpoint(
+            export, checkpoint=checkpoint, checkpoint_last_id=None,
+            rows_done=0, rows_total=_count(options, checkpoint['max_id']))
+
+    while True:
+        with NamedTemporaryFile(mode='w+', encoding='utf-8',
+                                suffix='.' + extension) as part_file:
+            rows, last_id = write_part(options, export, part_file,
+                                       rows_per_checkpoint)
+            if not rows:
+                break
+            part_file.flush()
+            path = save_shard(options, len(export.checkpoint['parts']),
+                              extension, part_file, PARTS)
+        checkpoint = export.checkpoint
+        checkpoint['parts'].append(path)
+        _save_checkpoint(export, checkpoint=checkpoint,
+                         checkpoint_last_id=last_id,
+                         rows_done=export.rows_done + rows)
+
+    checkpoint, rows_done = export.checkpoint, export.rows_done
+    export = finish(options, export)
+    # Parts left behind by interrupted attempts
+    delete_shards(options, PARTS)
+    Export.objects.filter(pk=export.pk).update(checkpoint=None)
+    # Python-only, for `incremental_export.generate_incremental_csv_export()`
+    export.final_checkpoint = checkpoint
+    export.rows_done = rows_done
+    return export
@@ -0,0 +1,126 @@
+# coding: utf-8
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.six import text_type
+
+from onadata.apps.api.mongo_helper import MongoHelper
+
+
+class CompiledForm:
+    """
+    Everything derived from a form definition which is expensive to rebuild
+    and only changes when the form is republished.
+    """
+
+    def __init__(self, data_dictionary):
+        self.survey = data_dictionary.build_survey()
+        self.elements = list(self.survey.iter_descendants())
+        # first element with a given name
+        self.elements_by_name = {}
+        # abbreviated xpath => element
+        self.elements_by_xpath = {}
+        # type => elements, in survey order
+        self.elements_by_type = {}
+        self.geopoint_xpaths = []
+        self.repeat_xpaths = []
+        # field name as saved in Mongo => xpath
+        self.mongo_field_names = {}
+        # `repeat_iterations` => result of `DataDictionary.xpaths()`
+        self.xpaths = {}
+
+        for element in self.elements:
+            xpath = element.get_abbreviated_xpath()
+            self.elements_by_name.setdefault(element.name, element)
+            self.elements_by_xpath[xpath] = element
+            self.elements_by_type.setdefault(element.type, []).append(element)
+            self.mongo_field_names[MongoHelper.encode(text_type(xpath))] = \
+                xpath
+            if element.type == 'repeat':
+                self.repeat_xpaths.append(xpath)
+            if element.bind.get('type') == 'geopoint':
+                self.geopoint_xpaths.append(xpath)
+
+
+class CompiledFormCache:
+    """
+    Process-local LRU cache of `CompiledForm`s.
+
+    Entries are keyed by the form's primary key and its version, i.e.
+    `date_modified`, so a form republished by another process is simply a
+    miss here. Saving or deleting a form in this process also evicts it right
+    away (see `invalidate_compiled_form()`).
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._compiled_forms = OrderedDict()
+
+    @staticmethod
+    def get_key(xform):
+        return xform.pk, xform.date_modified or xform.hash
+
+    def get(self, data_dictionary):
+        if data_dictionary.pk is None:
+            # Never cache forms which are not saved yet
+            return CompiledForm(data_dictionary)
+
+        key = self.get_key(data_dictionary)
+        with self._lock:
+            compiled_form = self._compiled_forms.get(key)
+            if compiled_form is not None:
+                self._compiled_forms.move_to_end(key)
+                self.hits += 1
+                return compiled_form
+            self.misses += 1
+
+        # Compile outside the lock; at worst, two threads compile the same
+        # form concurrently and the last one wins
+        compiled_form = CompiledForm(data_dictionary)
+        with self._lock:
+            self._compiled_forms[key] = compiled_form
+            while len(self._compiled_forms) > self.max_size:
+                self._compiled_forms.popitem(last=False)
+        return compiled_form
+
+    def set_xpaths(self, compiled_form, repeat_iterations, xpaths):
+        """
+        Memoize the result of `DataDictionary.xpaths()` in `compiled_form`,
+        which other threads may be reading.
+
+        :returns: The memoized xpaths, which are those of whichever thread
+            got here first
+        """
+        with self._lock:
+            return compiled_form.xpaths.setdefault(repeat_iterations, xpaths)
+
+    def invalidate(self, xform_id):
+        with self._lock:
+            for key in [k for k in self._compiled_forms if k[0] == xform_id]:
+                del self._compiled_forms[key]
+
+    def clear(self):
+        with self._lock:
+            self._compiled_forms.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._compiled_forms),
+                'max_size': self.max_size,
+            }
+
+
+compiled_form_cache = CompiledFormCache(settings.COMPILED_FORM_CACHE_MAX_SIZE)
+
+
+def invalidate_compiled_form(sender, instance, **kwargs):
+    compiled_form_cache.invalidate(instance.pk)
@@ -42,25 +42,32 @@ def is_owner(view_func):
     return _wrapped_view
 
 
+def decode_form_field_names(record, field_names):
+    """
+    Replace, recursively, the field names of a Mongo `record` which were
+    encoded to be valid Mongo keys with the original ones; `field_names` is
+    the mapping returned by `DataDictionary.get_mongo_field_names_dict()`.
+    """
+    if isinstance(record, dict):
+        # Avoid RuntimeError: dictionary keys changed during iteration
+        record_iter = dict(record)
+        for field in record_iter:
+            if isinstance(record[field], list):
+                tmp_items = []
+                items = record[field]
+                for item in items:
+                    tmp_items.append(
+                        decode_form_field_names(item, field_names))
+                record[field] = tmp_items
+            if field not in field_names.values() and \
+                    field in field_names.keys():
+                record[field_names[field]] = record.pop(field)
+    return record
+
+
 def apply_form_field_names(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        def _get_decoded_record(record):
-            if isinstance(record, dict):
-                # Avoid RuntimeError: dictionary keys changed during iteration
-                record_iter = dict(record)
-                for field in record_iter:
-                    if isinstance(record[field], list):
-                        tmp_items = []
-                        items = record[field]
-                        for item in items:
-                            tmp_items.append(_get_decoded_record(item))
-                        record[field] = tmp_items
-                    if field not in field_names.values() and \
-                            field in field_names.keys():
-                        record[field_names[field]] = record.pop(field)
-            return record
-
         cursor = func(*args, **kwargs)
         # Compare by class name instead of type because tests use MockMongo
         if cursor.__class__.__name__ == 'Cursor' and 'id_string' in kwargs and \
@@ -72,7 +79,7 @@ def apply_form_field_names(func):
             records = []
             field_names = dd.data_dictionary().get_mongo_field_names_dict()
             for record in cursor:
-                records.append(_get_decoded_record(record))
+                records.append(decode_form_field_names(record, field_names))
             return records
         return cursor
     return wrapper
@@ -0,0 +1,415 @@
+# coding: utf-8
+"""
+Bloom filters of the submissions of each user, by `xml_hash` and
+`instanceID`, which let `create_instance()` skip the duplicate query for
+submissions which were certainly never seen before, i.e. nearly all of them.
+
+A filter answers "not seen" or "maybe"; only "maybe" runs the duplicate
+query. Filters are kept in Redis, shared by every process, when
+`DUPLICATE_FILTER_REDIS_URL` is set, otherwise in memory, which is only
+correct with a single process, e.g. for development and tests.
+
+New submissions are added once their transaction commits. Filters are
+(re)built from the database by the `rebuild_duplicate_filter` task, the first
+time a user submits and whenever their filter fills up. During a rebuild,
+additions go to both the current and the next filter, which is therefore
+complete when it replaces the current one. Deleted submissions stay in the
+filters until they are rebuilt, which only costs false positives.
+
+The filters are only an optimisation: when their store fails, e.g. Redis is
+down, submissions run the duplicate query. The filters of users whose new
+submissions could not be added are dropped, by a task retried until the
+store is back, and rebuilt.
+"""
+import logging
+import math
+import threading
+import time
+from collections import defaultdict
+from hashlib import sha256
+
+from django.conf import settings
+from django.db import transaction
+
+# Filters are sized for twice the number of submissions at build time, and
+# at least this many
+MIN_CAPACITY = 1000
+# Positions set or read per storage round trip while rebuilding
+REBUILD_BATCH_SIZE = 10000
+# seconds during which a filter is not rebuilt again
+REBUILD_INTERVAL = 600
+
+# Counters of `get_stats()`
+STATS = ('not_seen', 'maybe', 'false_positives', 'unavailable')
+
+
+def get_elements(xml_hash, uuid=None):
+    elements = ['hash:' + xml_hash]
+    if uuid:
+        elements.append('uuid:' + uuid)
+    return elements
+
+
+def get_positions(element, size, hashes):
+    # Double hashing: the positions are `h1 + i * h2`
+    digest = sha256(element.encode()).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:16], 'big') | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+def get_parameters(capacity, false_positive_rate):
+    """
+    :returns: The number of bits and of hash functions of a filter holding
+        `capacity` elements with the given false positive rate
+    """
+    size = int(math.ceil(-capacity * math.log(false_positive_rate)
+                         / math.log(2) ** 2))
+    hashes = max(1, int(round(size / capacity * math.log(2))))
+    return size, hashes
+
+
+class LocalFilterStore:
+    """
+    In-memory stand-in for `RedisFilterStore`. Each process only ever sees
+    its own additions.
+    """
+    # Exceptions meaning that the store is unavailable
+    errors = ()
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._meta = {}
+        self._bits = {}
+        self._stats = defaultdict(int)
+
+    def get_meta(self, owner_id):
+        with self._lock:
+            return dict(self._meta.get(owner_id, {}))
+
+    def update_meta(self, owner_id, **fields):
+        with self._lock:
+            meta = self._meta.setdefault(owner_id, {})
+            for field, value in fields.items():
+                if value is None:
+                    meta.pop(field, None)
+                else:
+                    meta[field] = value
+
+    def claim_rebuild(self, owner_id, interval):
+        with self._lock:
+            meta = self._meta.setdefault(owner_id, {})
+            if meta.get('rebuild_requested', 0) > time.time() - interval:
+                return False
+            meta['rebuild_requested'] = time.time()
+            return True
+
+    def increment_count(self, owner_id, count):
+        with self._lock:
+            meta = self._meta.setdefault(owner_id, {})
+            meta['count'] = meta.get('count', 0) + count
+
+    def get_bits(self, owner_id, generation, positions):
+        with self._lock:
+            bits = self._bits.get((owner_id, generation), set())
+            return [position in bits for position in positions]
+
+    def set_bits(self, owner_id, generation, positions):
+        with self._lock:
+            self._bits.setdefault((owner_id, generation), set()).update(
+                positions)
+
+    def discard(self, owner_id, generation):
+        with self._lock:
+            self._bits.pop((owner_id, generation), None)
+
+    def increment_stat(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+class RedisFilterStore:
+    """
+    Keeps the filters in Redis bitmaps shared by every process; each user
+    has a hash of metadata and a bitmap per generation of their filter.
+    """
+    KEY_PREFIX = 'kobocat:duplicate_filter:'
+    STATS_KEY = KEY_PREFIX + 'stats'
+    # seconds during which a replaced bitmap may still get additions
+    DISCARD_DELAY = 60
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._watch_error = redis.WatchError
+        self.errors = (redis.RedisError,)
+
+    def _meta_key(self, owner_id):
+        return '{}{}'.format(self.KEY_PREFIX, owner_id)
+
+    def _bits_key(self, owner_id, generation):
+        return '{}{}:{}'.format(self.KEY_PREFIX, owner_id, generation)
+
+    def get_meta(self, owner_id):
+        return dict(
+            (field.decode(), float(value) if b'.' in value else int(value))
+            for field, value in self._redis.hgetall(
+                self._meta_key(owner_id)).items())
+
+    def update_meta(self, owner_id, **fields):
+        key = self._meta_key(owner_id)
+        pipeline = self._redis.pipeline()
+        removed = [field for field, value in fields.items() if value is None]
+        if removed:
+            pipeline.hdel(key, *removed)
+        fields = dict((field, value) for field, value in fields.items()
+                      if value is not None)
+        if fields:
+            pipeline.hset(key, mapping=fields)
+        pipeline.execute()
+
+    def claim_rebuild(self, owner_id, interval):
+        key = self._meta_key(owner_id)
+        now = time.time()
+        with self._redis.pipeline() as pipeline:
+            # Optimistic locking, so that a single process claims it
+            try:
+                pipeline.watch(key)
+                requested = pipeline.hget(key, 'rebuild_requested')
+                if requested and float(requested) > now - interval:
+                    return False
+                pipeline.multi()
+                pipeline.hset(key, 'rebuild_requested', now)
+                pipeline.execute()
+            except self._watch_error:
+                return False
+        return True
+
+    def increment_count(self, owner_id, count):
+        self._redis.hincrby(self._meta_key(owner_id), 'count', count)
+
+    def get_bits(self, owner_id, generation, positions):
+        key = self._bits_key(owner_id, generation)
+        pipeline = self._redis.pipeline(transaction=False)
+        for position in positions:
+            pipeline.getbit(key, position)
+        return [bool(bit) for bit in pipeline.execute()]
+
+    def set_bits(self, owner_id, generation, positions):
+        key = self._bits_key(owner_id, generation)
+        pipeline = self._redis.pipeline(transaction=False)
+        for position in positions:
+            pipeline.setbit(key, position, 1)
+        pipeline.execute()
+
+    def discard(self, owner_id, generation):
+        # Not deleted right away: additions which read the metadata before
+        # the filter was replaced would recreate it
+        self._redis.expire(self._bits_key(owner_id, generation),
+                           self.DISCARD_DELAY)
+
+    def increment_stat(self, name):
+        self._redis.hincrby(self.STATS_KEY, name, 1)
+
+    def get_stats(self):
+        return dict((name.decode(), int(value)) for name, value in
+                    self._redis.hgetall(self.STATS_KEY).items())
+
+
+class DuplicateFilter:
+
+    def __init__(self, store, false_positive_rate):
+        self.store = store
+        self.false_positive_rate = false_positive_rate
+
+    def check(self, owner_id, xml_hash, uuid=None):
+        """
+        Whether a submission of `owner_id` may have the same content, i.e.
+        `xml_hash`, and the same `instanceID`, i.e. `uuid`
+
+        :returns: `False` if certainly not, `True` if maybe, `None` if the
+            filter is disabled, not built yet or unavailable
+        """
+        if not settings.DUPLICATE_FILTER_ENABLED:
+            return None
+        try:
+            meta = self.store.get_meta(owner_id)
+            if 'generation' not in meta:
+                self._increment_stat('unavailable')
+                self.request_rebuild(owner_id)
+                return None
+            if meta.get('count', 0) > meta['capacity']:
+                # Still correct, but with more and more false positives
+                self.request_rebuild(owner_id)
+
+            positions = []
+            for element in get_elements(xml_hash, uuid):
+                positions.extend(
+                    get_positions(element, meta['size'], meta['hashes']))
+            seen = all(self.store.get_bits(owner_id, meta['generation'],
+                                           positions))
+        except self.store.errors:
+            logging.getLogger().warning(
+                'Duplicate filter unavailable; running the duplicate query.',
+                exc_info=True)
+            self._increment_stat('unavailable')
+            return None
+        self._increment_stat('maybe' if seen else 'not_seen')
+        return seen
+
+    def _increment_stat(self, name):
+        try:
+            self.store.increment_stat(name)
+        except self.store.errors:
+            # Lost along with the store
+            pass
+
+    def record_false_positive(self):
+        """
+        To be called when a submission `check()` deemed maybe seen was not a
+        duplicate after all
+        """
+        self._increment_stat('false_positives')
+
+    def add(self, owner_id, pairs):
+        """
+        Add submissions of `owner_id` once, and only if, the current
+        transaction commits
+
+        :param list pairs: `(xml_hash, uuid)` tuples
+        """
+        if not settings.DUPLICATE_FILTER_ENABLED:
+            return
+        elements = [element for xml_hash, uuid in pairs if xml_hash
+                    for element in get_elements(xml_hash, uuid)]
+        if elements:
+            transaction.on_commit(lambda: self._add(owner_id, elements))
+
+    def _add(self, owner_id, elements):
+        # The submissions are saved already: failing now would only make
+        # clients send them again
+        try:
+            self._add_to_store(owner_id, elements)
+        except self.store.errors:
+            logging.getLogger().warning(
+                'Duplicate filter unavailable; submissions not added.',
+                exc_info=True)
+            self._increment_stat('unavailable')
+            # Avoid circular import
+            from onadata.apps.logger.tasks import forget_duplicate_filter
+            # The filter would tell the submissions apart as never seen
+            try:
+                forget_duplicate_filter.delay(owner_id)
+            except Exception:
+                # e.g. the broker is the same Redis
+                logging.getLogger().error(
+                    'Duplicate filter of user %s missed submissions; run '
+                    'the `rebuild_duplicate_filters` management command.',
+                    owner_id, exc_info=True)
+
+    def _add_to_store(self, owner_id, elements):
+        meta = self.store.get_meta(owner_id)
+        # While rebuilding, add to the next filter too
+        for prefix in ('', 'next_'):
+            if prefix + 'generation' not in meta:
+                continue
+            positions = []
+            for element in elements:
+                positions.extend(get_positions(
+                    element, meta[prefix + 'size'], meta[prefix + 'hashes']))
+            self.store.set_bits(owner_id, meta[prefix + 'generation'],
+                                positions)
+        # Each submission has a hash element, and maybe a uuid one
+        self.store.increment_count(
+            owner_id, len([e for e in elements if e.startswith('hash:')]))
+
+    def forget(self, owner_id):
+        """
+        Drop the filter of `owner_id`, e.g. which missed submissions, so that
+        `check()` runs the duplicate query until it is rebuilt
+        """
+        self._replace(owner_id, self.store.get_meta(owner_id), None)
+
+    def request_rebuild(self, owner_id):
+        if self.store.claim_rebuild(owner_id, REBUILD_INTERVAL):
+            # Avoid circular import
+            from onadata.apps.logger.tasks import rebuild_duplicate_filter
+            rebuild_duplicate_filter.delay(owner_id)
+
+    def rebuild(self, owner_id):
+        """
+        Build a filter of all the submissions of `owner_id`, sized after
+        their number, and replace the current one with it
+        """
+        # Avoid circular import
+        from onadata.apps.logger.models import Instance
+
+        instances = Instance.objects.filter(xform__user_id=owner_id)
+        meta = self.store.get_meta(owner_id)
+        if instances.filter(xml_hash=Instance.DEFAULT_XML_HASH).exists():
+            # Submissions without hashes are compared by their XML, which the
+            # filter cannot tell apart; see the `backfill_xml_hashes`
+            # management command
+            self._replace(owner_id, meta, None)
+            return False
+
+        capacity = max(instances.count() * 2, MIN_CAPACITY)
+        size, hashes = get_parameters(capacity, self.false_positive_rate)
+        generation = meta.get('generation', 0) + 1
+        # From now on, additions go to the new filter as well
+        self.store.update_meta(owner_id, next_generation=generation,
+                               next_size=size, next_hashes=hashes)
+        count = 0
+        positions = []
+        for xml_hash, uuid in instances.values_list(
+                'xml_hash', 'uuid').iterator():
+            count += 1
+            for element in get_elements(xml_hash, uuid):
+                positions.extend(get_positions(element, size, hashes))
+            if len(positions) >= REBUILD_BATCH_SIZE:
+                self.store.set_bits(owner_id, generation, positions)
+                positions = []
+        if positions:
+            self.store.set_bits(owner_id, generation, positions)
+
+        self._replace(owner_id, meta, {
+            'generation': generation,
+            'size': size,
+            'hashes': hashes,
+            'capacity': capacity,
+            'count': count,
+        })
+        return True
+
+    def _replace(self, owner_id, meta, fields):
+        fields = fields or dict.fromkeys(
+            ('generation', 'size', 'hashes', 'capacity', 'count'))
+        fields.update(dict.fromkeys(
+            ('next_generation', 'next_size', 'next_hashes')))
+        self.store.update_meta(owner_id, **fields)
+        if 'generation' in meta:
+            self.store.discard(owner_id, meta['generation'])
+
+    def get_stats(self):
+        stats = dict.fromkeys(STATS, 0)
+        stats.update(self.store.get_stats())
+        # Share of the submissions which were not duplicates that the filter
+        # failed to recognize as such
+        negatives = stats['not_seen'] + stats['false_positives']
+        stats['false_positive_rate'] = \
+            stats['false_positives'] / float(negatives) if negatives else 0
+        return stats
+
+
+def _get_store():
+    if settings.DUPLICATE_FILTER_REDIS_URL:
+        return RedisFilterStore(settings.DUPLICATE_FILTER_REDIS_URL)
+    return LocalFilterStore()
+
+
+duplicate_filter = DuplicateFilter(
+    _get_store(), settings.DUPLICATE_FILTER_FALSE_POSITIVE_RATE)
@@ -0,0 +1,210 @@
+# coding: utf-8
+"""
+Cache of filtered exports.
+
+Filtered exports are not persisted as `Export`s, so dashboards requesting the
+same filtered export over and over used to generate it every time. Exports
+are now cached, keyed by everything their content depends on: the form and
+its version, the set of submissions, the normalized filter query, the
+export options and the format.
+
+Identical concurrent requests coalesce: the first one generates the export
+while the others wait for it, up to `EXPORT_CACHE_WAIT_TIMEOUT` seconds. The
+one generating holds a PostgreSQL advisory lock on the key until its
+transaction ends, i.e. until the entry is committed: with `ATOMIC_REQUESTS`,
+an entry created to claim the key would stay invisible, and block identical
+requests on its unique key, until the response is sent.
+Entries expire `EXPORT_CACHE_TTL` seconds after they were generated, and the
+least recently used ones are evicted when the cached files take more than
+`EXPORT_CACHE_MAX_SIZE` bytes.
+"""
+import json
+import time
+from datetime import timedelta
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from django.db import connection, transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+from django.utils.six import string_types
+
+from onadata.apps.logger.models import Instance, SubmissionChange
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.export_cache import ExportCacheEntry
+from onadata.libs.utils.export_tools import generate_export
+
+# seconds between two checks of an export generated by another request
+POLL_INTERVAL = 1
+
+
+def normalize_query(query):
+    """
+    Serialize `query` so that equivalent queries, e.g. with keys in another
+    order, give the same string
+    """
+    if not query:
+        return '{}'
+    if isinstance(query, string_types):
+        try:
+            query = json.loads(query)
+        except ValueError:
+            return query
+    return json.dumps(query, sort_keys=True, separators=(',', ':'))
+
+
+def get_submissions_version(xform):
+    """
+    A value which changes whenever a submission of `xform` is added, edited
+    or deleted. Not the counters of `xform`, which lag behind new submissions
+    when they are buffered; see `submission_counter_buffer`
+    """
+    return [
+        Instance.objects.filter(xform_id=xform.pk).aggregate(
+            last_id=Max('pk'))['last_id'],
+        SubmissionChange.get_latest_id(xform.pk),
+    ]
+
+
+def get_cache_key(xform, export_type, extension, filter_query, options):
+    key = json.dumps([
+        xform.pk,
+        xform.hash,
+        get_submissions_version(xform),
+        normalize_query(filter_query),
+        sorted(options.items()),
+        export_type,
+        extension,
+    ])
+    return sha256(key.encode()).hexdigest()
+
+
+def evict(keep=None):
+    """
+    Delete expired and abandoned entries, then the least recently used ones
+    until the cached files fit in `EXPORT_CACHE_MAX_SIZE` bytes
+
+    :param keep: The pk of an entry not to evict for size, e.g. the one just
+        generated
+    """
+    now = timezone.now()
+    expired = ExportCacheEntry.objects.filter(
+        Q(status=ExportCacheEntry.READY,
+          date_created__lt=now - timedelta(seconds=settings.EXPORT_CACHE_TTL))
+        # left by older versions, which claimed keys with entries
+        | Q(status=ExportCacheEntry.PENDING,
+            date_created__lt=now - timedelta(
+                seconds=settings.EXPORT_CACHE_WAIT_TIMEOUT)))
+    # one by one, so that their files get deleted
+    for entry in expired:
+        entry.delete()
+
+    ready = ExportCacheEntry.objects.filter(status=ExportCacheEntry.READY)
+    total_size = ready.aggregate(total=Sum('size'))['total'] or 0
+    if total_size <= settings.EXPORT_CACHE_MAX_SIZE:
+        return
+    for entry in ready.exclude(pk=keep).order_by('last_accessed'):
+        entry.delete()
+        total_size -= entry.size
+        if total_size <= settings.EXPORT_CACHE_MAX_SIZE:
+            break
+
+
+def _try_lock(key):
+    """
+    Lock `key` until the current transaction ends, without waiting
+
+    :returns: Whether the lock was taken, i.e. whether no other request is
+        generating the export
+    """
+    with connection.cursor() as cursor:
+        # 60 bits of the key, which fit in the `bigint` of the lock
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s)',
+                       [int(key[:15], 16)])
+        return cursor.fetchone()[0]
+
+
+def _get_ready_entry(key):
+    """
+    :returns: The committed entry for `key`, if its file still exists
+    """
+    entry = ExportCacheEntry.objects.filter(
+        key=key, status=ExportCacheEntry.READY).first()
+    if entry is None:
+        return None
+    if not get_storage_class()().exists(entry.filepath):
+        entry.delete()
+        return None
+    ExportCacheEntry.objects.filter(pk=entry.pk).update(
+        last_accessed=timezone.now())
+    return entry
+
+
+def _get_export(entry):
+    # Like other filtered exports, it is not saved
+    return Export(xform=entry.xform, export_type=entry.export_type,
+                  filedir=entry.filedir, filename=entry.filename,
+                  internal_status=Export.SUCCESSFUL)
+
+
+def generate_cached_export(export_type, extension, xform, filter_query,
+                           group_delimiter='/', split_select_multiples=True,
+                           binary_select_multiples=False):
+    """
+    `generate_export()` for a filtered export, from the cache if an
+    identical export was generated already
+    """
+    def _generate():
+        return generate_export(
+            export_type, extension, xform.user.username, xform.id_string,
+            None, filter_query, group_delimiter, split_select_multiples,
+            binary_select_multiples)
+
+    if not settings.EXPORT_CACHE_TTL:
+        return _generate()
+
+    options = {
+        'group_delimiter': group_delimiter,
+        'split_select_multiples': split_select_multiples,
+        'binary_select_multiples': binary_select_multiples,
+    }
+    key = get_cache_key(xform, export_type, extension, filter_query, options)
+    evict()
+    deadline = time.time() + settings.EXPORT_CACHE_WAIT_TIMEOUT
+    # Outside of requests, the lock must still last until the entry is
+    # committed
+    with transaction.atomic():
+        while True:
+            entry = _get_ready_entry(key)
+            if entry is not None:
+                return _get_export(entry)
+            # Released if the request holding it fails, which lets this one
+            # take over
+            if _try_lock(key):
+                # The export may have been committed in the meantime
+                entry = _get_ready_entry(key)
+                if entry is not None:
+                    return _get_export(entry)
+                break
+            # Another request is generating the same export
+            if time.time() >= deadline:
+                return _generate()
+            time.sleep(POLL_INTERVAL)
+
+        export = _generate()
+        now = timezone.now()
+        # Entries left `PENDING` by older versions are replaced
+        entry, _ = ExportCacheEntry.objects.update_or_create(
+            key=key, defaults={
+                'xform': xform,
+                'export_type': export_type,
+                'status': ExportCacheEntry.READY,
+                'filedir': export.filedir,
+                'filename': export.filename,
+                'size': get_storage_class()().size(export.filepath),
+                'date_created': now,
+                'last_accessed': now,
+            })
+    evict(keep=entry.pk)
+    return export
@@ -176,6 +176,82 @@ def dict_to_joined_export(data, index, indices, name):
     return output
 
 
+class SectionPlan:
+    """
+    Everything `ExportBuilder.to_xls_export()` needs to write the rows of one
+    section, i.e. what `ExportBuilder.pre_process_row()` looks up for every
+    row, computed once per survey.
+    """
+
+    def __init__(self, export_builder, section):
+        name = section['name']
+        self.name = name
+        self.fields = [element['xpath'] for element in section['elements']] \
+            + export_builder.EXTRA_FIELDS
+        self.encoded_fields = list(
+            export_builder.encoded_fields.get(name, {}).items())
+        # (xpath, {choice name: choice xpath}, choice xpaths)
+        self.select_multiples = []
+        if export_builder.SPLIT_SELECT_MULTIPLES:
+            self.select_multiples = [
+                (xpath,
+                 dict((choice[len(xpath) + 1:], choice) for choice in choices),
+                 choices)
+                for xpath, choices in export_builder.select_multiples.get(
+                    name, {}).items()]
+        self.gps_fields = list(export_builder.gps_fields.get(name, {}).items())
+        self.converters = [
+            (element['xpath'], ExportBuilder.CONVERT_FUNCS[element['type']])
+            for element in section['elements']
+            if element['type'] in ExportBuilder.TYPES_TO_CONVERT]
+        # Same flag as `ExportBuilder.split_select_multiples()`
+        self.binary_select_multiples = ExportBuilder.BINARY_SELECT_MULTIPLES
+
+    def process(self, row):
+        """
+        Same as `ExportBuilder.pre_process_row()`
+        """
+        for xpath, encoded_xpath in self.encoded_fields:
+            if row.get(encoded_xpath):
+                row[xpath] = row.pop(encoded_xpath)
+
+        for xpath, choices_by_name, choices in self.select_multiples:
+            selected = row.get(xpath)
+            selected = selected.split() if selected else []
+            selections = set(choices_by_name[name] for name in selected
+                             if name in choices_by_name)
+            if self.binary_select_multiples:
+                for choice in choices:
+                    row[choice] = 1 if choice in selections else 0
+            elif selected:
+                for choice in choices:
+                    row[choice] = choice in selections
+            else:
+                for choice in choices:
+                    row[choice] = None
+
+        for xpath, gps_components in self.gps_fields:
+            data = row.get(xpath)
+            if data:
+                row.update(zip(gps_components, data.split()))
+
+        for xpath, func in self.converters:
+            value = row.get(xpath)
+            if value is not None and value != '':
+                try:
+                    row[xpath] = func(value)
+                except ValueError:
+                    pass
+
+        return row
+
+    def to_values(self, row, work_sheet_titles):
+        # update parent_table with the generated sheet's title
+        row[PARENT_TABLE_NAME] = work_sheet_titles.get(
+            row.get(PARENT_TABLE_NAME))
+        return [row.get(field) for field in self.fields]
+
+
 class ExportBuilder:
     IGNORED_COLUMNS = [
         XFORM_ID_STRING,
@@ -334,6 +410,8 @@ class ExportBuilder:
             main_section, self.survey, self.sections,
             self.select_multiples, self.gps_fields, self.encoded_fields,
             self.GROUP_DELIMITER)
+        self.section_plans = [
+            SectionPlan(self, section) for section in self.sections]
 
     def section_by_name(self, name):
         matches = [s for s in self.sections if s['name'] == name]
@@ -455,24 +533,27 @@ class ExportBuilder:
             i += 1
         return generated_name
 
-    def to_xls_export(self, path, data, *args):
-        def write_row(data, work_sheet, fields, work_sheet_titles):
-            # update parent_table with the generated sheet's title
-            data[PARENT_TABLE_NAME] = work_sheet_titles.get(
-                data.get(PARENT_TABLE_NAME))
-            work_sheet.append([data.get(f) for f in fields])
-
-        wb = Workbook(write_only=True)
-        work_sheets = {}
+    def get_work_sheet_titles(self):
         # map of section_names to generated_names
         work_sheet_titles = {}
         for section in self.sections:
             section_name = section['name']
-            work_sheet_title = ExportBuilder.get_valid_sheet_name(
+            work_sheet_titles[section_name] = ExportBuilder.get_valid_sheet_name(
                 "_".join(section_name.split("/")), list(work_sheet_titles.values()))
-            work_sheet_titles[section_name] = work_sheet_title
+        return work_sheet_titles
+
+    def create_work_sheets(self, wb):
+        """
+        Add one sheet per section, with its headers, to `wb`
+
+        :returns: sheets by section name, and sheet titles by section name
+        """
+        work_sheets = {}
+        work_sheet_titles = self.get_work_sheet_titles()
+        for section in self.sections:
+            section_name = section['name']
             work_sheets[section_name] = wb.create_sheet(
-                title=work_sheet_title)
+                title=work_sheet_titles[section_name])
 
         # write the headers
         for section in self.sections:
@@ -484,8 +565,18 @@ class ExportBuilder:
             ws = work_sheets[section_name]
             ws.append(headers)
 
-        index = 1
-        indices = {}
+        return work_sheets, work_sheet_titles
+
+    def iter_xls_rows(self, data, work_sheet_titles, index=1, indices=None):
+        """
+        Yield a `(SectionPlan, values)` pair for each row to write, section
+        by section, submission by submission
+
+        :param index: `_index` of the first submission
+        :param indices: Last `_index` of each repeat, updated in place
+        """
+        if indices is None:
+            indices = {}
         survey_name = self.survey.name
         for d in data:
             joined_export = dict_to_joined_export(d, index, indices,
@@ -498,38 +589,40 @@ class ExportBuilder:
                 output[survey_name] = {}
             output[survey_name][INDEX] = index
             output[survey_name][PARENT_INDEX] = -1
-            for section in self.sections:
-                # get data for this section and write to xls
-                section_name = section['name']
-                fields = [
-                    element['xpath'] for element in
-                    section['elements']] + self.EXTRA_FIELDS
-
-                ws = work_sheets[section_name]
+            for plan in self.section_plans:
                 # section might not exist within the output, e.g. data was
                 # not provided for said repeat - write test to check this
-                row = output.get(section_name, None)
+                row = output.get(plan.name, None)
                 if type(row) == dict:
-                    write_row(
-                        self.pre_process_row(row, section),
-                        ws, fields, work_sheet_titles)
+                    yield plan, plan.to_values(
+                        plan.process(row), work_sheet_titles)
                 elif type(row) == list:
                     for child_row in row:
-                        write_row(
-                            self.pre_process_row(child_row, section),
-                            ws, fields, work_sheet_titles)
+                        yield plan, plan.to_values(
+                            plan.process(child_row), work_sheet_titles)
             index += 1
 
+    def to_xls_export(self, path, data, *args):
+        wb = Workbook(write_only=True)
+        work_sheets, work_sheet_titles = self.create_work_sheets(wb)
+        for plan, values in self.iter_xls_rows(data, work_sheet_titles):
+            work_sheets[plan.name].append(values)
         wb.save(filename=path)
 
     def to_flat_csv_export(
             self, path, data, username, id_string, filter_query):
         # TODO resolve circular import
 
-        from onadata.apps.viewer.pandas_mongo_bridge import\
-            CSVDataFrameBuilder
+        from onadata.apps.viewer.pandas_mongo_bridge import (
+            CSVDataFrameBuilder,
+            CSVStreamingBuilder,
+        )
 
-        csv_builder = CSVDataFrameBuilder(
+        if settings.CSV_EXPORT_ENGINE == 'streaming':
+            builder_class = CSVStreamingBuilder
+        else:
+            builder_class = CSVDataFrameBuilder
+        csv_builder = builder_class(
             username, id_string, filter_query, self.GROUP_DELIMITER,
             self.SPLIT_SELECT_MULTIPLES, self.BINARY_SELECT_MULTIPLES)
         csv_builder.export_to(path)
@@ -552,6 +645,17 @@ def generate_export(export_type, extension, username, id_string,
         Export.CSV_EXPORT: 'to_flat_csv_export',
     }
 
+    # TODO resolve circular import
+    from onadata.libs.utils.incremental_export import (
+        generate_incremental_csv_export,
+        is_incremental,
+    )
+
+    if is_incremental(export_type, filter_query):
+        return generate_incremental_csv_export(
+            username, id_string, export_id, group_delimiter,
+            split_select_multiples, binary_select_multiples)
+
     xform = XForm.objects.get(
         user__username__iexact=username, id_string__exact=id_string)
 
@@ -573,6 +677,19 @@ def generate_export(export_type, extension, username, id_string,
     func.__call__(
         temp_file.name, records, username, id_string, filter_query)
 
+    return save_export(xform, export_type, extension, temp_file, export_id,
+                       filter_query)
+
+
+def save_export(xform, export_type, extension, export_file, export_id=None,
+                filter_query=None):
+    """
+    Save `export_file`, an open temporary file, to the storage and record it
+    in the given `Export`, or in a new one
+    """
+    username = xform.user.username
+    id_string = xform.id_string
+
     # generate filename
     basename = "%s_%s" % (
         id_string, datetime.now().strftime("%Y_%m_%d_%H_%M_%S"))
@@ -592,11 +709,11 @@ def generate_export(export_type, extension, username, id_string,
     # TODO: if s3 storage, make private - how will we protect local storage??
     storage = get_storage_class()()
     # seek to the beginning as required by storage classes
-    temp_file.seek(0)
+    export_file.seek(0)
     export_filename = storage.save(
         file_path,
-        File(temp_file, file_path))
-    temp_file.close()
+        File(export_file, file_path))
+    export_file.close()
 
     dir_name, basename = os.path.split(export_filename)
 
@@ -677,10 +794,19 @@ def generate_attachments_zip_export(
 
     export_filename = get_storage_class()().save(file_path, ContentFile(''))
 
+    progress_callback = None
+    if export_id:
+        Export.objects.filter(pk=export_id).update(
+            rows_done=0, rows_total=attachments.count())
+
+        def progress_callback(done):
+            Export.objects.filter(pk=export_id).update(rows_done=done)
+
     with get_storage_class()().open(export_filename, 'wb') as destination_file:
         create_attachments_zipfile(
             attachments,
             output_file=destination_file,
+            progress_callback=progress_callback,
         )
 
     dir_name, basename = os.path.split(export_filename)
@@ -1,11 +1,12 @@
 # coding: utf-8
+from datetime import timedelta
 from io import BytesIO
-from tempfile import NamedTemporaryFile
 
-import requests
 from django.conf import settings
 from django.core.files.storage import get_storage_class
 from django.core.files.base import ContentFile
+from django.db.models import Q
+from django.utils import timezone
 from PIL import Image
 
 from onadata.libs.utils.viewer_tools import get_path
@@ -35,84 +36,187 @@ def get_dimensions(size_, longest_side):
     return flat(width, height)
 
 
-def _save_thumbnails(image, original_path, size, suffix):
+# Like `Image.thumbnail()`, decode and reduce JPEGs to at least this many
+# times the size of the largest thumbnail, then resample
+REDUCING_GAP = 2.0
+
+
+def _save_thumbnail(image, image_format, thumbnail_path):
+    """
+    Encode `image` in memory and write it to the storage
+
+    :returns: The entry of the thumbnail in the manifest of the attachment,
+        see `Attachment.thumbnails`
+    """
+    default_storage = get_storage_class()()
     # Thumbnail format will be set by original file extension.
     # Use same format to keep transparency of GIF/PNG
-    nm = NamedTemporaryFile(suffix='.%s' % image.format)
-    default_storage = get_storage_class()()
+    thumbnail_file = BytesIO()
     try:
-        # Ensure conversion to float in operations
-        image.thumbnail(get_dimensions(image.size, float(size)), Image.ANTIALIAS)
-    except ZeroDivisionError:
-        pass
-    try:
-        image.save(nm.name)
+        image.save(thumbnail_file, format=image_format)
     except IOError:
         # e.g. `IOError: cannot write mode P as JPEG`, which gets raised when
         # someone uploads an image in an indexed-color format like GIF
-        image.convert('RGB').save(nm.name)
+        thumbnail_file = BytesIO()
+        image.convert('RGB').save(thumbnail_file, format=image_format)
 
     # Try to delete file with the same name if it already exists to avoid useless file.
     # i.e if `file_<suffix>.jpg` exists, Storage will save `a_<suffix>_<random_string>.jpg`
     # but nothing in the code is aware about this `<random_string>
     try:
-        default_storage.delete(get_path(original_path, suffix))
+        default_storage.delete(thumbnail_path)
     except IOError:
         pass
 
-    default_storage.save(
-        get_path(original_path, suffix), ContentFile(nm.read()))
+    content = thumbnail_file.getvalue()
+    return {
+        'key': default_storage.save(thumbnail_path, ContentFile(content)),
+        'size': len(content),
+    }
 
-    nm.close()
 
+def create_thumbnails(filename):
+    """
+    Create the `THUMB_ORDER` thumbnails of an image. The original is read
+    from the storage and decoded once; each thumbnail is a downscale of the
+    previous, larger one.
 
-def resize(filename):
+    :returns: The manifest of the thumbnails, see `Attachment.thumbnails`
+    """
     default_storage = get_storage_class()()
-    is_local = default_storage.__class__.__name__ == 'FileSystemStorage'
-    image = None
-    original_path = None
-
-    if is_local:
-        path = default_storage.path(filename)
-        image = Image.open(path)
-        original_path = path
-    else:
-        path = default_storage.url(filename)
-        original_path = filename
-        req = requests.get(path)
-        if req.status_code == 200:
-            im = BytesIO(req.content)
-            image = Image.open(im)
+    conf = settings.THUMB_CONF
+    with default_storage.open(filename, 'rb') as original_file:
+        image = Image.open(original_file)
+        image_format = image.format
+        # JPEG only: let the decoder scale the image down, by up to 8
+        image.draft(image.mode, get_dimensions(
+            image.size,
+            float(conf[settings.THUMB_ORDER[0]]['size']) * REDUCING_GAP))
+        image.load()
+
+    thumbnails = {}
+    for key in settings.THUMB_ORDER:
+        try:
+            # Ensure conversion to float in operations
+            image.thumbnail(get_dimensions(image.size,
+                                           float(conf[key]['size'])),
+                            Image.ANTIALIAS, reducing_gap=REDUCING_GAP)
+        except ZeroDivisionError:
+            pass
+        thumbnails[key] = _save_thumbnail(
+            image, image_format, get_path(filename, conf[key]['suffix']))
+    return thumbnails
+
+
+def get_thumbnails_manifest(filename):
+    """
+    Describe the existing thumbnails of an image from the storage, for
+    attachments whose thumbnails were created before they were recorded
 
-    if image:
-        conf = settings.THUMB_CONF
-        [_save_thumbnails(
-            image, original_path,
-            conf[key]['size'],
-            conf[key]['suffix']) for key in settings.THUMB_ORDER]
+    :returns: The manifest of the thumbnails, see `Attachment.thumbnails`, or
+        `None` if any of them is missing
+    """
+    default_storage = get_storage_class()()
+    manifest = {}
+    for key in settings.THUMB_ORDER:
+        path = get_path(filename, settings.THUMB_CONF[key]['suffix'])
+        if not default_storage.exists(path):
+            return None
+        size = default_storage.size(path)
+        if not size:
+            return None
+        manifest[key] = {'key': path, 'size': size}
+    return manifest
+
+
+def requeue_stale_thumbnails(attachment):
+    """
+    Queue the `create_attachment_thumbnails` task again if the thumbnails of
+    `attachment` have been pending for more than
+    `THUMBNAILS_PENDING_TIMEOUT` minutes, e.g. because the worker creating
+    them died
+
+    :returns: Whether the task was queued
+    """
+    # Avoid circular imports
+    from onadata.apps.logger.models import Attachment
+    from onadata.apps.logger.tasks import create_attachment_thumbnails
+
+    if attachment.thumbnails_status != Attachment.THUMBNAILS_PENDING:
+        return False
+    now = timezone.now()
+    cutoff = now - timedelta(minutes=settings.THUMBNAILS_PENDING_TIMEOUT)
+    if attachment.thumbnails_requested is not None and \
+            attachment.thumbnails_requested >= cutoff:
+        return False
+    # Only the first of concurrent callers gets to queue it
+    updated = Attachment.objects.filter(
+        Q(thumbnails_requested=None) | Q(thumbnails_requested__lt=cutoff),
+        pk=attachment.pk,
+        thumbnails_status=Attachment.THUMBNAILS_PENDING,
+    ).update(thumbnails_requested=now)
+    attachment.thumbnails_requested = now
+    if not updated:
+        return False
+    create_attachment_thumbnails.delay(attachment.pk)
+    return True
+
+
+def resize(filename):
+    create_thumbnails(filename)
 
 
 def image_url(attachment, suffix):
     """
     Return url of an image given size(@param suffix)
-    e.g large, medium, small, or generate required thumbnail
+    e.g large, medium, small. Thumbnails are created by the
+    `create_attachment_thumbnails` task; until they are, the original is
+    returned.
+
+    Once recorded in `Attachment.thumbnails`, thumbnails are not looked up
+    in the storage anymore.
     """
+    # Avoid circular imports
+    from onadata.apps.logger.models import Attachment
+    from onadata.apps.logger.tasks import create_attachment_thumbnails
+
     url = attachment.media_file.url
     if suffix == 'original':
         return url
     else:
         default_storage = get_storage_class()()
         if suffix in settings.THUMB_CONF:
-            size = settings.THUMB_CONF[suffix]['suffix']
+            if attachment.thumbnails_status == Attachment.THUMBNAILS_CREATED \
+                    and attachment.thumbnails is not None:
+                thumbnail = attachment.thumbnails.get(suffix)
+                if thumbnail:
+                    url = default_storage.url(thumbnail['key'])
+                return url
+            if attachment.thumbnails_status == Attachment.THUMBNAILS_PENDING:
+                requeue_stale_thumbnails(attachment)
+                return url
+            if attachment.thumbnails_status == Attachment.THUMBNAILS_FAILED:
+                return url
+            # The thumbnails predate the manifest, or the attachment predates
+            # the task: look them up once and record them. Claim the
+            # attachment first, so that concurrent views do not all do it
+            claimed = Attachment.objects.filter(
+                pk=attachment.pk, thumbnails_status=None,
+            ).update(thumbnails_status=Attachment.THUMBNAILS_PENDING,
+                     thumbnails_requested=timezone.now())
+            if not claimed:
+                return url
+            attachment.thumbnails_status = Attachment.THUMBNAILS_PENDING
             filename = attachment.media_file.name
-            if default_storage.exists(filename):
-                if default_storage.exists(get_path(filename, size)) and \
-                        default_storage.size(get_path(filename, size)) > 0:
-                    url = default_storage.url(
-                        get_path(filename, size))
-                else:
-                    resize(filename)
-                    return image_url(attachment, suffix)
-            else:
+            if not default_storage.exists(filename):
+                attachment.thumbnails_status = Attachment.THUMBNAILS_FAILED
+                Attachment.objects.filter(pk=attachment.pk).update(
+                    thumbnails_status=attachment.thumbnails_status)
                 return None
+            manifest = get_thumbnails_manifest(filename)
+            if manifest is None:
+                create_attachment_thumbnails.delay(attachment.pk)
+            else:
+                attachment.set_thumbnails(manifest)
+                url = default_storage.url(manifest[suffix]['key'])
     return url
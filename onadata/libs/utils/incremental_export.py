@@ -0,0 +1,171 @@
+# coding: utf-8
+"""
+Unfiltered CSV exports which only append the submissions received since the
+previous export.
+
+An export generated here records its high-water mark, i.e. the `_id` of its
+last submission, its number of rows and its columns. The next export copies
+it and appends the submissions whose `_id` is greater, unless:
+ * it was generated with other options;
+ * the form was replaced since;
+ * a submission up to the high-water mark was edited or deleted since, as
+   recorded by `SubmissionChange`;
+ * Mongo now has more submissions up to the high-water mark than it has
+   rows: documents are not written in `_id` order, e.g. by concurrent
+   requests, the Mongo outbox or `remongo`;
+ * new submissions have repeat columns missing from it.
+Then the export is rebuilt from scratch, with the streaming CSV engine, and
+with checkpoints if `EXPORT_CHECKPOINT_ROWS` is set.
+"""
+import codecs
+import csv
+import shutil
+
+from django.conf import settings
+from django.core.files.storage import get_storage_class
+from django.core.files.temp import NamedTemporaryFile
+
+from onadata.apps.logger.models import SubmissionChange
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.parsed_instance import xform_instances
+from onadata.libs.exceptions import NoRecordsFoundError
+from onadata.libs.utils.checkpointed_export import \
+    generate_checkpointed_export
+from onadata.libs.utils.export_tools import save_export
+from onadata.libs.utils.sharded_export import (
+    get_csv_builder,
+    get_export_options,
+    get_query,
+    get_xform,
+)
+
+# `get_export_options()` keys which change the content of the export
+BUILDER_OPTIONS = [
+    'group_delimiter',
+    'split_select_multiples',
+    'binary_select_multiples',
+]
+
+
+def is_incremental(export_type, filter_query):
+    return (settings.CSV_EXPORT_INCREMENTAL and
+            export_type == Export.CSV_EXPORT and filter_query is None)
+
+
+def get_base_export(xform, options):
+    """
+    The latest export to which the submissions received since can be
+    appended, or `None`
+    """
+    try:
+        base = Export.objects.filter(
+            xform=xform, export_type=Export.CSV_EXPORT,
+            internal_status=Export.SUCCESSFUL,
+            high_water_mark__isnull=False,
+        ).latest('created_on')
+    except Export.DoesNotExist:
+        return None
+
+    state = base.incremental_state or {}
+    if any(state.get(key) != options[key] for key in BUILDER_OPTIONS):
+        return None
+    if state.get('xform_hash') != xform.hash:
+        return None
+    if SubmissionChange.touches(xform.pk, base.created_on,
+                                base.high_water_mark):
+        return None
+    if state.get('rows') != xform_instances.count_documents(
+            get_query(options, last_id=base.high_water_mark),
+            maxTimeMS=settings.MONGO_DB_MAX_TIME_MS):
+        return None
+    if not base.filepath or not get_storage_class()().exists(base.filepath):
+        return None
+    return base
+
+
+def _append_rows(export_file, base, csv_builder):
+    """
+    Copy `base` to `export_file` and append the rows of the submissions
+    received since
+
+    :returns: The new high-water mark and number of rows, or `(None, None)`
+        if the new submissions do not fit the columns of `base`
+    """
+    first_id = base.high_water_mark + 1
+    float_columns, max_id = csv_builder.discover_columns(first_id)
+    columns = base.incremental_state['columns']
+    if not set(csv_builder.get_csv_columns()).issubset(columns):
+        return None, None
+
+    with get_storage_class()().open(base.filepath, 'rb') as base_file:
+        shutil.copyfileobj(base_file, export_file)
+    rows = base.incremental_state['rows']
+    if max_id is None:
+        # nothing new
+        return base.high_water_mark, rows
+    new_rows, _ = csv_builder.write_rows(
+        codecs.getwriter('utf-8')(export_file), columns, float_columns,
+        first_id, max_id)
+    return max_id, rows + new_rows
+
+
+def _write_all_rows(export_file, csv_builder):
+    """
+    :returns: The high-water mark, the number of rows, and the columns
+    """
+    float_columns, max_id = csv_builder.discover_columns()
+    if max_id is None:
+        raise NoRecordsFoundError("No records found for your query")
+    columns = csv_builder.get_csv_columns()
+    writer = codecs.getwriter('utf-8')(export_file)
+    csv.writer(writer, lineterminator='\n').writerow(columns)
+    rows, _ = csv_builder.write_rows(writer, columns, float_columns,
+                                     last_id=max_id)
+    return max_id, rows, columns
+
+
+def generate_incremental_csv_export(username, id_string, export_id=None,
+                                    group_delimiter='/',
+                                    split_select_multiples=True,
+                                    binary_select_multiples=False):
+    options = get_export_options(
+        username, id_string, export_id, None, group_delimiter,
+        split_select_multiples, binary_select_multiples)
+    xform = get_xform(options)
+    csv_builder = get_csv_builder(options)
+    base = get_base_export(xform, options)
+
+    export_file = NamedTemporaryFile(suffix='.csv')
+    export = high_water_mark = columns = None
+    if base is not None:
+        high_water_mark, rows = _append_rows(export_file, base, csv_builder)
+        columns = base.incremental_state['columns']
+    if high_water_mark is None and settings.EXPORT_CHECKPOINT_ROWS and \
+            export_id is not None:
+        # Rebuilding a large form is what checkpoints are for
+        export = generate_checkpointed_export(
+            Export.CSV_EXPORT, options, settings.EXPORT_CHECKPOINT_ROWS)
+        high_water_mark = export.final_checkpoint['max_id']
+        columns = export.final_checkpoint['columns']
+        rows = export.rows_done
+    elif high_water_mark is None:
+        export_file.seek(0)
+        export_file.truncate()
+        high_water_mark, rows, columns = _write_all_rows(export_file,
+                                                         csv_builder)
+
+    if export is None:
+        export = save_export(xform, Export.CSV_EXPORT, 'csv', export_file,
+                             export_id)
+    state = dict((key, options[key]) for key in BUILDER_OPTIONS)
+    state['columns'] = columns
+    state['rows'] = rows
+    state['xform_hash'] = xform.hash
+    export.high_water_mark = high_water_mark
+    export.incremental_state = state
+    # Export.save() is a busybody; bypass it with update()
+    Export.objects.filter(pk=export.pk).update(
+        high_water_mark=high_water_mark, incremental_state=state)
+    # Only changes since the latest export matter from now on
+    SubmissionChange.prune(xform.pk, export.created_on)
+    return export
@@ -1,9 +1,12 @@
 # coding: utf-8
+import logging
+import mimetypes
 import os
 import re
 import sys
 import tempfile
 import traceback
+from collections import OrderedDict
 from datetime import date, datetime
 from xml.parsers.expat import ExpatError
 
@@ -14,8 +17,8 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError, PermissionDenied
 from django.core.files.storage import get_storage_class
 from django.core.mail import mail_admins
-from django.db import IntegrityError, transaction
-from django.db.models import Q
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, DateTimeField, Q, Value, When
 from django.db.models.signals import pre_delete
 from django.http import (
     HttpResponse,
@@ -27,6 +30,7 @@ from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.encoding import DjangoUnicodeDecodeError, smart_str
 from django.utils.translation import ugettext as _
+from lxml.etree import XMLSyntaxError
 from modilabs.utils.subprocess_timeout import ProcessTimedOut
 from pyxform.errors import PyXFormError
 from pyxform.xform2json import create_survey_element_from_xml
@@ -36,6 +40,7 @@ from wsgiref.util import FileWrapper
 from onadata.apps.logger.exceptions import FormInactiveError, DuplicateUUIDError
 from onadata.apps.logger.models import Attachment
 from onadata.apps.logger.models import Instance
+from onadata.apps.logger.models import SurveyType
 from onadata.apps.logger.models import XForm
 from onadata.apps.logger.models.attachment import (
     generate_attachment_filename,
@@ -44,6 +49,8 @@ from onadata.apps.logger.models.attachment import (
 from onadata.apps.logger.models.instance import (
     InstanceHistory,
     get_id_string_from_xml_str,
+    increment_user_submissions_counter,
+    increment_xform_submission_count,
     update_xform_submission_count,
     update_user_submissions_counter,
 )
@@ -53,16 +60,17 @@ from onadata.apps.logger.xform_instance_parser import (
     InstanceInvalidUserError,
     InstanceMultipleNodeError,
     DuplicateInstance,
+    ParsedSubmission,
     clean_and_parse_xml,
-    get_uuid_from_xml,
-    get_deprecated_uuid_from_xml,
-    get_submission_date_from_xml)
+    get_uuid_from_xml)
 from onadata.apps.main.models import UserProfile
 from onadata.apps.viewer.models.data_dictionary import DataDictionary
 from onadata.apps.viewer.models.parsed_instance import _remove_from_mongo, \
     xform_instances, ParsedInstance
-from onadata.libs.utils import common_tags
-from onadata.libs.utils.model_tools import queryset_iterator, set_uuid
+from onadata.libs.utils.duplicate_filter import duplicate_filter
+from onadata.libs.utils.model_tools import set_uuid
+from onadata.libs.utils.mongo_drift import get_drift
+from onadata.libs.utils.mongo_rebuild import rebuild_mongo
 
 OPEN_ROSA_VERSION_HEADER = 'X-OpenRosa-Version'
 HTTP_OPEN_ROSA_VERSION_HEADER = 'HTTP_X_OPENROSA_VERSION'
@@ -73,19 +81,24 @@ DEFAULT_CONTENT_LENGTH = settings.DEFAULT_CONTENT_LENGTH
 uuid_regex = re.compile(r'<formhub>\s*<uuid>\s*([^<]+)\s*</uuid>\s*</formhub>',
                         re.DOTALL)
 
-mongo_instances = settings.MONGO_DB.instances
-
 
 def _get_instance(xml, new_uuid, submitted_by, status, xform,
-                  defer_counting=False):
+                  defer_counting=False, parsed_submission=None):
     """
     `defer_counting=False` will set a Python-only attribute of the same name on
     the *new* `Instance` if one is created. This will prevent
     `update_xform_submission_count()` from doing anything, which avoids locking
     any rows in `logger_xform` or `main_userprofile`.
+
+    `parsed_submission` is the `ParsedSubmission` of `xml`, if the caller
+    already has one; it is handed over to the `Instance` to avoid parsing
+    `xml` again.
     """
+    if parsed_submission is None:
+        parsed_submission = ParsedSubmission(xml)
+
     # check if its an edit submission
-    old_uuid = get_deprecated_uuid_from_xml(xml)
+    old_uuid = parsed_submission.deprecated_uuid
     instances = Instance.objects.filter(uuid=old_uuid)
 
     if instances:
@@ -95,6 +108,7 @@ def _get_instance(xml, new_uuid, submitted_by, status, xform,
         InstanceHistory.objects.create(
             xml=instance.xml, xform_instance=instance, uuid=old_uuid)
         instance.xml = xml
+        instance.parsed_submission = parsed_submission
         instance._populate_xml_hash()
         instance.uuid = new_uuid
         instance.save()
@@ -104,6 +118,7 @@ def _get_instance(xml, new_uuid, submitted_by, status, xform,
         # attribute, `defer_counting`, before saving
         instance = Instance()
         instance.xml = xml
+        instance.parsed_submission = parsed_submission
         instance.user = submitted_by
         instance.status = status
         instance.xform = xform
@@ -132,7 +147,8 @@ def get_uuid_from_submission(xml):
     return len(split_xml) > 1 and split_xml[1] or None
 
 
-def get_xform_from_submission(xml, username, uuid=None):
+def get_xform_from_submission(xml, username, uuid=None,
+                              parsed_submission=None):
     # check alternative form submission ids
     uuid = uuid or get_uuid_from_submission(xml)
 
@@ -148,7 +164,10 @@ def get_xform_from_submission(xml, username, uuid=None):
         else:
             return xform
 
-    id_string = get_id_string_from_xml_str(xml)
+    if parsed_submission is not None:
+        id_string = parsed_submission.id_string
+    else:
+        id_string = get_id_string_from_xml_str(xml)
 
     return get_object_or_404(XForm, id_string__exact=id_string,
                              user__username=username)
@@ -204,10 +223,22 @@ def check_submission_permissions(request, xform):
                   'form_title': xform.title}))
 
 
-def save_attachments(instance, media_files):
+def _create_thumbnails_on_commit(attachment):
+    # Avoid circular import
+    from onadata.apps.logger.tasks import create_attachment_thumbnails
+
+    transaction.on_commit(
+        lambda: create_attachment_thumbnails.delay(attachment.pk))
+
+
+def save_attachments(instance, media_files, stored_files=None):
     """
     Returns `True` if any new attachment was saved, `False` if all attachments
     were duplicates or none were provided
+
+    :param list stored_files: Gets the names of the files written to the
+        storage appended, e.g. to delete them if the transaction is rolled
+        back
     """
     any_new_attachment = False
     for f in media_files:
@@ -222,18 +253,34 @@ def save_attachments(instance, media_files):
             # We already have this attachment!
             continue
         f.seek(0)
+        # Guess the mimetype like `Attachment.save()` would, to know whether
+        # thumbnails are needed before creating the attachment
+        mimetype = f.content_type or mimetypes.guess_type(f.name)[0] or ''
+        thumbnails_fields = {}
+        if mimetype.startswith('image'):
+            thumbnails_fields = {
+                'thumbnails_status': Attachment.THUMBNAILS_PENDING,
+                'thumbnails_requested': timezone.now(),
+            }
         # This is a new attachment; save it!
-        Attachment.objects.create(
+        attachment = Attachment.objects.create(
             instance=instance,
-            media_file=f, mimetype=f.content_type)
+            media_file=f, mimetype=mimetype, **thumbnails_fields)
+        if stored_files is not None:
+            stored_files.append(attachment.media_file.name)
+        if thumbnails_fields:
+            _create_thumbnails_on_commit(attachment)
         any_new_attachment = True
     return any_new_attachment
 
 
 def save_submission(xform, xml, media_files, new_uuid, submitted_by, status,
-                    date_created_override):
+                    date_created_override, parsed_submission=None):
+    if parsed_submission is None:
+        parsed_submission = ParsedSubmission(xml)
+
     if not date_created_override:
-        date_created_override = get_submission_date_from_xml(xml)
+        date_created_override = parsed_submission.submission_date
 
     # We have to save the `Instance` to the database before we can associate
     # any `Attachment`s with it, but we are inside a transaction and saving
@@ -250,7 +297,8 @@ def save_submission(xform, xml, media_files, new_uuid, submitted_by, status,
     # responsible for calling `update_xform_submission_count()` if the returned
     # `Instance` has `defer_counting = True`.
     instance = _get_instance(xml, new_uuid, submitted_by, status, xform,
-                             defer_counting=True)
+                             defer_counting=True,
+                             parsed_submission=parsed_submission)
 
     save_attachments(instance, media_files)
 
@@ -264,11 +312,12 @@ def save_submission(xform, xml, media_files, new_uuid, submitted_by, status,
         instance.save()
 
     if instance.xform is not None:
-        pi, created = ParsedInstance.objects.get_or_create(
-            instance=instance)
-
-    if not created:
-        pi.save(asynchronous=False)
+        pi = ParsedInstance.objects.filter(instance=instance).first() or \
+            ParsedInstance(instance=instance)
+        # Reuse `instance`, and the submission it has already parsed, instead
+        # of letting `pi` fetch a fresh copy from the database
+        pi.instance = instance
+        pi.save(asynchronous=False, outbox=settings.MONGO_OUTBOX_ENABLED)
 
     # Now that the slow tasks are complete and we are (hopefully!) close to the
     # end of the transaction, update the submission count if the `Instance` was
@@ -301,12 +350,22 @@ def create_instance(username, xml_file, media_files,
         username = username.lower()
 
     xml = smart_str(xml_file.read())
-    xml_hash = Instance.get_hash(xml)
-    xform = get_xform_from_submission(xml, username, uuid)
+    # Parse the XML once and share the result with everything downstream
+    parsed_submission = ParsedSubmission(xml)
+    xform = get_xform_from_submission(xml, username, uuid,
+                                      parsed_submission=parsed_submission)
     check_submission_permissions(request, xform)
 
+    return _create_instance_for_xform(xform, xml, parsed_submission,
+                                      media_files, submitted_by, status,
+                                      date_created_override)
+
+
+def _create_instance_for_xform(xform, xml, parsed_submission, media_files,
+                               submitted_by, status, date_created_override):
+    xml_hash = Instance.get_hash(xml)
     # get new and deprecated uuid's
-    new_uuid = get_uuid_from_xml(xml)
+    new_uuid = parsed_submission.uuid
 
     # Dorey's rule from 2012 (commit 890a67aa):
     #   Ignore submission as a duplicate IFF
@@ -324,10 +383,17 @@ def create_instance(username, xml_file, media_files,
         # content hash is not present, by string comparison of the full
         # content, which is slow! Use the management command
         # `populate_xml_hashes_for_instances` to hash existing submissions
-        existing_instance = Instance.objects.filter(
-            Q(xml_hash=xml_hash) | Q(xml_hash=Instance.DEFAULT_XML_HASH, xml=xml),
-            xform__user=xform.user,
-        ).first()
+        seen = duplicate_filter.check(xform.user_id, xml_hash, new_uuid)
+        if seen is False:
+            # Certainly not a duplicate
+            existing_instance = None
+        else:
+            existing_instance = Instance.objects.filter(
+                Q(xml_hash=xml_hash) | Q(xml_hash=Instance.DEFAULT_XML_HASH, xml=xml),
+                xform__user=xform.user,
+            ).first()
+            if seen and existing_instance is None:
+                duplicate_filter.record_false_positive()
     else:
         existing_instance = None
 
@@ -337,16 +403,230 @@ def create_instance(username, xml_file, media_files,
         if not any_new_attachment:
             raise DuplicateInstance()
         else:
-            # Update Mongo via the related ParsedInstance
-            existing_instance.parsed_instance.save(asynchronous=False)
+            # Update Mongo via the related ParsedInstance. The XML content
+            # is identical, so the submission parsed above can be reused
+            existing_instance.parsed_submission = parsed_submission
+            existing_instance.parsed_instance.save(
+                asynchronous=False, outbox=settings.MONGO_OUTBOX_ENABLED)
             return existing_instance
     else:
         instance = save_submission(xform, xml, media_files, new_uuid,
                                    submitted_by, status,
-                                   date_created_override)
+                                   date_created_override,
+                                   parsed_submission=parsed_submission)
         return instance
 
 
+def create_instances(username, submissions, status='submitted_via_web',
+                     request=None):
+    """
+    Batch counterpart of `create_instance()`, e.g. for the submissions found
+    in a bulk-submission ZIP file.
+
+    New submissions are written with one `INSERT` per table and form, one
+    Mongo `bulk_write()` and a single update of the submission counters.
+    Duplicates and edits are rarer and have subtle rules, so they still go
+    through `create_instance()`'s code path, one at a time.
+
+    :param list submissions: `(xml_file, media_files)` tuples
+    :returns: A list of `(instance, error)` pairs, in the order of
+        `submissions`, where exactly one of each pair is `None`.
+    """
+    submitted_by = request.user \
+        if request and request.user.is_authenticated else None
+
+    if username:
+        username = username.lower()
+
+    results = [None] * len(submissions)
+    xforms = {}
+    xforms_by_pk = OrderedDict()
+    # xform pk => submissions to that form, as
+    # `(index, xml, parsed_submission, media_files)`
+    submissions_by_xform = OrderedDict()
+
+    for index, (xml_file, media_files) in enumerate(submissions):
+        try:
+            xml = smart_str(xml_file.read())
+            parsed_submission = ParsedSubmission(xml)
+            # Look each form up once per batch
+            key = get_uuid_from_submission(xml), parsed_submission.id_string
+            if key not in xforms:
+                xforms[key] = get_xform_from_submission(
+                    xml, username, parsed_submission=parsed_submission)
+                check_submission_permissions(request, xforms[key])
+        except Exception as e:
+            results[index] = (None, e)
+            continue
+        xform = xforms_by_pk.setdefault(xforms[key].pk, xforms[key])
+        submissions_by_xform.setdefault(xform.pk, []).append(
+            (index, xml, parsed_submission, media_files))
+
+    for xform_pk, items in submissions_by_xform.items():
+        xform = xforms_by_pk[xform_pk]
+        new_items, other_items = _split_new_submissions(xform, items)
+        stored_files = []
+        try:
+            with transaction.atomic():
+                for index, result in _bulk_save_submissions(
+                        xform, new_items, submitted_by, status,
+                        stored_files):
+                    results[index] = result
+        except Exception:
+            logging.getLogger().warning(
+                'Bulk save failed; saving submissions one at a time.',
+                exc_info=True)
+            # Only the database was rolled back: the attachments would be
+            # stored twice
+            storage = get_storage_class()()
+            for name in stored_files:
+                storage.delete(name)
+            other_items = sorted(new_items + other_items)
+
+        for index, xml, parsed_submission, media_files in other_items:
+            try:
+                with transaction.atomic():
+                    instance = _create_instance_for_xform(
+                        xform, xml, parsed_submission, media_files,
+                        submitted_by, status, None)
+            except Exception as e:
+                results[index] = (None, e)
+            else:
+                results[index] = (instance, None)
+
+    return results
+
+
+def _split_new_submissions(xform, items):
+    """
+    Tell apart, with one query each for duplicates and edits, the
+    submissions `_bulk_save_submissions()` can insert from those that need
+    `_create_instance_for_xform()`.
+    """
+    # See Dorey's rule in `_create_instance_for_xform()`
+    hashes = {}
+    for item in items:
+        index, xml, parsed_submission, media_files = item
+        if xform.has_start_time or parsed_submission.uuid is not None:
+            hashes[index] = Instance.get_hash(xml)
+    existing_hashes = set()
+    if hashes:
+        existing_instances = Instance.objects.filter(
+            xform__user=xform.user)
+        existing_hashes.update(existing_instances.filter(
+            xml_hash__in=set(hashes.values())
+        ).values_list('xml_hash', flat=True))
+        # Submissions saved before `xml_hash` existed
+        existing_hashes.update(
+            Instance.get_hash(xml) for xml in existing_instances.filter(
+                xml_hash=Instance.DEFAULT_XML_HASH,
+                xml__in=[item[1] for item in items if item[0] in hashes],
+            ).values_list('xml', flat=True))
+
+    deprecated_uuids = set(
+        item[2].deprecated_uuid for item in items
+        if item[2].deprecated_uuid is not None)
+    if deprecated_uuids:
+        deprecated_uuids = set(Instance.objects.filter(
+            uuid__in=deprecated_uuids).values_list('uuid', flat=True))
+
+    new_items = []
+    other_items = []
+    for item in items:
+        index, xml, parsed_submission, media_files = item
+        xml_hash = hashes.get(index)
+        if (xml_hash in existing_hashes or
+                parsed_submission.deprecated_uuid in deprecated_uuids):
+            other_items.append(item)
+        else:
+            new_items.append(item)
+        if xml_hash is not None:
+            # Later copies within the batch are duplicates of this one
+            existing_hashes.add(xml_hash)
+
+    return new_items, other_items
+
+
+def _bulk_save_submissions(xform, items, submitted_by, status,
+                           stored_files=None):
+    """
+    Save new submissions to `xform` in bulk, the way `save_submission()`
+    does one at a time. Yields `(index, (instance, error))` pairs.
+
+    :param list stored_files: See `save_attachments()`
+    """
+    survey_types = {}
+    instances = []
+    indexes = []
+    # `auto_now_add` overwrites `date_created` upon insert, so overrides are
+    # applied afterwards
+    dates_created = {}
+    for index, xml, parsed_submission, media_files in items:
+        instance = Instance(xml=xml, user=submitted_by, status=status,
+                            xform=xform)
+        instance.parsed_submission = parsed_submission
+        date_created_override = parsed_submission.submission_date
+        if date_created_override:
+            if not timezone.is_aware(date_created_override):
+                date_created_override = timezone.make_aware(
+                    date_created_override, timezone.utc)
+            instance.date_created = date_created_override
+            dates_created[index] = date_created_override
+        try:
+            slug = parsed_submission.root_node_name
+            if slug not in survey_types:
+                survey_types[slug] = SurveyType.objects.get_or_create(
+                    slug=slug)[0]
+            instance.survey_type = survey_types[slug]
+            instance._prepare_for_save()
+        except Exception as e:
+            yield index, (None, e)
+            continue
+        instances.append(instance)
+        indexes.append(index)
+
+    if not instances:
+        return
+
+    if connection.features.can_return_ids_from_bulk_insert:
+        Instance.objects.bulk_create(instances)
+        # `bulk_create()` does not send `post_save`, which adds the others
+        duplicate_filter.add(xform.user_id, [
+            (instance.xml_hash, instance.uuid) for instance in instances])
+    else:
+        # e.g. SQLite, which cannot return the primary keys of the new rows
+        for instance in instances:
+            instance.defer_counting = True
+            super(Instance, instance).save()
+            del instance.defer_counting
+
+    overrides = {}
+    for index, instance in zip(indexes, instances):
+        if index in dates_created:
+            instance.date_created = dates_created[index]
+            overrides[instance.pk] = instance.date_created
+    if overrides:
+        Instance.objects.filter(pk__in=overrides).update(
+            date_created=Case(
+                *[When(pk=pk, then=Value(date_created))
+                  for pk, date_created in overrides.items()],
+                output_field=DateTimeField()))
+
+    media_files_by_index = dict((item[0], item[3]) for item in items)
+    for index, instance in zip(indexes, instances):
+        save_attachments(instance, media_files_by_index[index], stored_files)
+
+    ParsedInstance.bulk_save(
+        [ParsedInstance(instance=instance) for instance in instances])
+
+    increment_xform_submission_count(xform.pk, instances[-1].date_created,
+                                     count=len(instances))
+    increment_user_submissions_counter(xform.pk, count=len(instances))
+
+    for index, instance in zip(indexes, instances):
+        yield index, (instance, None)
+
+
 def safe_create_instance(username, xml_file, media_files, uuid, request):
     """Create an instance and catch exceptions.
 
@@ -370,7 +650,7 @@ def safe_create_instance(username, xml_file, media_files, uuid, request):
         error = OpenRosaResponseNotFound(
             _("Form does not exist on this account")
         )
-    except ExpatError as e:
+    except (ExpatError, XMLSyntaxError) as e:
         error = OpenRosaResponseBadRequest(_("Improperly formatted XML."))
     except DuplicateInstance:
         response = OpenRosaResponse(_("Duplicate submission"))
@@ -623,62 +903,44 @@ def inject_instanceid(xml_str, uuid):
     return xml_str
 
 
-def update_mongo_for_xform(xform, only_update_missing=True):
+def update_mongo_for_xform(xform, only_update_missing=True, workers=0):
+    rebuild_mongo_for_xforms([xform], only_update_missing, workers)
 
-    instance_ids = set(
-        [i.id for i in Instance.objects.only('id').filter(xform=xform)])
-    sys.stdout.write("Total no of instances: %d\n" % len(instance_ids))
-    mongo_ids = set()
-    user = xform.user
-    userform_id = "%s_%s" % (user.username, xform.id_string)
+
+def rebuild_mongo_for_xforms(xforms, only_update_missing=True, workers=0):
+    """
+    Write the Mongo documents of the submissions of `xforms`, several forms
+    at a time; see `onadata.libs.utils.mongo_rebuild`
+
+    :param bool only_update_missing: Only write the missing documents;
+        otherwise, delete and re-create all of them
+    """
     if only_update_missing:
         sys.stdout.write("Only updating missing mongo instances\n")
-        mongo_ids = set(
-            [rec[common_tags.ID] for rec in mongo_instances.find(
-                {common_tags.USERFORM_ID: userform_id},
-                {common_tags.ID: 1},
-                max_time_ms=settings.MONGO_DB_MAX_TIME_MS
-)])
-        sys.stdout.write("Total no of mongo instances: %d\n" % len(mongo_ids))
-        # get the difference
-        instance_ids = instance_ids.difference(mongo_ids)
-    else:
-        # clear mongo records
-        mongo_instances.delete_many({common_tags.USERFORM_ID: userform_id})
-    # get instances
-    sys.stdout.write(
-        "Total no of instances to update: %d\n" % len(instance_ids))
-    instances = Instance.objects.only('id').in_bulk(
-        [id_ for id_ in instance_ids])
-    total = len(instances)
-    done = 0
-    for id_, instance in instances.items():
-        (pi, created) = ParsedInstance.objects.get_or_create(instance=instance)
-        try:
-            save_success = pi.save(asynchronous=False)
-        except InstanceEmptyError:
-            print(
-                "\033[91m[WARNING] - Skipping Instance #{}/uuid:{} because "
-                "it is empty\033[0m".format(id_, instance.uuid)
-            )
-        else:
-            if not save_success:
-                print(
-                    "\033[91m[ERROR] - Instance #{}/uuid:{} - Could not save "
-                    "the parsed instance\033[0m".format(id_, instance.uuid)
-                )
-            else:
-                done += 1
 
-        progress = "\r%.2f %% done..." % ((float(done) / float(total)) * 100)
-        sys.stdout.write(progress)
+    def progress(stats):
+        sys.stdout.write(
+            "\r%d documents written in %d seconds, %d per second..." % (
+                stats['written'], stats['elapsed'],
+                stats['documents_per_second']))
         sys.stdout.flush()
+
+    stats = rebuild_mongo(xforms, only_missing=only_update_missing,
+                          replace_all=not only_update_missing,
+                          workers=workers, progress_callback=progress)
+    for pk, error in sorted(stats['errors'].items()):
+        print(
+            "\033[91m[ERROR] - Instance #{} - Could not save "
+            "the parsed instance: {}\033[0m".format(pk, error)
+        )
     sys.stdout.write(
-        "\nUpdated %s\n------------------------------------------\n"
-        % xform.id_string)
+        "\nUpdated %d forms\n------------------------------------------\n"
+        % stats['forms'])
+    return stats
 
 
-def mongo_sync_status(remongo=False, update_all=False, user=None, xform=None):
+def mongo_sync_status(remongo=False, update_all=False, user=None, xform=None,
+                      workers=0, deep=False):
     """Check the status of records in the mysql db versus mongodb. At a
     minimum, return a report (string) of the results.
 
@@ -691,58 +953,66 @@ def mongo_sync_status(remongo=False, update_all=False, user=None, xform=None):
     user       -> if specified, apply only to the forms for the given user
                   (default: None)
     xform      -> if specified, apply only to the given form (default: None)
+    workers    -> number of processes parsing submissions when remongo is
+                  True; None for the number of CPUs (default: 0, i.e. in
+                  this process, which is all Celery workers can do)
+    deep       -> if True, also find the missing, stale and extra records,
+                  not just how many are missing (default: False)
 
     """
 
-    qs = XForm.objects.only('id_string', 'user').select_related('user')
+    qs = None
     if user and not xform:
-        qs = qs.filter(user=user)
+        qs = XForm.objects.filter(user=user)
     elif user and xform:
-        qs = qs.filter(user=user, id_string=xform.id_string)
-    else:
-        qs = qs.all()
+        qs = XForm.objects.filter(user=user, id_string=xform.id_string)
 
-    total = qs.count()
     found = 0
-    done = 0
     total_to_remongo = 0
+    xforms_to_remongo = []
     report_string = ""
-    for xform in queryset_iterator(qs, 100):
-        # get the count
-        user = xform.user
-        instance_count = Instance.objects.filter(xform=xform).count()
-        userform_id = "%s_%s" % (user.username, xform.id_string)
-        mongo_count = mongo_instances.count_documents(
-            {common_tags.USERFORM_ID: userform_id},
-            maxTimeMS=settings.MONGO_DB_MAX_TIME_MS
-        )
-
-        if instance_count != mongo_count or update_all:
+    for form in get_drift(qs, deep=deep):
+        out_of_sync = form['postgres_count'] != form['mongo_count']
+        if deep:
+            out_of_sync = out_of_sync or any(
+                (form['missing'], form['stale'], form['extra']))
+        if out_of_sync or update_all:
             line = "user: %s, id_string: %s\nInstance count: %d\t"\
-                   "Mongo count: %d\n---------------------------------"\
-                   "-----\n" % (
-                       user.username, xform.id_string, instance_count,
-                       mongo_count)
-            report_string += line
+                   "Mongo count: %d\n" % (
+                       form['username'], form['id_string'],
+                       form['postgres_count'], form['mongo_count'])
+            if deep:
+                line += "Missing: %d\tStale: %d\tExtra: %d\n" % (
+                    len(form['missing']), len(form['stale']),
+                    len(form['extra']))
+            report_string += line + "---------------------------------"\
+                                    "-----\n"
             found += 1
-            total_to_remongo += (instance_count - mongo_count)
+            if deep:
+                total_to_remongo += len(form['missing']) + len(form['stale'])
+            else:
+                total_to_remongo += \
+                    form['postgres_count'] - form['mongo_count']
 
             # should we remongo
-            if remongo or (remongo and update_all):
+            if remongo:
                 if update_all:
                     sys.stdout.write(
                         "Updating all records for %s\n--------------------"
-                        "---------------------------\n" % xform.id_string)
+                        "---------------------------\n" % form['id_string'])
                 else:
                     sys.stdout.write(
                         "Updating missing records for %s\n----------------"
                         "-------------------------------\n"
-                        % xform.id_string)
-                update_mongo_for_xform(
-                    xform, only_update_missing=not update_all)
-        done += 1
-        sys.stdout.write(
-            "%.2f %% done ...\r" % ((float(done) / float(total)) * 100))
+                        % form['id_string'])
+                xforms_to_remongo.append(form['xform_id'])
+    if xforms_to_remongo:
+        # All together, so that several forms get written at a time
+        rebuild_mongo_for_xforms(
+            XForm.objects.filter(pk__in=xforms_to_remongo).select_related(
+                'user').order_by('pk'),
+            only_update_missing=not update_all,
+            workers=workers)
     # only show stats if we are not updating mongo, the update function
     # will show progress
     if not remongo:
@@ -0,0 +1,211 @@
+# coding: utf-8
+"""
+Drift between the submissions in PostgreSQL and their documents in Mongo,
+for `mongo_sync_status()`.
+
+The counts of all forms are compared at once: one grouped query on each side,
+joined in memory. The deep mode also compares checksums of ranges of primary
+keys, i.e. the number of submissions, the sum of their primary keys and the
+sum of their modification times, computed by each database, and only lists
+the submissions of the ranges which differ: missing from Mongo, stale, i.e.
+modified since their document was written, or extra, i.e. deleted from
+PostgreSQL. Documents written before `ParsedInstance.MODIFIED_EPOCH` existed
+are reported stale.
+"""
+from collections import defaultdict
+
+from django.db import connection
+from django.db.models import Count
+
+from onadata.apps.logger.models import Instance, XForm
+from onadata.apps.viewer.models.parsed_instance import (
+    ParsedInstance,
+    xform_instances,
+)
+from onadata.libs.utils.common_tags import ID, USERFORM_ID
+
+DEFAULT_RANGE_SIZE = 1000
+
+# `Instance.date_modified` as stored in Mongo documents
+MODIFIED_EPOCH_SQL = 'FLOOR(EXTRACT(EPOCH FROM date_modified))::bigint'
+
+RANGE_CHECKSUMS_SQL = '''
+SELECT xform_id, id - id %% %(range_size)s, COUNT(*), SUM(id),
+       SUM({modified})
+FROM logger_instance
+{where}
+GROUP BY 1, 2
+'''
+
+RANGE_SQL = '''
+SELECT id, {modified}
+FROM logger_instance
+WHERE xform_id = %(xform_id)s AND id >= %(start)s AND id < %(end)s
+'''.format(modified=MODIFIED_EPOCH_SQL)
+
+
+def _get_forms(xforms):
+    """
+    :returns: `{userform_id: (xform_id, username, id_string)}`
+    """
+    forms = {}
+    for xform_id, username, id_string in xforms.values_list(
+            'pk', 'user__username', 'id_string').order_by('pk'):
+        forms['{}_{}'.format(username, id_string)] = (
+            xform_id, username, id_string)
+    return forms
+
+
+def get_postgres_counts(xform_ids=None):
+    """
+    :returns: `{xform_id: number of submissions}`
+    """
+    instances = Instance.objects.all()
+    if xform_ids is not None:
+        instances = instances.filter(xform_id__in=xform_ids)
+    return dict(instances.order_by().values_list('xform_id').annotate(
+        count=Count('pk')))
+
+
+def get_mongo_counts(userform_ids=None):
+    """
+    :returns: `{userform_id: number of documents}`
+    """
+    pipeline = []
+    if userform_ids is not None:
+        pipeline.append({'$match': {USERFORM_ID: {'$in': userform_ids}}})
+    pipeline.append({'$group': {'_id': '$' + USERFORM_ID,
+                                'count': {'$sum': 1}}})
+    return dict((group['_id'], group['count'])
+                for group in xform_instances.aggregate(pipeline,
+                                                       allowDiskUse=True))
+
+
+def get_postgres_range_checksums(range_size, xform_ids=None):
+    """
+    :returns: `{(xform_id, range start): (count, sum of primary keys, sum of
+        modification epochs)}`
+    """
+    params = {'range_size': range_size}
+    where = ''
+    if xform_ids is not None:
+        where = 'WHERE xform_id = ANY(%(xform_ids)s)'
+        params['xform_ids'] = list(xform_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(RANGE_CHECKSUMS_SQL.format(
+            modified=MODIFIED_EPOCH_SQL, where=where), params)
+        return dict(((xform_id, start), (count, int(ids), int(modified)))
+                    for xform_id, start, count, ids, modified in cursor)
+
+
+def get_mongo_range_checksums(range_size, userform_ids=None):
+    """
+    :returns: `{(userform_id, range start): (count, sum of primary keys, sum
+        of modification epochs)}`
+    """
+    pipeline = []
+    if userform_ids is not None:
+        pipeline.append({'$match': {USERFORM_ID: {'$in': userform_ids}}})
+    pipeline.append({'$group': {
+        '_id': {
+            'form': '$' + USERFORM_ID,
+            'start': {'$subtract': [
+                '$' + ID, {'$mod': ['$' + ID, range_size]}]},
+        },
+        'count': {'$sum': 1},
+        'ids': {'$sum': '$' + ID},
+        # Missing from older documents, which then count as stale
+        'modified': {'$sum': '$' + ParsedInstance.MODIFIED_EPOCH},
+    }})
+    return dict(
+        ((group['_id']['form'], int(group['_id']['start'])),
+         (group['count'], int(group['ids']), int(group['modified'])))
+        for group in xform_instances.aggregate(pipeline, allowDiskUse=True))
+
+
+def diff_range(xform_id, userform_id, start, range_size):
+    """
+    Compare the submissions of a range of primary keys one by one
+
+    :returns: `(missing, stale, extra)` lists of primary keys
+    """
+    end = start + range_size
+    with connection.cursor() as cursor:
+        cursor.execute(RANGE_SQL, {'xform_id': xform_id, 'start': start,
+                                   'end': end})
+        in_postgres = dict(cursor.fetchall())
+    in_mongo = dict(
+        (doc[ID], doc.get(ParsedInstance.MODIFIED_EPOCH))
+        for doc in xform_instances.find(
+            {USERFORM_ID: userform_id, ID: {'$gte': start, '$lt': end}},
+            {ParsedInstance.MODIFIED_EPOCH: 1}))
+    missing = sorted(set(in_postgres) - set(in_mongo))
+    extra = sorted(set(in_mongo) - set(in_postgres))
+    stale = sorted(pk for pk, modified in in_postgres.items()
+                   if pk in in_mongo and in_mongo[pk] != modified)
+    return missing, stale, extra
+
+
+def get_drift(xforms=None, deep=False, range_size=DEFAULT_RANGE_SIZE):
+    """
+    Compare the submissions of `xforms` in PostgreSQL with their documents
+    in Mongo
+
+    :param xforms: `XForm` queryset; defaults to all forms
+    :param bool deep: Also list the missing, stale and extra documents
+    :param int range_size: Number of primary keys per checksum, in deep mode
+    :returns: A dict per form, in primary key order, with `xform_id`,
+        `username`, `id_string`, `postgres_count` and `mongo_count`, plus
+        `missing`, `stale` and `extra` lists of primary keys in deep mode
+    """
+    subset = xforms is not None
+    if not subset:
+        xforms = XForm.objects.all()
+    forms = _get_forms(xforms)
+    postgres_counts = get_postgres_counts(
+        [form[0] for form in forms.values()] if subset else None)
+    mongo_counts = get_mongo_counts(list(forms) if subset else None)
+
+    drift = {}
+    for userform_id, (xform_id, username, id_string) in forms.items():
+        drift[userform_id] = {
+            'xform_id': xform_id,
+            'username': username,
+            'id_string': id_string,
+            'postgres_count': postgres_counts.get(xform_id, 0),
+            'mongo_count': mongo_counts.get(userform_id, 0),
+        }
+        if deep:
+            drift[userform_id].update(missing=[], stale=[], extra=[])
+
+    if deep:
+        postgres_checksums = get_postgres_range_checksums(
+            range_size, [form[0] for form in forms.values()]
+            if subset else None)
+        mongo_checksums = get_mongo_range_checksums(
+            range_size, list(forms) if subset else None)
+        # Ranges by form, with the checksums of both sides
+        ranges = defaultdict(dict)
+        for (xform_id, start), checksum in postgres_checksums.items():
+            ranges[xform_id][start] = [checksum, None]
+        xform_ids = dict((userform_id, form[0])
+                         for userform_id, form in forms.items())
+        for (userform_id, start), checksum in mongo_checksums.items():
+            if userform_id not in xform_ids:
+                # Documents of forms which no longer exist
+                continue
+            ranges[xform_ids[userform_id]].setdefault(
+                start, [None, None])[1] = checksum
+
+        for userform_id, form in drift.items():
+            for start, (postgres_checksum, mongo_checksum) in sorted(
+                    ranges[form['xform_id']].items()):
+                if postgres_checksum == mongo_checksum:
+                    continue
+                missing, stale, extra = diff_range(
+                    form['xform_id'], userform_id, start, range_size)
+                form['missing'].extend(missing)
+                form['stale'].extend(stale)
+                form['extra'].extend(extra)
+
+    return sorted(drift.values(), key=lambda form: form['xform_id'])
@@ -0,0 +1,168 @@
+# coding: utf-8
+"""
+Indexes of the Mongo collections, and a log of the slow queries run on them.
+
+Queries on submissions always filter on `_userform_id`, then on whatever
+fields and sorts API users ask for: the declared indexes cover the common
+ones. They are created by the `ensure_mongo_indexes` management command, and
+checked by a system check; slow queries which still need others are logged,
+along with the plan Mongo chose, by `SlowQueryListener`.
+
+This module is imported by the settings, to register `SlowQueryListener`
+when connecting to Mongo: it must not import any model.
+"""
+import logging
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING, IndexModel, monitoring
+
+from onadata.libs.utils.common_tags import (
+    ID,
+    SUBMISSION_TIME,
+    USERFORM_ID,
+    VALIDATION_STATUS,
+)
+
+# Keys of the indexes of each collection
+DECLARED_INDEXES = {
+    'instances': [
+        [(USERFORM_ID, ASCENDING), (ID, ASCENDING)],
+        [(USERFORM_ID, ASCENDING), (SUBMISSION_TIME, ASCENDING)],
+        [(USERFORM_ID, ASCENDING), (VALIDATION_STATUS + '.uid', ASCENDING)],
+    ],
+    'auditlog': [
+        [('account', ASCENDING), ('created_on', DESCENDING)],
+    ],
+}
+
+# Commands `SlowQueryListener` can explain
+EXPLAINABLE_COMMANDS = ('find', 'aggregate', 'count', 'distinct')
+# Commands started but not finished yet, kept for `SlowQueryListener`, per
+# process; more mean that events got lost
+MAX_PENDING_COMMANDS = 1000
+
+
+def _get_keys(index):
+    return [(field, int(direction)) for field, direction in index['key']]
+
+
+def get_missing_indexes(db=None):
+    """
+    :returns: `{collection name: [keys of the declared indexes which do not
+        exist]}`, only for the collections missing some
+    """
+    db = db if db is not None else settings.MONGO_DB
+    missing = {}
+    for collection, declared in DECLARED_INDEXES.items():
+        existing = [_get_keys(index) for index in
+                    db[collection].index_information().values()]
+        keys = [keys for keys in declared if keys not in existing]
+        if keys:
+            missing[collection] = keys
+    return missing
+
+
+def get_undeclared_indexes(db=None):
+    """
+    :returns: `{collection name: [names of the indexes which are not
+        declared]}`, e.g. to drop those made redundant by the declared ones
+    """
+    db = db if db is not None else settings.MONGO_DB
+    undeclared = {}
+    for collection, declared in DECLARED_INDEXES.items():
+        names = [name for name, index in
+                 db[collection].index_information().items()
+                 if name != '_id_' and _get_keys(index) not in declared]
+        if names:
+            undeclared[collection] = names
+    return undeclared
+
+
+def ensure_indexes(db=None):
+    """
+    Create the declared indexes which do not exist, in the background
+
+    :returns: `{collection name: [names of the created indexes]}`
+    """
+    db = db if db is not None else settings.MONGO_DB
+    created = {}
+    for collection, keys in get_missing_indexes(db).items():
+        created[collection] = db[collection].create_indexes(
+            [IndexModel(index_keys, background=True)
+             for index_keys in keys])
+    return created
+
+
+def get_plan_stages(plan):
+    """
+    :returns: The stages of an `explain()` plan, e.g. `['FETCH', 'IXSCAN']`
+    """
+    stages = []
+    while plan:
+        stages.append(plan.get('stage'))
+        # `inputStages` only when several indexes are used at once
+        inputs = plan.get('inputStages', [])
+        for input_plan in inputs:
+            stages.extend(get_plan_stages(input_plan))
+        plan = plan.get('inputStage') if not inputs else None
+    return stages
+
+
+class SlowQueryListener(monitoring.CommandListener):
+    """
+    Logs the queries on the declared collections which take longer than
+    `MONGO_SLOW_QUERY_MS`, with the plan Mongo chose for them; a
+    `COLLSCAN` stage means that no index was used.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._commands = OrderedDict()
+
+    def _is_watched(self, command_name, command):
+        return (settings.MONGO_SLOW_QUERY_MS
+                and command_name in EXPLAINABLE_COMMANDS
+                and command.get(command_name) in DECLARED_INDEXES)
+
+    def started(self, event):
+        if not self._is_watched(event.command_name, event.command):
+            return
+        # Without the session, read preference, etc. added by the driver
+        command = dict((key, value) for key, value in event.command.items()
+                       if not key.startswith('$') and key != 'lsid')
+        with self._lock:
+            self._commands[event.request_id] = (event.database_name, command)
+            while len(self._commands) > MAX_PENDING_COMMANDS:
+                self._commands.popitem(last=False)
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._commands.pop(event.request_id, None)
+        if not pending or event.duration_micros < \
+                settings.MONGO_SLOW_QUERY_MS * 1000:
+            return
+        database_name, command = pending
+        try:
+            explanation = settings.MONGO_CONNECTION[database_name].command(
+                'explain', command, verbosity='queryPlanner')
+        except Exception:
+            logging.getLogger('console_logger').warning(
+                'Slow Mongo query could not be explained', exc_info=True)
+            return
+        self.log(command, event.duration_micros // 1000, explanation)
+
+    def failed(self, event):
+        with self._lock:
+            self._commands.pop(event.request_id, None)
+
+    @staticmethod
+    def log(command, duration_ms, explanation):
+        # `aggregate` explanations nest the plan in their first stage
+        planner = explanation.get('queryPlanner') or explanation.get(
+            'stages', [{}])[0].get('$cursor', {}).get('queryPlanner', {})
+        stages = get_plan_stages(planner.get('winningPlan'))
+        logging.getLogger('console_logger').warning(
+            'Slow Mongo query (%d ms, plan %s): %s', duration_ms,
+            ' < '.join(str(stage) for stage in stages), command)
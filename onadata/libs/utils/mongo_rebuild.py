@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Rebuild of the Mongo documents of whole forms, for the `remongo` and
+`sync_mongo` management commands.
+
+Submissions are read by chunks of primary keys, with everything their
+documents need fetched along: a few queries per chunk instead of several per
+submission. The XML of each chunk is parsed by a pool of processes while the
+next chunks are read, possibly of the next forms, and the documents are
+upserted with one unordered `bulk_write()` per chunk.
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+
+from onadata.apps.logger.models import Instance
+from onadata.apps.logger.xform_instance_parser import ParsedSubmission
+from onadata.apps.viewer.models.parsed_instance import (
+    ParsedInstance,
+    xform_instances,
+)
+from onadata.libs.utils.common_tags import ID, USERFORM_ID
+
+
+def parse_submissions(data_dictionary, rows):
+    """
+    Run by the workers of the pool, which must not query the database
+
+    :param list rows: `(pk, xml)` tuples
+    :returns: `(pk, flat dict, error)` tuples, like `Instance.get_dict()`
+    """
+    results = []
+    for pk, xml in rows:
+        try:
+            parsed = ParsedSubmission(xml).get_parser(data_dictionary)\
+                .get_flat_dict_with_attributes()
+        except Exception as e:
+            results.append((pk, None, str(e) or e.__class__.__name__))
+        else:
+            results.append((pk, parsed, None))
+    return results
+
+
+def _parsed(data_dictionary, rows):
+    future = Future()
+    future.set_result(parse_submissions(data_dictionary, rows))
+    return future
+
+
+def iter_chunks(xform, chunk_size, only_missing=False):
+    """
+    Yield the submissions of `xform` by chunks of `chunk_size`, in primary
+    key order, as lists of `Instance`s with their parsed instance, user,
+    attachments, notes and tags
+
+    :param bool only_missing: Skip submissions which are in Mongo already
+    """
+    instances = Instance.objects.filter(xform=xform).select_related(
+        'user', 'xform__user', 'parsed_instance',
+    ).prefetch_related('attachments', 'notes', 'tags').order_by('pk')
+    last_pk = 0
+    while True:
+        chunk = list(instances.filter(pk__gt=last_pk)[:chunk_size])
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+        if only_missing:
+            in_mongo = set(doc[ID] for doc in xform_instances.find(
+                {ID: {'$in': [instance.pk for instance in chunk]}},
+                {ID: 1},
+                max_time_ms=settings.MONGO_DB_MAX_TIME_MS))
+            chunk = [instance for instance in chunk
+                     if instance.pk not in in_mongo]
+            if not chunk:
+                continue
+        yield chunk
+
+
+def _get_parsed_instances(chunk, results):
+    """
+    :returns: The `ParsedInstance`s of the submissions of `chunk` which could
+        be parsed, saved if needed, and the errors of the others, by pk
+    """
+    parsed_by_pk = {}
+    errors = {}
+    for pk, parsed, error in results:
+        if error is None:
+            parsed_by_pk[pk] = parsed
+        else:
+            errors[pk] = error
+
+    new_parsed_instances = []
+    moved_parsed_instances = []
+    parsed_instances = []
+    for instance in chunk:
+        if instance.pk not in parsed_by_pk:
+            continue
+        try:
+            parsed_instance = instance.parsed_instance
+        except ParsedInstance.DoesNotExist:
+            parsed_instance = ParsedInstance(instance=instance)
+            new_parsed_instances.append(parsed_instance)
+        # The document was parsed by a worker; see `ParsedInstance.to_dict()`
+        parsed_instance._dict_cache = parsed_by_pk[instance.pk]
+        lat_lng = parsed_instance.lat, parsed_instance.lng
+        parsed_instance._set_geopoint()
+        if parsed_instance.pk is not None and \
+                (parsed_instance.lat, parsed_instance.lng) != lat_lng:
+            moved_parsed_instances.append(parsed_instance)
+        parsed_instances.append(parsed_instance)
+
+    # Like `ParsedInstance.save()`, without the Mongo write
+    if new_parsed_instances:
+        ParsedInstance.objects.bulk_create(new_parsed_instances)
+    if moved_parsed_instances:
+        ParsedInstance.objects.bulk_update(moved_parsed_instances,
+                                           ['lat', 'lng'])
+    return parsed_instances, errors
+
+
+def rebuild_mongo(xforms, only_missing=False, replace_all=False,
+                  chunk_size=500, workers=0, progress_callback=None):
+    """
+    Write the Mongo documents of the submissions of `xforms`
+
+    :param xforms: Iterable of forms
+    :param bool only_missing: Only write the documents missing from Mongo
+    :param bool replace_all: Delete the documents of each form first, e.g.
+        to get rid of those of deleted submissions
+    :param int chunk_size: Number of submissions read, parsed and written
+        at a time
+    :param int workers: Number of processes parsing XML; `0`, the default,
+        parses in this process, e.g. in Celery workers, which cannot start
+        processes. `None` uses the number of CPUs
+    :param progress_callback: Called with the statistics, as returned, after
+        each chunk
+    :returns: Statistics: `forms`, `written` documents, `errors` as a dict
+        of messages by submission pk, `elapsed` seconds and
+        `documents_per_second`
+    """
+    stats = {
+        'forms': 0,
+        'written': 0,
+        'errors': {},
+        'elapsed': 0,
+        'documents_per_second': 0,
+    }
+    if workers is None:
+        workers = os.cpu_count()
+    executor = ProcessPoolExecutor(workers) if workers else None
+    # Chunks being parsed, in order, possibly of several forms
+    pending = deque()
+    started = time.time()
+
+    def _write_oldest():
+        chunk, future = pending.popleft()
+        parsed_instances, errors = _get_parsed_instances(
+            chunk, future.result())
+        synced, write_errors = ParsedInstance.bulk_update_mongo(
+            parsed_instances)
+        errors.update(write_errors)
+        stats['written'] += len(synced)
+        stats['errors'].update(errors)
+        stats['elapsed'] = time.time() - started
+        stats['documents_per_second'] = \
+            stats['written'] / stats['elapsed'] if stats['elapsed'] else 0
+        if progress_callback:
+            progress_callback(dict(stats))
+
+    try:
+        for xform in xforms:
+            stats['forms'] += 1
+            if replace_all:
+                xform_instances.delete_many({USERFORM_ID: '{}_{}'.format(
+                    xform.user.username, xform.id_string)})
+            # Pickled along with each chunk: workers have no database access
+            data_dictionary = xform.data_dictionary()
+            for chunk in iter_chunks(xform, chunk_size,
+                                     only_missing and not replace_all):
+                rows = [(instance.pk, instance.xml) for instance in chunk]
+                pending.append((
+                    chunk,
+                    executor.submit(parse_submissions, data_dictionary, rows)
+                    if executor else _parsed(data_dictionary, rows)))
+                # Keep every worker busy while chunks get written
+                while len(pending) > max(workers, 1):
+                    _write_oldest()
+        while pending:
+            _write_oldest()
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return stats
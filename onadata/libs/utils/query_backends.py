@@ -0,0 +1,367 @@
+# coding: utf-8
+"""
+Backends of the data API, which query the submissions of a form with the
+subset of the Mongo query language it accepts: `MongoHelper.KEY_WHITELIST`
+operators, a sort on a single field and a list of fields.
+
+`MongoQueryBackend` reads the Mongo documents, as always. `PostgresQueryBackend`
+translates queries into SQL over `logger_instance.json`, which holds the same
+data, and builds documents like the Mongo ones, without reading Mongo. The
+`create_json_query_indexes` management command creates the indexes it needs.
+Choose with `DATA_QUERY_BACKEND`.
+"""
+import json
+
+from bson import json_util
+from django.conf import settings
+from django.db.models import BooleanField
+from django.db.models.expressions import RawSQL
+from django.utils.six import string_types
+
+from onadata.apps.api.mongo_helper import MongoHelper
+from onadata.apps.logger.models import Instance
+from onadata.apps.viewer.models.parsed_instance import ParsedInstance
+from onadata.libs.utils.common_tags import (
+    ATTACHMENTS,
+    ID,
+    NESTED_RESERVED_ATTRIBUTES,
+    NOTES,
+    STATUS,
+    TAGS,
+    USERFORM_ID,
+    UUID,
+    VALIDATION_STATUS,
+)
+
+# Fields of the Mongo documents which are columns of `logger_instance`
+COLUMN_FIELDS = {
+    ID: '"logger_instance"."id"',
+    UUID: '"logger_instance"."uuid"',
+    STATUS: '"logger_instance"."status"',
+}
+# Fields of the Mongo documents which are JSON columns of `logger_instance`,
+# other fields are keys of `Instance.json`
+JSON_COLUMN_FIELDS = {
+    VALIDATION_STATUS: '"logger_instance"."validation_status"',
+}
+JSON_COLUMN = '"logger_instance"."json"'
+# Fields of the Mongo documents which are not stored with submissions
+UNSUPPORTED_FIELDS = (ATTACHMENTS, NOTES, TAGS,
+                      ParsedInstance.MODIFIED_EPOCH)
+
+COMPARISON_OPERATORS = {
+    '$gt': '>',
+    '$gte': '>=',
+    '$lt': '<',
+    '$lte': '<=',
+}
+
+
+class UnsupportedQueryError(ValueError):
+    pass
+
+
+def _load(value):
+    if isinstance(value, string_types):
+        return json.loads(value, object_hook=json_util.object_hook)
+    return value
+
+
+class MongoQueryBackend:
+
+    def query(self, xform, query, fields=None, sort=None, start=0,
+              limit=ParsedInstance.DEFAULT_LIMIT, count=False):
+        """
+        :param query: JSON string or dict, including the `_userform_id` of
+            `xform`
+        :returns: A cursor of Mongo documents, or `[{'count': count}]` if
+            `count`
+        """
+        return ParsedInstance.query_mongo_minimal(
+            query=query, fields=fields, sort=sort, start=start, limit=limit,
+            count=count)
+
+
+class PostgresQueryBackend:
+
+    def query(self, xform, query, fields=None, sort=None, start=0,
+              limit=ParsedInstance.DEFAULT_LIMIT, count=False):
+        """
+        Same as `MongoQueryBackend.query()`, but `_userform_id` is ignored:
+        only submissions of `xform` are returned
+
+        :raises UnsupportedQueryError: if the query cannot be translated
+        """
+        query = dict(_load(query) or {})
+        query.pop(USERFORM_ID, None)
+        instances = Instance.objects.filter(xform=xform)
+        where, params = translate_query(query)
+        if where:
+            instances = instances.annotate(
+                matches_query=RawSQL(where, params,
+                                     output_field=BooleanField())
+            ).filter(matches_query=True)
+
+        if count:
+            return [{'count': instances.count()}]
+
+        if start < 0 or limit < 0:
+            raise ValueError("Invalid start/limit params")
+        limit = min(limit, ParsedInstance.DEFAULT_LIMIT)
+        instances = instances.order_by(
+            *get_ordering(_load(sort) or {})
+        ).select_related(
+            'user', 'xform__user', 'parsed_instance',
+        ).prefetch_related(
+            'attachments', 'notes', 'tags',
+        )[start:start + limit]
+
+        fields = _load(fields) or []
+        return [project(get_document(instance), fields)
+                for instance in instances]
+
+
+def get_document(instance):
+    """
+    :returns: The Mongo document of `instance`, built from `Instance.json`
+        instead of its XML
+    """
+    try:
+        parsed_instance = instance.parsed_instance
+    except ParsedInstance.DoesNotExist:
+        parsed_instance = ParsedInstance(instance=instance)
+    parsed_instance._dict_cache = dict(instance.json)
+    document = parsed_instance.to_dict_for_mongo()
+    # Hidden from the API; see `ParsedInstance._get_mongo_cursor()`
+    document.pop(USERFORM_ID, None)
+    document.pop(ParsedInstance.MODIFIED_EPOCH, None)
+    return document
+
+
+def project(document, fields):
+    """
+    :returns: Only `fields` of `document`, and its `_id`, like a Mongo
+        projection
+    """
+    if not fields:
+        return document
+    projected = {ID: document[ID]}
+    for field in fields:
+        path = get_path(field)
+        value = document
+        for key in path:
+            if not isinstance(value, dict) or \
+                    MongoHelper.encode(key) not in value:
+                break
+            value = value[MongoHelper.encode(key)]
+        else:
+            target = projected
+            for key in path[:-1]:
+                target = target.setdefault(key, {})
+            target[MongoHelper.encode(path[-1])] = value
+    return projected
+
+
+def get_path(field):
+    """
+    :returns: The keys to `field`: dotted names are nested keys only for
+        `NESTED_RESERVED_ATTRIBUTES`, like in `MongoHelper.to_safe_dict()`
+    """
+    for attribute in NESTED_RESERVED_ATTRIBUTES:
+        if field.startswith(attribute + '.'):
+            return field.split('.')
+    return [field]
+
+
+def get_expression(field):
+    """
+    :returns: A `(sql, params)` JSONB expression of `field`
+    """
+    if field in UNSUPPORTED_FIELDS or field == USERFORM_ID:
+        raise UnsupportedQueryError(
+            "Cannot query `{}` in PostgreSQL".format(field))
+    if field in COLUMN_FIELDS:
+        return 'to_jsonb({})'.format(COLUMN_FIELDS[field]), []
+    path = get_path(field)
+    if path[0] in JSON_COLUMN_FIELDS:
+        column, path = JSON_COLUMN_FIELDS[path[0]], path[1:]
+        if not path:
+            return '({}::jsonb)'.format(column), []
+    else:
+        column = JSON_COLUMN
+    # The same expressions as the indexes; see `create_json_query_indexes`
+    if len(path) == 1:
+        return '({}::jsonb -> %s)'.format(column), path
+    return '({}::jsonb #> %s)'.format(column), [path]
+
+
+def _dumps(value):
+    try:
+        return json.dumps(value)
+    except TypeError:
+        raise UnsupportedQueryError(
+            "Cannot compare with {!r} in PostgreSQL".format(value))
+
+
+def translate_query(query):
+    """
+    :returns: A `(sql, params)` condition of the submissions matching the
+        Mongo `query`, or `('', [])` if they all do
+    """
+    if not isinstance(query, dict):
+        raise UnsupportedQueryError("Invalid query: {!r}".format(query))
+    conditions = []
+    params = []
+    for key, value in query.items():
+        if key in ('$and', '$or'):
+            if not isinstance(value, list) or not value:
+                raise UnsupportedQueryError(
+                    "`{}` needs a non-empty list".format(key))
+            translated = [translate_query(item) for item in value]
+            conditions.append('({})'.format(
+                (' AND ' if key == '$and' else ' OR ').join(
+                    '({})'.format(sql or 'TRUE')
+                    for sql, item_params in translated)))
+            for sql, item_params in translated:
+                params.extend(item_params)
+        elif key.startswith('$'):
+            raise UnsupportedQueryError(
+                "Unsupported operator `{}`".format(key))
+        else:
+            sql, field_params = translate_field(key, value)
+            conditions.append(sql)
+            params.extend(field_params)
+    return ' AND '.join(conditions), params
+
+
+def translate_field(field, value):
+    if field == ID:
+        return translate_id(value)
+    if isinstance(value, dict) and any(key.startswith('$') for key in value):
+        return translate_operators(field, value)
+
+    expression, params = get_expression(field)
+    if value is None:
+        # Missing, or null
+        return "({0} IS NULL OR {0} = 'null'::jsonb)".format(expression), \
+            params + params
+    # Same as `expression = value`, but uses the GIN index when there is one
+    path = get_path(field)
+    if field not in COLUMN_FIELDS and path[0] not in JSON_COLUMN_FIELDS:
+        document = value
+        for key in reversed(path):
+            document = {key: document}
+        return '{}::jsonb @> %s::jsonb'.format(JSON_COLUMN), \
+            [_dumps(document)]
+    return '{} = %s::jsonb'.format(expression), params + [_dumps(value)]
+
+
+def translate_operators(field, operators):
+    expression, expression_params = get_expression(field)
+    conditions = []
+    params = []
+    options = operators.get('$options', '')
+    for operator, value in operators.items():
+        if operator == '$options':
+            continue
+        if operator == '$exists':
+            conditions.append('{} IS {}NULL'.format(
+                expression, 'NOT ' if value else ''))
+            params.extend(expression_params)
+        elif operator == '$in':
+            if not isinstance(value, list):
+                raise UnsupportedQueryError("`$in` needs a list")
+            if not value:
+                conditions.append('FALSE')
+                continue
+            conditions.append('{} IN ({})'.format(
+                expression, ', '.join(['%s::jsonb'] * len(value))))
+            params.extend(expression_params)
+            params.extend(_dumps(item) for item in value)
+        elif operator == '$all':
+            if not isinstance(value, list):
+                raise UnsupportedQueryError("`$all` needs a list")
+            conditions.append('{} @> %s::jsonb'.format(expression))
+            params.extend(expression_params)
+            params.append(_dumps(value))
+        elif operator in COMPARISON_OPERATORS:
+            # Like Mongo, only values of the same type are compared
+            conditions.append(
+                'jsonb_typeof({0}) = jsonb_typeof(%s::jsonb) AND '
+                '{0} {1} %s::jsonb'.format(
+                    expression, COMPARISON_OPERATORS[operator]))
+            params.extend(expression_params)
+            params.append(_dumps(value))
+            params.extend(expression_params)
+            params.append(_dumps(value))
+        elif operator == '$regex':
+            if not isinstance(value, string_types):
+                raise UnsupportedQueryError("`$regex` needs a string")
+            if set(options) - set('i'):
+                raise UnsupportedQueryError(
+                    "Unsupported `$options`: {}".format(options))
+            conditions.append(
+                "jsonb_typeof({0}) = 'string' AND {0} #>> '{{}}' {1} %s"
+                .format(expression, '~*' if 'i' in options else '~'))
+            params.extend(expression_params)
+            params.extend(expression_params)
+            params.append(value)
+        else:
+            raise UnsupportedQueryError(
+                "Unsupported operator `{}`".format(operator))
+    return '({})'.format(' AND '.join(conditions) or 'TRUE'), params
+
+
+def translate_id(value):
+    """
+    `_id` is the primary key: compared natively, which uses its index
+    """
+    column = COLUMN_FIELDS[ID]
+
+    def to_int(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise UnsupportedQueryError(
+                "Invalid `{}`: {!r}".format(ID, value))
+
+    if not isinstance(value, dict):
+        return '{} = %s'.format(column), [to_int(value)]
+    conditions = []
+    params = []
+    for operator, operand in value.items():
+        if operator == '$exists':
+            conditions.append('TRUE' if operand else 'FALSE')
+        elif operator == '$in':
+            conditions.append('{} = ANY(%s)'.format(column))
+            params.append([to_int(item) for item in operand])
+        elif operator in COMPARISON_OPERATORS:
+            conditions.append('{} {} %s'.format(
+                column, COMPARISON_OPERATORS[operator]))
+            params.append(to_int(operand))
+        else:
+            raise UnsupportedQueryError(
+                "Unsupported operator `{}` on `{}`".format(operator, ID))
+    return '({})'.format(' AND '.join(conditions) or 'TRUE'), params
+
+
+def get_ordering(sort):
+    """
+    :returns: `order_by()` arguments for a Mongo `sort` on a single field
+    """
+    if not isinstance(sort, dict) or len(sort) != 1:
+        # Insertion order, like Mongo without a sort
+        return ['pk']
+    field, direction = list(sort.items())[0]
+    descending = int(direction) < 0
+    if field == ID:
+        return ['-pk' if descending else 'pk']
+    expression, params = get_expression(field)
+    ordering = RawSQL(expression, params)
+    return [ordering.desc() if descending else ordering.asc(), 'pk']
+
+
+def get_query_backend():
+    if settings.DATA_QUERY_BACKEND == 'postgres':
+        return PostgresQueryBackend()
+    return MongoQueryBackend()
@@ -0,0 +1,306 @@
+# coding: utf-8
+"""
+Exports of very large forms rendered by several Celery workers.
+
+The submissions of a form are split into shards, i.e. contiguous `_id`
+ranges of `EXPORT_SHARD_SIZE` submissions. Each shard is rendered on its
+own, into a temporary file kept in the default storage, then a last step
+concatenates them into one export. See `create_sharded_export` in
+`onadata.apps.viewer.tasks`.
+"""
+import csv
+import io
+import json
+import os
+import shutil
+from collections import defaultdict
+from datetime import date, datetime
+
+from dateutil import parser
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import get_storage_class
+from django.core.files.temp import NamedTemporaryFile
+from openpyxl.workbook import Workbook
+
+from onadata.apps.logger.models import XForm
+from onadata.apps.viewer.models.export import Export
+from onadata.apps.viewer.models.parsed_instance import (
+    ParsedInstance,
+    xform_instances,
+)
+from onadata.libs.utils.common_tags import (
+    INDEX,
+    PARENT_INDEX,
+    PARENT_TABLE_NAME,
+)
+from onadata.libs.utils.export_tools import ExportBuilder, save_export
+
+
+def get_export_options(username, id_string, export_id, query=None,
+                       group_delimiter='/', split_select_multiples=True,
+                       binary_select_multiples=False):
+    """
+    Everything a shard task needs to know about the export, as a
+    JSON-serializable dict
+    """
+    return {
+        'username': username,
+        'id_string': id_string,
+        'export_id': export_id,
+        'query': query,
+        'group_delimiter': group_delimiter,
+        'split_select_multiples': split_select_multiples,
+        'binary_select_multiples': binary_select_multiples,
+    }
+
+
+def get_query(options, first_id=None, last_id=None):
+    query = ParsedInstance._get_mongo_cursor_query(
+        options['query'], options['username'], options['id_string'])
+    id_range = {}
+    if first_id is not None:
+        id_range['$gte'] = first_id
+    if last_id is not None:
+        id_range['$lte'] = last_id
+    if id_range:
+        query = {'$and': [query, {'_id': id_range}]}
+    return query
+
+
+def get_shards(options, shard_size):
+    """
+    Split the submissions to export into contiguous `_id` ranges of
+    `shard_size` submissions
+
+    :returns: A list of `[first_id, last_id]` pairs, in `_id` order
+    """
+    cursor = xform_instances.find(
+        get_query(options), {'_id': 1},
+        max_time_ms=settings.MONGO_DB_MAX_TIME_MS,
+    ).sort('_id', 1).batch_size(ParsedInstance.DEFAULT_BATCHSIZE)
+    shards = []
+    for position, record in enumerate(cursor):
+        if position % shard_size == 0:
+            shards.append([record['_id'], record['_id']])
+        else:
+            shards[-1][1] = record['_id']
+    return shards
+
+
+def get_shard_directory(options, kind='shards'):
+    return os.path.join(options['username'], 'exports', options['id_string'],
+                        kind, str(options['export_id']))
+
+
+def save_shard(options, number, extension, shard_file, kind='shards'):
+    storage = get_storage_class()()
+    file_path = os.path.join(get_shard_directory(options, kind),
+                             '{}.{}'.format(number, extension))
+    shard_file.seek(0)
+    return storage.save(file_path, File(shard_file, file_path))
+
+
+def delete_shards(options, kind='shards'):
+    """
+    Delete the temporary files left by the shards of an export
+    """
+    storage = get_storage_class()()
+    directory = get_shard_directory(options, kind)
+    try:
+        _, filenames = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        storage.delete(os.path.join(directory, filename))
+
+
+def get_xform(options):
+    return XForm.objects.get(user__username__iexact=options['username'],
+                             id_string__exact=options['id_string'])
+
+
+def get_csv_builder(options):
+    # TODO resolve circular import
+    from onadata.apps.viewer.pandas_mongo_bridge import CSVStreamingBuilder
+
+    return CSVStreamingBuilder(
+        options['username'], options['id_string'], options['query'],
+        options['group_delimiter'], options['split_select_multiples'],
+        options['binary_select_multiples'])
+
+
+def discover_csv_shard(options, first_id, last_id):
+    """
+    First pass over one shard: find its repeat columns, and the columns
+    whose integers pandas would have written as floats
+    """
+    csv_builder = get_csv_builder(options)
+    float_columns, _ = csv_builder.discover_columns(first_id, last_id)
+    return {
+        'ordered_columns': [
+            [key, columns]
+            for key, columns in csv_builder.ordered_columns.items()
+            if columns],
+        'float_columns': [sorted(chunk) for chunk in float_columns],
+    }
+
+
+def get_csv_columns(options, discoveries):
+    """
+    Merge the columns discovered by each shard, in shard order
+    """
+    csv_builder = get_csv_builder(options)
+    csv_builder.init_ordered_columns()
+    for discovery in discoveries:
+        csv_builder.merge_ordered_columns(discovery['ordered_columns'])
+    return csv_builder.get_csv_columns()
+
+
+def write_csv_shard(options, number, first_id, last_id, columns,
+                    float_columns):
+    """
+    Second pass over one shard: write its rows, without header
+    """
+    csv_builder = get_csv_builder(options)
+    with NamedTemporaryFile(mode='w+', encoding='utf-8',
+                            suffix='.csv') as shard_file:
+        csv_builder.write_rows(shard_file, columns, float_columns,
+                               first_id, last_id)
+        shard_file.flush()
+        return save_shard(options, number, 'csv', shard_file)
+
+
+def concatenate_csv_shards(options, columns, shard_paths):
+    header = io.StringIO()
+    csv.writer(header, lineterminator='\n').writerow(columns)
+
+    storage = get_storage_class()()
+    export_file = NamedTemporaryFile(suffix='.csv')
+    export_file.write(header.getvalue().encode('utf-8'))
+    for shard_path in shard_paths:
+        with storage.open(shard_path, 'rb') as shard_file:
+            shutil.copyfileobj(shard_file, export_file)
+
+    export = save_export(get_xform(options), Export.CSV_EXPORT, 'csv',
+                         export_file, options['export_id'], options['query'])
+    for shard_path in shard_paths:
+        storage.delete(shard_path)
+    return export
+
+
+def get_export_builder(options, xform):
+    export_builder = ExportBuilder()
+    export_builder.GROUP_DELIMITER = options['group_delimiter']
+    export_builder.SPLIT_SELECT_MULTIPLES = options['split_select_multiples']
+    export_builder.BINARY_SELECT_MULTIPLES = \
+        options['binary_select_multiples']
+    export_builder.set_survey(xform.data_dictionary().survey)
+    return export_builder
+
+
+def _encode_value(value):
+    # Type converters only ever return dates, see `ExportBuilder`
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+    if isinstance(value, date):
+        return {'$date': value.isoformat()}
+    return str(value)
+
+
+def _decode_value(value):
+    if '$datetime' in value:
+        return parser.parse(value['$datetime'])
+    if '$date' in value:
+        return date.fromisoformat(value['$date'])
+    return value
+
+
+def write_xls_rows(rows_file, export_builder, records, index=1,
+                   indices=None):
+    """
+    Write the rows of `records` to `rows_file` as JSON lines of
+    `[section position, values]`
+
+    :returns: The number of rows written per section
+    """
+    positions = dict((plan.name, position) for position, plan in
+                     enumerate(export_builder.section_plans))
+    counts = defaultdict(int)
+    for plan, values in export_builder.iter_xls_rows(
+            records, export_builder.get_work_sheet_titles(), index, indices):
+        rows_file.write(json.dumps([positions[plan.name], values],
+                                   default=_encode_value))
+        rows_file.write('\n')
+        counts[plan.name] += 1
+    return counts
+
+
+def write_xls_shard(options, number, first_id, last_id):
+    """
+    Write the rows of one shard to a JSON-lines file, see
+    `write_xls_rows()`. Their indices start from 1 within the shard, and are
+    shifted when shards are merged.
+
+    :returns: The path of the file and the number of rows per section
+    """
+    export_builder = get_export_builder(options, get_xform(options))
+    records = xform_instances.find(
+        get_query(options, first_id, last_id),
+        max_time_ms=settings.MONGO_DB_MAX_TIME_MS,
+    ).sort('_id', 1).batch_size(ParsedInstance.DEFAULT_BATCHSIZE)
+
+    with NamedTemporaryFile(mode='w+', encoding='utf-8',
+                            suffix='.jsonl') as shard_file:
+        counts = write_xls_rows(shard_file, export_builder, records)
+        shard_file.flush()
+        return {
+            'path': save_shard(options, number, 'jsonl', shard_file),
+            'counts': counts,
+        }
+
+
+def merge_xls_shards(options, shards):
+    """
+    Write the rows of every shard, returned by `write_xls_shard()`, into the
+    sheets of one workbook
+    """
+    xform = get_xform(options)
+    export_builder = get_export_builder(options, xform)
+    wb = Workbook(write_only=True)
+    work_sheets, work_sheet_titles = export_builder.create_work_sheets(wb)
+    section_names = dict(
+        (title, name) for name, title in work_sheet_titles.items())
+    # `EXTRA_FIELDS` are the last values of every row
+    extra_fields = export_builder.EXTRA_FIELDS
+    index_position = extra_fields.index(INDEX) - len(extra_fields)
+    parent_index_position = extra_fields.index(PARENT_INDEX) - \
+        len(extra_fields)
+    parent_table_name_position = extra_fields.index(PARENT_TABLE_NAME) - \
+        len(extra_fields)
+
+    storage = get_storage_class()()
+    # number of rows of each section in the previous shards
+    offsets = defaultdict(int)
+    for shard in shards:
+        with storage.open(shard['path'], 'rb') as shard_file:
+            for line in shard_file:
+                position, values = json.loads(
+                    line.decode('utf-8'), object_hook=_decode_value)
+                plan = export_builder.section_plans[position]
+                values[index_position] += offsets[plan.name]
+                parent_name = section_names.get(
+                    values[parent_table_name_position])
+                if parent_name is not None:
+                    values[parent_index_position] += offsets[parent_name]
+                work_sheets[plan.name].append(values)
+        for section_name, count in shard['counts'].items():
+            offsets[section_name] += count
+
+    export_file = NamedTemporaryFile(suffix='.xlsx')
+    wb.save(filename=export_file.name)
+    export = save_export(xform, Export.XLS_EXPORT, 'xlsx', export_file,
+                         options['export_id'], options['query'])
+    for shard in shards:
+        storage.delete(shard['path'])
+    return export
@@ -0,0 +1,252 @@
+# coding: utf-8
+import logging
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+class LocalCounterStore:
+    """
+    In-memory stand-in for `RedisCounterStore`, e.g. for development and
+    tests. Each process only ever flushes its own increments.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = defaultdict(int)
+        self._last_submission_times = {}
+
+    def add(self, key, count, last_submission_time=None):
+        with self._lock:
+            self._counts[key] += count
+            if last_submission_time is not None:
+                self._last_submission_times[key[0]] = last_submission_time
+
+    def pop_all(self):
+        with self._lock:
+            counts = dict(self._counts)
+            last_submission_times = self._last_submission_times
+            self._counts = defaultdict(int)
+            self._last_submission_times = {}
+        return counts, last_submission_times
+
+    def restore(self, counts, last_submission_times):
+        with self._lock:
+            for key, count in counts.items():
+                self._counts[key] += count
+            for xform_id, value in last_submission_times.items():
+                # Keep any more recent time added since `pop_all()`
+                self._last_submission_times.setdefault(xform_id, value)
+
+
+class RedisCounterStore:
+    """
+    Keeps increments in two Redis hashes shared by every process, so that any
+    of them, usually the Celery worker, can flush them.
+    """
+    COUNTS_KEY = 'kobocat:submission_counters:counts'
+    LAST_SUBMISSION_TIMES_KEY = \
+        'kobocat:submission_counters:last_submission_times'
+
+    def __init__(self, url):
+        import redis
+        self._redis = redis.Redis.from_url(url)
+
+    @staticmethod
+    def _encode_key(key):
+        xform_id, month = key
+        return '{}:{}'.format(xform_id, month.isoformat() if month else '')
+
+    @staticmethod
+    def _decode_key(field):
+        xform_id, month = field.decode().split(':')
+        return int(xform_id), parse_date(month) if month else None
+
+    def add(self, key, count, last_submission_time=None):
+        pipeline = self._redis.pipeline()
+        pipeline.hincrby(self.COUNTS_KEY, self._encode_key(key), count)
+        if last_submission_time is not None:
+            pipeline.hset(self.LAST_SUBMISSION_TIMES_KEY, key[0],
+                          last_submission_time.isoformat())
+        pipeline.execute()
+
+    def pop_all(self):
+        # Read and clear both hashes in one MULTI/EXEC transaction so that no
+        # concurrent increment is lost
+        pipeline = self._redis.pipeline()
+        pipeline.hgetall(self.COUNTS_KEY)
+        pipeline.delete(self.COUNTS_KEY)
+        pipeline.hgetall(self.LAST_SUBMISSION_TIMES_KEY)
+        pipeline.delete(self.LAST_SUBMISSION_TIMES_KEY)
+        counts, _, last_submission_times, _ = pipeline.execute()
+        return (
+            dict((self._decode_key(field), int(count))
+                 for field, count in counts.items()),
+            dict((int(xform_id), parse_datetime(value.decode()))
+                 for xform_id, value in last_submission_times.items()),
+        )
+
+    def restore(self, counts, last_submission_times):
+        pipeline = self._redis.pipeline()
+        for key, count in counts.items():
+            pipeline.hincrby(self.COUNTS_KEY, self._encode_key(key), count)
+        for xform_id, value in last_submission_times.items():
+            # Keep any more recent time added since `pop_all()`
+            pipeline.hsetnx(self.LAST_SUBMISSION_TIMES_KEY, xform_id,
+                            value.isoformat())
+        pipeline.execute()
+
+
+class SubmissionCounterBuffer:
+    """
+    Accumulates changes to the submission counters, i.e.
+    `XForm.num_of_submissions`, `XForm.last_submission_time`,
+    `UserProfile.num_of_submissions` and the monthly `SubmissionCounter`s,
+    instead of updating those hot rows for every single submission.
+
+    Increments are keyed by form and month; deletions use `None` as month,
+    since they never decrease the monthly counters. `flush()` applies them
+    with one aggregated `UPDATE` per row. It runs on a Celery beat schedule
+    and, at most every `flush_interval` seconds, after a transaction which
+    changed the counters commits.
+
+    Counters are therefore up to `flush_interval` seconds behind, and the
+    increments of a process that dies before flushing them are lost. The
+    `reconcile_submission_counters` management command recomputes everything
+    from the `Instance`s.
+    """
+
+    def __init__(self, store, flush_interval):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._last_flush = time.time()
+
+    def add(self, xform_id, count, last_submission_time=None):
+        """
+        Buffer `count` new submissions (or deletions, if negative) to
+        `xform_id` once, and only if, the current transaction commits.
+        """
+        month = date.today().replace(day=1) if count > 0 else None
+        transaction.on_commit(lambda: self._add(
+            (xform_id, month), count, last_submission_time))
+
+    def _add(self, key, count, last_submission_time):
+        # The submission is saved already: failing now would turn it into an
+        # error, and skip the commit hooks registered after this one. A
+        # failed flush puts the counts back for the next one
+        try:
+            self.store.add(key, count, last_submission_time)
+            if time.time() - self._last_flush >= self.flush_interval:
+                self.flush()
+        except Exception:
+            logging.getLogger().error(
+                'Failed to update submission counters; the '
+                '`reconcile_submission_counters` management command '
+                'recomputes them.', exc_info=True)
+
+    def flush(self):
+        """
+        Write all the buffered changes to the database. If that fails, they
+        are put back into the store for the next flush.
+
+        :returns: The number of forms whose counters were updated.
+        """
+        self._last_flush = time.time()
+        counts, last_submission_times = self.store.pop_all()
+        if not counts:
+            return 0
+
+        try:
+            return self._write(counts, last_submission_times)
+        except Exception:
+            self.store.restore(counts, last_submission_times)
+            raise
+
+    @staticmethod
+    def _write(counts, last_submission_times):
+        # Avoid circular imports
+        from onadata.apps.logger.models import XForm
+        from onadata.apps.logger.models.submission_counter import \
+            SubmissionCounter
+
+        xform_counts = defaultdict(int)
+        monthly_counts = defaultdict(int)
+        xforms_with_deletions = set()
+        for (xform_id, month), count in counts.items():
+            xform_counts[xform_id] += count
+            if month is None:
+                xforms_with_deletions.add(xform_id)
+            else:
+                monthly_counts[(xform_id, month)] += count
+
+        user_ids = dict(XForm.objects.filter(
+            pk__in=xform_counts).values_list('pk', 'user_id'))
+        user_counts = defaultdict(int)
+        user_monthly_counts = defaultdict(int)
+        for xform_id, count in xform_counts.items():
+            if xform_id in user_ids:
+                user_counts[user_ids[xform_id]] += count
+        for (xform_id, month), count in monthly_counts.items():
+            if xform_id in user_ids:
+                user_monthly_counts[(user_ids[xform_id], month)] += count
+
+        # Hack to avoid circular imports
+        UserProfile = User.profile.related.related_model
+        # Rows are always locked in the same order, so that concurrent
+        # flushes cannot deadlock
+        with transaction.atomic():
+            for xform_id, count in sorted(xform_counts.items()):
+                fields = {
+                    'num_of_submissions': Greatest(
+                        F('num_of_submissions') + count, 0),
+                }
+                if xform_id in last_submission_times:
+                    fields['last_submission_time'] = \
+                        last_submission_times[xform_id]
+                if xform_id in xforms_with_deletions:
+                    # Like `update_xform_submission_count_delete()`, update
+                    # `date_modified` to detect outdated exports
+                    fields['date_modified'] = timezone.now()
+                XForm.objects.filter(pk=xform_id).update(**fields)
+
+            for user_id, count in sorted(user_counts.items()):
+                updated = UserProfile.objects.filter(user_id=user_id).update(
+                    num_of_submissions=Greatest(
+                        F('num_of_submissions') + count, 0),
+                )
+                if not updated:
+                    UserProfile.objects.create(
+                        user_id=user_id, num_of_submissions=max(count, 0))
+
+            for (user_id, month), count in sorted(
+                    user_monthly_counts.items()):
+                updated = SubmissionCounter.objects.filter(
+                    user_id=user_id, timestamp=month
+                ).update(count=F('count') + count)
+                if not updated:
+                    # Bypass `SubmissionCounter.save()`, which would move
+                    # `timestamp` to the current month
+                    SubmissionCounter.objects.bulk_create([
+                        SubmissionCounter(user_id=user_id, timestamp=month,
+                                          count=count)])
+
+        return len(xform_counts)
+
+
+def _get_store():
+    if settings.SUBMISSION_COUNTER_BUFFER_REDIS_URL:
+        return RedisCounterStore(settings.SUBMISSION_COUNTER_BUFFER_REDIS_URL)
+    return LocalCounterStore()
+
+
+submission_counter_buffer = SubmissionCounterBuffer(
+    _get_store(), settings.SUBMISSION_COUNTER_BUFFER_FLUSH_INTERVAL)
@@ -1,11 +1,15 @@
 # coding: utf-8
 import os
 import json
+import shutil
+import time
 import traceback
 import requests
 import zipfile
 
-from tempfile import NamedTemporaryFile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 from xml.dom import minidom
 
 from django.conf import settings
@@ -19,6 +23,13 @@ from onadata.libs.utils import common_tags
 
 SLASH = "/"
 
+# Attachments are copied to ZIP archives by chunks of this many bytes, and
+# prefetched in memory up to this size; larger ones are spooled to disk
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024
+ATTACHMENT_SPOOL_SIZE = 8 * ATTACHMENT_CHUNK_SIZE
+# seconds between two calls to the progress callback of ZIP exports
+ZIP_PROGRESS_INTERVAL = 1
+
 
 class MyError(Exception):
     pass
@@ -224,7 +235,14 @@ def enketo_url(form_url, id_string, instance_xml=None,
     return False
 
 
-def create_attachments_zipfile(attachments, output_file=None):
+def create_attachments_zipfile(attachments, output_file=None,
+                               progress_callback=None):
+    """
+    Write `attachments` to a ZIP archive
+
+    :param progress_callback: Called with the number of attachments done so
+        far, about every `ZIP_PROGRESS_INTERVAL` seconds and at the end
+    """
     if not output_file:
         output_file = NamedTemporaryFile()
     else:
@@ -239,19 +257,105 @@ def create_attachments_zipfile(attachments, output_file=None):
             )
         output_file.seek = no_seeking
 
+    progress = _ZipProgress(progress_callback)
     storage = get_storage_class()()
     with zipfile.ZipFile(output_file, 'w', zipfile.ZIP_STORED, allowZip64=True) as zip_file:
-        for attachment in attachments:
-            if storage.exists(attachment.media_file.name):
-                try:
-                    with storage.open(attachment.media_file.name, 'rb') as source_file:
-                        zip_file.writestr(attachment.media_file.name, source_file.read())
-                except Exception as e:
-                    report_exception("Error adding file \"{}\" to archive.".format(attachment.media_file.name), e)
+        if settings.ATTACHMENTS_ZIP_ENGINE == 'streaming':
+            _write_attachments_streaming(
+                zip_file, storage, attachments, progress)
+        else:
+            for attachment in attachments:
+                if storage.exists(attachment.media_file.name):
+                    try:
+                        with storage.open(attachment.media_file.name, 'rb') as source_file:
+                            zip_file.writestr(attachment.media_file.name, source_file.read())
+                    except Exception as e:
+                        report_exception("Error adding file \"{}\" to archive.".format(attachment.media_file.name), e)
+                progress.advance()
+    progress.report()
 
     return output_file
 
 
+class _ZipProgress:
+    def __init__(self, callback):
+        self.callback = callback
+        self.done = 0
+        self.reported = time.time()
+
+    def advance(self):
+        self.done += 1
+        if time.time() - self.reported >= ZIP_PROGRESS_INTERVAL:
+            self.report()
+
+    def report(self):
+        if self.callback:
+            self.callback(self.done)
+        self.reported = time.time()
+
+
+def _prefetch_attachment(storage, name):
+    """
+    Copy an attachment from the storage to a temporary file, in memory
+    unless it is large
+    """
+    spooled_file = SpooledTemporaryFile(max_size=ATTACHMENT_SPOOL_SIZE)
+    try:
+        with storage.open(name, 'rb') as source_file:
+            shutil.copyfileobj(source_file, spooled_file,
+                               ATTACHMENT_CHUNK_SIZE)
+    except Exception:
+        spooled_file.close()
+        raise
+    spooled_file.seek(0)
+    return spooled_file
+
+
+def _write_attachments_streaming(zip_file, storage, attachments, progress):
+    """
+    Copy `attachments` to `zip_file` chunk by chunk, while a pool of
+    `ATTACHMENTS_ZIP_PREFETCH` threads fetches the next ones from the
+    storage.
+
+    `media_file_size` is only ever set once the file is stored, so the
+    `exists()` round trip is skipped for the attachments which have it.
+    """
+    prefetch = max(settings.ATTACHMENTS_ZIP_PREFETCH, 1)
+    # `(name, future)` of the attachments being fetched, in archive order
+    pending = deque()
+
+    def _write_next():
+        name, future = pending.popleft()
+        try:
+            with future.result() as source_file:
+                zip_info = zipfile.ZipInfo(name, time.localtime()[:6])
+                # lets `zipfile` decide whether the member needs ZIP64
+                source_file.seek(0, os.SEEK_END)
+                zip_info.file_size = source_file.tell()
+                source_file.seek(0)
+                with zip_file.open(zip_info, 'w') as member:
+                    shutil.copyfileobj(source_file, member,
+                                       ATTACHMENT_CHUNK_SIZE)
+        except Exception as e:
+            report_exception(
+                "Error adding file \"{}\" to archive.".format(name), e)
+        progress.advance()
+
+    with ThreadPoolExecutor(max_workers=prefetch) as executor:
+        for attachment in attachments:
+            name = attachment.media_file.name
+            if attachment.media_file_size is None and \
+                    not storage.exists(name):
+                progress.advance()
+                continue
+            pending.append((name, executor.submit(
+                _prefetch_attachment, storage, name)))
+            if len(pending) > prefetch:
+                _write_next()
+        while pending:
+            _write_next()
+
+
 def _get_form_url(username):
     if settings.TESTING_MODE:
         http_host = 'http://{}'.format(settings.TEST_HTTP_HOST)
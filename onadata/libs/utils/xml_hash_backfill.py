@@ -0,0 +1,199 @@
+# coding: utf-8
+"""
+Backfill of `Instance.xml_hash` for large tables.
+
+Until every submission has a hash, duplicate detection in `create_instance()`
+falls back to comparing whole XML documents. `logger_instance` is walked by
+ranges of primary keys; the XML of each range is hashed by a pool of
+processes while the next ranges are read, and the hashes are written back
+with one `UPDATE ... FROM (VALUES ...)` per batch.
+
+The backfill can be interrupted at any time: only submissions without a hash
+are considered, and the primary key to start from next time may be saved to a
+checkpoint file after each range.
+"""
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.db import connection
+from django.db.models import Max, Min
+
+from onadata.apps.logger.models import Instance
+
+UPDATE_SQL = (
+    'UPDATE {table} AS instance SET xml_hash = v.xml_hash '
+    'FROM (VALUES {values}) AS v (id, xml_hash) '
+    'WHERE instance.id = v.id'
+)
+
+
+def hash_xmls(rows):
+    """
+    Run by the workers of the pool
+
+    :param list rows: `(pk, xml)` tuples
+    :returns: `(pk, xml_hash)` tuples
+    """
+    return [(pk, Instance.get_hash(xml)) for pk, xml in rows]
+
+
+def get_pk_bounds(repopulate=False):
+    queryset = Instance.objects.all()
+    if not repopulate:
+        queryset = queryset.filter(xml_hash=Instance.DEFAULT_XML_HASH)
+    bounds = queryset.aggregate(first=Min('pk'), last=Max('pk'))
+    return bounds['first'], bounds['last']
+
+
+def fetch_range(start, stop, repopulate=False):
+    """
+    :returns: The `(pk, xml)` of the submissions whose pk is in
+        `[start, stop)` and, unless `repopulate`, which have no hash
+    """
+    queryset = Instance.objects.filter(pk__gte=start, pk__lt=stop)
+    if not repopulate:
+        queryset = queryset.filter(xml_hash=Instance.DEFAULT_XML_HASH)
+    return list(queryset.order_by().values_list('pk', 'xml'))
+
+
+def write_hashes(hashes, batch_size, repopulate=False):
+    """
+    Write `(pk, xml_hash)` tuples back, without going through `save()` and
+    its signals
+
+    :returns: The number of submissions updated
+    """
+    updated = 0
+    with connection.cursor() as cursor:
+        for offset in range(0, len(hashes), batch_size):
+            batch = hashes[offset:offset + batch_size]
+            sql = UPDATE_SQL.format(
+                table=Instance._meta.db_table,
+                values=', '.join(['(%s, %s)'] * len(batch)))
+            if not repopulate:
+                # Submissions saved meanwhile were hashed by `save()`
+                sql += ' AND instance.xml_hash IS NULL'
+            cursor.execute(sql, [value for row in batch for value in row])
+            updated += cursor.rowcount
+    return updated
+
+
+def read_checkpoint(checkpoint_file):
+    if not checkpoint_file or not os.path.exists(checkpoint_file):
+        return None
+    with open(checkpoint_file) as f:
+        return json.load(f)['next_pk']
+
+
+def write_checkpoint(checkpoint_file, next_pk):
+    # Written aside then renamed, so that an interruption never leaves a
+    # truncated file behind
+    temp_file = checkpoint_file + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump({'next_pk': next_pk}, f)
+    os.replace(temp_file, checkpoint_file)
+
+
+def _hashed(rows):
+    future = Future()
+    future.set_result(hash_xmls(rows))
+    return future
+
+
+def backfill_xml_hashes(start_pk=None, end_pk=None, range_size=5000,
+                        batch_size=1000, workers=None,
+                        max_rows_per_second=None, repopulate=False,
+                        checkpoint_file=None, progress_callback=None):
+    """
+    Populate `Instance.xml_hash`
+
+    :param int start_pk: First pk to consider. Defaults to the checkpoint, if
+        any, or the lowest pk of the submissions without a hash
+    :param int end_pk: Last pk to consider. Defaults to the highest pk of the
+        submissions without a hash
+    :param int range_size: Number of primary keys read per query
+    :param int batch_size: Number of submissions updated per query
+    :param int workers: Number of processes hashing XML; `0` hashes in this
+        process. Defaults to the number of CPUs
+    :param int max_rows_per_second: Throttle the backfill to this many
+        submissions per second, e.g. to spare a production database
+    :param bool repopulate: Recalculate existing hashes too
+    :param str checkpoint_file: Path of a file where the pk to resume from is
+        saved after each range, and read from on start
+    :param progress_callback: Called with the statistics, as returned, after
+        each range
+    :returns: Statistics: `rows_hashed`, `rows_updated`, `next_pk`,
+        `end_pk`, `elapsed` seconds, `rows_per_second` and `eta` seconds
+    """
+    first_pk, last_pk = get_pk_bounds(repopulate)
+    if start_pk is None:
+        start_pk = read_checkpoint(checkpoint_file) or first_pk
+    if end_pk is None:
+        end_pk = last_pk
+
+    stats = {
+        'rows_hashed': 0,
+        'rows_updated': 0,
+        'next_pk': start_pk,
+        'end_pk': end_pk,
+        'elapsed': 0,
+        'rows_per_second': 0,
+        'eta': 0,
+    }
+    if start_pk is None or end_pk is None or start_pk > end_pk:
+        return stats
+
+    if workers is None:
+        workers = os.cpu_count()
+    executor = ProcessPoolExecutor(workers) if workers else None
+    # Ranges read and being hashed, in order, so that the checkpoint is
+    # always the end of the ranges written so far
+    pending = deque()
+    started = time.time()
+
+    def _write_oldest():
+        stop, future = pending.popleft()
+        hashes = future.result()
+        stats['rows_updated'] += write_hashes(hashes, batch_size, repopulate)
+        stats['rows_hashed'] += len(hashes)
+        stats['next_pk'] = stop
+        if checkpoint_file:
+            write_checkpoint(checkpoint_file, stop)
+
+        elapsed = time.time() - started
+        if max_rows_per_second:
+            # Sleep until the rate is back under the limit
+            throttled = stats['rows_hashed'] / float(max_rows_per_second)
+            if throttled > elapsed:
+                time.sleep(throttled - elapsed)
+                elapsed = throttled
+        stats['elapsed'] = elapsed
+        stats['rows_per_second'] = stats['rows_hashed'] / elapsed \
+            if elapsed else 0
+        done = stop - start_pk
+        remaining = max(end_pk + 1 - stop, 0)
+        stats['eta'] = elapsed * remaining / done
+        if progress_callback:
+            progress_callback(dict(stats))
+
+    try:
+        for start in range(start_pk, end_pk + 1, range_size):
+            stop = min(start + range_size, end_pk + 1)
+            rows = fetch_range(start, stop, repopulate)
+            pending.append((
+                stop,
+                executor.submit(hash_xmls, rows) if executor
+                else _hashed(rows)))
+            # Keep every worker busy while ranges get written
+            while len(pending) > max(workers, 1):
+                _write_oldest()
+        while pending:
+            _write_oldest()
+    finally:
+        if executor:
+            executor.shutdown()
+
+    return stats
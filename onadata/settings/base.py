@@ -10,6 +10,8 @@ import dj_database_url
 from django.core.exceptions import SuspiciousOperation
 from pymongo import MongoClient
 
+from onadata.libs.utils.mongo_indexes import SlowQueryListener
+
 
 def skip_suspicious_operations(record):
     """Prevent django from sending 500 error
@@ -479,6 +481,11 @@ THUMB_CONF = {
 }
 # order of thumbnails from largest to smallest
 THUMB_ORDER = ['large', 'medium', 'small']
+# Thumbnails still pending after this many minutes, e.g. because the worker
+# creating them died, are queued again by `image_url()` and the
+# `create_image_thumbnails` management command
+THUMBNAILS_PENDING_TIMEOUT = int(os.environ.get(
+    'KOBOCAT_THUMBNAILS_PENDING_TIMEOUT', 10))
 
 # Number of times Celery retries to send data to external rest service
 REST_SERVICE_MAX_RETRIES = 3
@@ -510,6 +517,110 @@ BINARY_SELECT_MULTIPLES = False
 # Use 'n/a' for empty values by default on csv exports
 NA_REP = 'n/a'
 
+# Engine used by `XFormInstanceParser` to read submissions: 'minidom' builds a
+# full DOM, while 'iterparse' streams lxml events and keeps no tree in memory
+XFORM_INSTANCE_PARSER_ENGINE = os.environ.get(
+    'KOBOCAT_XFORM_INSTANCE_PARSER_ENGINE', 'minidom')
+
+# Engine used for flat CSV exports: 'pandas' builds a DataFrame for every 30k
+# submissions, while 'streaming' writes each row as soon as it is read and
+# keeps memory use constant; both produce the same file
+CSV_EXPORT_ENGINE = os.environ.get('KOBOCAT_CSV_EXPORT_ENGINE', 'pandas')
+
+# CSV and XLSX exports of forms with at least this many submissions are split
+# into shards of `EXPORT_SHARD_SIZE` submissions, rendered in parallel by
+# several Celery workers; 0 disables sharding. A multiple of 30000 keeps
+# sharded CSV files identical to the other engines
+SHARDED_EXPORT_MIN_SUBMISSIONS = int(os.environ.get(
+    'KOBOCAT_SHARDED_EXPORT_MIN_SUBMISSIONS', 0))
+EXPORT_SHARD_SIZE = int(os.environ.get('KOBOCAT_EXPORT_SHARD_SIZE', 30000))
+
+# CSV and XLSX export tasks save a checkpoint every `EXPORT_CHECKPOINT_ROWS`
+# submissions, and resume from it when retried after hitting their soft time
+# limit or losing their worker; 0 disables checkpoints
+EXPORT_CHECKPOINT_ROWS = int(os.environ.get(
+    'KOBOCAT_EXPORT_CHECKPOINT_ROWS', 0))
+# With checkpoints, an export task is given up after `EXPORT_MAX_ATTEMPTS`
+# runs, counting retries and redeliveries after its worker died
+EXPORT_MAX_ATTEMPTS = int(os.environ.get('KOBOCAT_EXPORT_MAX_ATTEMPTS', 5))
+
+# When enabled, a new unfiltered CSV export copies the latest one and appends
+# only the submissions received since; it is rebuilt from scratch when older
+# submissions were edited or deleted, or when new repeat columns show up
+CSV_EXPORT_INCREMENTAL = os.environ.get(
+    'KOBOCAT_CSV_EXPORT_INCREMENTAL', 'False') == 'True'
+
+# Filtered exports are cached for `EXPORT_CACHE_TTL` seconds (0 disables the
+# cache), within a budget of `EXPORT_CACHE_MAX_SIZE` bytes of files. Requests
+# for an export being generated by another request wait for it up to
+# `EXPORT_CACHE_WAIT_TIMEOUT` seconds; see `onadata.libs.utils.export_cache`
+EXPORT_CACHE_TTL = int(os.environ.get('KOBOCAT_EXPORT_CACHE_TTL', 3600))
+EXPORT_CACHE_MAX_SIZE = int(os.environ.get(
+    'KOBOCAT_EXPORT_CACHE_MAX_SIZE', 1024 * 1024 * 1024))
+EXPORT_CACHE_WAIT_TIMEOUT = int(os.environ.get(
+    'KOBOCAT_EXPORT_CACHE_WAIT_TIMEOUT', 120))
+
+# Engine used for attachment ZIP exports: 'legacy' reads each attachment
+# whole, one at a time, while 'streaming' copies them by chunks and fetches
+# the next `ATTACHMENTS_ZIP_PREFETCH` ones concurrently
+ATTACHMENTS_ZIP_ENGINE = os.environ.get(
+    'KOBOCAT_ATTACHMENTS_ZIP_ENGINE', 'legacy')
+ATTACHMENTS_ZIP_PREFETCH = int(os.environ.get(
+    'KOBOCAT_ATTACHMENTS_ZIP_PREFETCH', 4))
+
+# Attachments found by the media redirector, and the forms they belong to,
+# are cached by each process: at most this many entries, for this many
+# seconds. Either set to 0 disables the cache
+ATTACHMENT_LOOKUP_CACHE_MAX_SIZE = int(os.environ.get(
+    'KOBOCAT_ATTACHMENT_LOOKUP_CACHE_MAX_SIZE', 10000))
+ATTACHMENT_LOOKUP_CACHE_TTL = int(os.environ.get(
+    'KOBOCAT_ATTACHMENT_LOOKUP_CACHE_TTL', 60))
+# Whether the media redirector still looks for attachments whose owner and
+# file name are not populated, with a query scanning the whole attachment
+# table. Can be disabled once `populate_media_file_basename` has run
+ATTACHMENT_LOOKUP_LEGACY_FALLBACK = os.environ.get(
+    'KOBOCAT_ATTACHMENT_LOOKUP_LEGACY_FALLBACK', 'True') == 'True'
+
+# Maximum number of compiled forms (pyxform survey plus derived xpath maps)
+# each process keeps in memory
+COMPILED_FORM_CACHE_MAX_SIZE = int(os.environ.get(
+    'KOBOCAT_COMPILED_FORM_CACHE_MAX_SIZE', 100))
+
+# Maximum number of form statistics (see `onadata.libs.data.statistics`) each
+# process keeps in memory until the submissions of their form change; 0
+# disables the cache
+FORM_STATISTICS_CACHE_MAX_SIZE = int(os.environ.get(
+    'KOBOCAT_FORM_STATISTICS_CACHE_MAX_SIZE', 1000))
+
+# Number of submissions from a bulk-submission ZIP file that are saved
+# together; see `logger_tools.create_instances()`
+BULK_SUBMISSION_BATCH_SIZE = int(os.environ.get(
+    'KOBOCAT_BULK_SUBMISSION_BATCH_SIZE', 100))
+
+# When enabled, submission counters (`XForm.num_of_submissions`,
+# `UserProfile.num_of_submissions` and the monthly `SubmissionCounter`s) are
+# not updated for every submission; increments are buffered, in Redis if
+# `SUBMISSION_COUNTER_BUFFER_REDIS_URL` is set, otherwise in memory, and
+# flushed every `SUBMISSION_COUNTER_BUFFER_FLUSH_INTERVAL` seconds
+SUBMISSION_COUNTER_BUFFER_ENABLED = os.environ.get(
+    'KOBOCAT_SUBMISSION_COUNTER_BUFFER_ENABLED', 'False') == 'True'
+SUBMISSION_COUNTER_BUFFER_REDIS_URL = os.environ.get(
+    'KOBOCAT_SUBMISSION_COUNTER_BUFFER_REDIS_URL')
+SUBMISSION_COUNTER_BUFFER_FLUSH_INTERVAL = int(os.environ.get(
+    'KOBOCAT_SUBMISSION_COUNTER_BUFFER_FLUSH_INTERVAL', 10))
+
+# When enabled, a Bloom filter of each user's submissions lets
+# `create_instance()` skip the duplicate query for submissions which were
+# certainly never seen before. Filters are kept in Redis if
+# `DUPLICATE_FILTER_REDIS_URL` is set, otherwise in memory, which is only
+# correct with a single process; see `onadata.libs.utils.duplicate_filter`
+DUPLICATE_FILTER_ENABLED = os.environ.get(
+    'KOBOCAT_DUPLICATE_FILTER_ENABLED', 'False') == 'True'
+DUPLICATE_FILTER_REDIS_URL = os.environ.get(
+    'KOBOCAT_DUPLICATE_FILTER_REDIS_URL')
+DUPLICATE_FILTER_FALSE_POSITIVE_RATE = float(os.environ.get(
+    'KOBOCAT_DUPLICATE_FILTER_FALSE_POSITIVE_RATE', 0.01))
+
 SUPPORTED_MEDIA_UPLOAD_TYPES = [
     'image/jpeg',
     'image/png',
@@ -602,6 +713,24 @@ CELERY_BEAT_SCHEDULE = {
         'schedule': timedelta(hours=6),
         'options': {'queue': 'kobocat_queue'}
     },
+    # See `SubmissionCounterBuffer`
+    'flush-submission-counters': {
+        'task': 'onadata.apps.logger.tasks.flush_submission_counters',
+        'schedule': timedelta(seconds=SUBMISSION_COUNTER_BUFFER_FLUSH_INTERVAL),
+        'options': {'queue': 'kobocat_queue'}
+    },
+    # Retry Mongo writes which failed; see `MongoOutboxEntry`
+    'drain-mongo-outbox': {
+        'task': 'onadata.apps.viewer.tasks.drain_mongo_outbox',
+        'schedule': timedelta(minutes=1),
+        'options': {'queue': 'kobocat_queue'}
+    },
+    # Delete expired filtered exports; see `onadata.libs.utils.export_cache`
+    'evict-export-cache': {
+        'task': 'onadata.apps.viewer.tasks.evict_export_cache',
+        'schedule': timedelta(minutes=15),
+        'options': {'queue': 'kobocat_queue'}
+    },
 }
 
 CELERY_TASK_DEFAULT_QUEUE = "kobocat_queue"
@@ -668,13 +797,37 @@ else:
 # PyMongo 3 does acknowledged writes by default
 # https://emptysqua.re/blog/pymongos-new-default-safe-writes/
 MONGO_CONNECTION = MongoClient(
-    MONGO_CONNECTION_URL, j=True, tz_aware=True)
+    MONGO_CONNECTION_URL, j=True, tz_aware=True,
+    event_listeners=[SlowQueryListener()])
 
 MONGO_DB = MONGO_CONNECTION[MONGO_DATABASE['NAME']]
 
 # Timeout for Mongo, must be, at least, as long as Celery timeout.
 MONGO_DB_MAX_TIME_MS = CELERY_TASK_TIME_LIMIT * 1000
 
+# When enabled, submissions are not written to Mongo while they are received:
+# their ids are recorded in an outbox table instead, which Celery workers (or
+# the `drain_mongo_outbox` management command) write to Mongo in batches
+MONGO_OUTBOX_ENABLED = os.environ.get(
+    'KOBOCAT_MONGO_OUTBOX_ENABLED', 'False') == 'True'
+MONGO_OUTBOX_BATCH_SIZE = int(os.environ.get(
+    'KOBOCAT_MONGO_OUTBOX_BATCH_SIZE', 500))
+
+# Queries on the submissions and audit logs which take longer than this many
+# milliseconds are logged with the plan Mongo chose for them, to find those
+# which need an index; `0` disables it
+MONGO_SLOW_QUERY_MS = int(os.environ.get('KOBOCAT_MONGO_SLOW_QUERY_MS', 0))
+
+# Backend of the data API: `mongo`, or `postgres` to query the submissions
+# stored in PostgreSQL instead of their Mongo documents; see
+# `onadata.libs.utils.query_backends`
+DATA_QUERY_BACKEND = os.environ.get('KOBOCAT_DATA_QUERY_BACKEND', 'mongo')
+
+# Create the missing declared Mongo indexes when starting, instead of only
+# warning about them; see the `ensure_mongo_indexes` management command
+MONGO_ENSURE_INDEXES_ON_STARTUP = os.environ.get(
+    'KOBOCAT_MONGO_ENSURE_INDEXES_ON_STARTUP', 'False') == 'True'
+
 
 ################################
 # Sentry settings              #